@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+"""
+Localizzazione batch senza GUI.
+
+    python batch_localize.py --ply cloud.ply --vis visibility.txt \\
+        --ref ref1.jpg [--ref ref2.jpg ...] --targets "photos/*.jpg" \\
+        --matcher LightGlue --workers 4 --out output/batch.jsonl
+
+Per ogni target esegue matching + pose estimation (pose_pipeline)
+contro ogni reference e tiene il risultato con più inlier. I target sono
+distribuiti su un pool di processi; ogni processo carica progetto e
+modello una sola volta. Ogni target produce una riga JSONL (parametri,
+inlier, tempi per fase, errore) e, con --npz-dir, un .npz con i match.
+Rilanciando lo stesso comando si riprende dai target non ancora scritti.
+Se un target fa terminare il processo del worker, i target rimasti si
+elaborano uno alla volta in un worker dedicato: quello che lo fa cadere
+di nuovo viene registrato come fallito e non blocca la ripresa.
+Con --index (retrieval_index.py) le reference di ogni target vengono
+scelte dall'indice di retrieval invece che (o oltre che) da --ref.
+"""
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+import traceback
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG')
+
+# stato per processo, inizializzato da _init_worker
+_project = None
+_index = None
+_args = None
+
+
+def list_targets(spec):
+    """Cartella (immagini al suo interno) o pattern glob, in ordine."""
+    if os.path.isdir(spec):
+        paths = [os.path.join(spec, f) for f in os.listdir(spec) if f.endswith(IMAGE_EXTS)]
+    else:
+        paths = glob.glob(spec)
+    return sorted(os.path.abspath(p) for p in paths)
+
+
+def load_done(out_file, retry_failed=False):
+    """Target già presenti nel file JSONL (per riprendere dopo un crash)."""
+    done = set()
+    if not os.path.exists(out_file):
+        return done
+    with open(out_file, 'r') as f:
+        for line in f:
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue   # riga troncata da un crash
+            if rec.get('ok') or not retry_failed:
+                done.add(rec['target'])
+    return done
+
+
+def _ensure_newline(out_file):
+    """Chiude con un a capo l'ultima riga se un crash l'ha lasciata troncata."""
+    if not os.path.exists(out_file) or os.path.getsize(out_file) == 0:
+        return
+    with open(out_file, 'rb+') as f:
+        f.seek(-1, os.SEEK_END)
+        if f.read(1) != b'\n':
+            f.write(b'\n')
+
+
+def npz_name(target):
+    """Nome del .npz di un target, unico per percorso (a/img.jpg ≠ b/img.jpg)."""
+    stem = os.path.splitext(os.path.basename(target))[0]
+    return f"{stem}-{hashlib.sha1(target.encode('utf-8')).hexdigest()[:8]}.npz"
+
+
+def _prepare(args):
+    """
+    Costruisce nel processo principale, una volta, archivio di visibilità,
+    cache del .ply e indici di associazione delle reference: i worker
+    li trovano pronti e si limitano ad aprirli.
+    """
+    import pose_pipeline
+    proj = pose_pipeline.project.ZephyrProject(args['ply'], args['vis'])
+    names = []
+    for ref in args['refs']:
+        name = os.path.basename(ref)
+        if name not in proj.store:
+            continue
+        names.append(name)
+        if args['covisible']:
+            names += [n for n, _ in proj.covisible(name)[:args['covisible']]]
+    for name in dict.fromkeys(names):
+        proj.camera(name)
+
+
+def _init_worker(args):
+    global _project, _index, _args
+    import pose_pipeline
+    import matcher_registry
+    _args = args
+    _project = pose_pipeline.project.ZephyrProject(args['ply'], args['vis'])
+    if args['index']:
+        import retrieval_index
+        _index = retrieval_index.RetrievalIndex(args['index'])
+    try:
+        matcher_registry.warmup(args['matcher'])
+    except Exception as e:  # l'errore verrà riportato nel record di ogni target
+        print(f"[Batch] warm-up {args['matcher']} non riuscito: {e}")
+
+
+def _localize(target):
+    import pose_pipeline
+    t0 = time.perf_counter()
+    rec = {'target': target, 'ok': False}
+    best = None
+    errors = {}
+    refs = _args['refs']
+    if _index is not None:
+        try:
+            hits = _index.search_image(target, k=_args['top_k'])
+        except Exception as e:
+            hits = []
+            errors['retrieval'] = f"{type(e).__name__}: {e}"
+        rec['retrieved'] = hits
+        refs = refs + [path for path, _ in hits if path not in refs]
+    for ref in refs:
+        try:
+            if _args['covisible']:
+                res = pose_pipeline.estimate_pose_multi(ref, target, _project, matcher=_args['matcher'],
+                                                        covisible=_args['covisible'],
+                                                        max_width=_args['max_width'])
+            else:
+                res = pose_pipeline.estimate_pose(ref, target, _project, matcher=_args['matcher'],
+                                                  max_width=_args['max_width'])
+        except Exception as e:
+            errors[os.path.basename(ref)] = f"{type(e).__name__}: {e}"
+            continue
+        if best is None or res.num_inliers > best[1].num_inliers:
+            best = (ref, res)
+
+    if best is not None:
+        ref, res = best
+        rec.update({'ok': True, 'ref': ref, 'params': res.params, 'refs': res.refs,
+                    'inliers': res.num_inliers, 'matches': int(len(res.kp_ref)),
+                    'timings': res.timings})
+        if _args['npz_dir']:
+            # inliers ha una voce per match, allineata a kp_ref/kp_tgt/conf
+            path = os.path.join(_args['npz_dir'], npz_name(target))
+            np.savez(path, kp_ref=res.kp_ref, kp_tgt=res.kp_tgt, conf=res.conf,
+                     inliers=res.inliers, G=res.G, K=res.K)
+            rec['npz'] = path
+    if errors:
+        rec['errors'] = errors
+    rec['elapsed_s'] = time.perf_counter() - t0
+    return rec
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Localizzazione batch di immagini target su un progetto Zephyr")
+    parser.add_argument('--ply', required=True, help="point cloud .ply di Zephyr")
+    parser.add_argument('--vis', required=True, help="file di visibilità di Zephyr")
+    parser.add_argument('--ref', action='append', default=[],
+                        help="immagine di riferimento (ripetibile)")
+    parser.add_argument('--index', default=None,
+                        help="indice di retrieval (retrieval_index.py): sceglie le reference per target")
+    parser.add_argument('--top-k', type=int, default=3,
+                        help="reference scelte dall'indice per ogni target")
+    parser.add_argument('--targets', required=True, help="cartella o pattern glob dei target")
+    parser.add_argument('--matcher', default='LightGlue', help="OmniGlue, LiftFeat o LightGlue")
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--max-width', type=int, default=800)
+    parser.add_argument('--covisible', type=int, default=0,
+                        help="aggiunge a ogni reference le N camere più co-visibili")
+    parser.add_argument('--out', default=os.path.join('output', 'batch.jsonl'))
+    parser.add_argument('--npz-dir', default=None, help="salva anche i match per target (.npz)")
+    parser.add_argument('--retry-failed', action='store_true', help="riprova i target falliti")
+    args = parser.parse_args()
+    if not args.ref and not args.index:
+        parser.error("serve almeno una --ref o un --index")
+
+    targets = list_targets(args.targets)
+    done = load_done(args.out, args.retry_failed)
+    todo = [t for t in targets if t not in done]
+    print(f"[Batch] {len(targets)} target, {len(done)} già fatti, {len(todo)} da elaborare")
+    if not todo:
+        return
+
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    if args.npz_dir:
+        os.makedirs(args.npz_dir, exist_ok=True)
+    wargs = {'ply': os.path.abspath(args.ply), 'vis': os.path.abspath(args.vis),
+             'refs': [os.path.abspath(r) for r in args.ref], 'matcher': args.matcher,
+             'max_width': args.max_width, 'npz_dir': args.npz_dir,
+             'covisible': args.covisible, 'top_k': args.top_k,
+             'index': os.path.abspath(args.index) if args.index else None}
+
+    t0 = time.perf_counter()
+    print("[Batch] Preparazione del progetto...")
+    _prepare(wargs)
+    _ensure_newline(args.out)
+
+    # 'spawn': sicuro con torch/CUDA e uguale su Windows e Linux
+    ctx = multiprocessing.get_context('spawn')
+    written = 0
+    n_ok = 0
+
+    def write(rec):
+        nonlocal written, n_ok
+        written += 1
+        n_ok += rec['ok']
+        # una riga completa per target, subito su disco: ripresa sicura
+        out.write(json.dumps(rec) + '\n')
+        out.flush()
+        os.fsync(out.fileno())
+        status = f"{rec['inliers']} inlier" if rec['ok'] else "ERRORE"
+        print(f"[Batch] {written}/{len(todo)} {os.path.basename(rec['target'])}: {status}")
+
+    def new_pool(workers):
+        return ProcessPoolExecutor(max_workers=workers, mp_context=ctx,
+                                   initializer=_init_worker, initargs=(wargs,))
+
+    with open(args.out, 'a') as out:
+        broken = []
+        with new_pool(args.workers) as pool:
+            futures = {pool.submit(_localize, t): t for t in todo}
+            for fut in as_completed(futures):
+                try:
+                    rec = fut.result()
+                except BrokenProcessPool:
+                    # worker morto: non si sa quale target l'abbia causato
+                    broken.append(futures[fut])
+                    continue
+                except Exception:
+                    rec = {'target': futures[fut], 'ok': False,
+                           'errors': {'worker': traceback.format_exc()}}
+                write(rec)
+
+        if broken:
+            print(f"[Batch] pool dei worker interrotto: {len(broken)} target "
+                  f"rielaborati uno alla volta")
+        pool = None
+        try:
+            for target in sorted(broken):
+                pool = pool or new_pool(1)
+                try:
+                    rec = pool.submit(_localize, target).result()
+                except BrokenProcessPool:
+                    # è questo target a far cadere il worker: fallito, così
+                    # la ripresa non lo rilancia (salvo --retry-failed)
+                    pool.shutdown(wait=False)
+                    pool = None
+                    rec = {'target': target, 'ok': False,
+                           'errors': {'worker': "processo del worker terminato durante l'elaborazione"}}
+                except Exception:
+                    rec = {'target': target, 'ok': False, 'errors': {'worker': traceback.format_exc()}}
+                write(rec)
+        finally:
+            if pool is not None:
+                pool.shutdown()
+
+    print(f"[Batch] {n_ok}/{len(todo)} localizzati in {time.perf_counter() - t0:.1f}s -> {args.out}")
+
+
+if __name__ == '__main__':
+    main()
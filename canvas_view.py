@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+"""
+Visualizzazione del risultato del matching su un Canvas Tk.
+
+L'immagine dei match affiancati può superare i 5000 px di larghezza:
+ridimensionarla con LANCZOS a ogni evento <Configure> blocca la GUI
+mentre si trascina il bordo della finestra. Qui:
+
+  * ImagePyramid tiene l'immagine a metà, un quarto, ... della
+    risoluzione (si può costruire fuori dal thread di Tk);
+  * durante il ridimensionamento CanvasRenderer ricampiona dal livello
+    più vicino con un filtro veloce, al più ogni `fast_ms`;
+  * quando il ridimensionamento si ferma (`settle_ms` senza eventi)
+    esegue una sola passata LANCZOS, e non ripete rendering della
+    stessa dimensione.
+"""
+import tkinter as tk
+from PIL import Image, ImageTk
+import numpy as np
+
+import tracing
+
+FAST = Image.BILINEAR
+QUALITY = Image.LANCZOS
+
+
+class ImagePyramid:
+    """
+    Livelli dell'immagine dimezzati (box filter) fino a `min_width` px.
+
+    Parametri
+    ----------
+    image : np.ndarray HxWx3 o PIL.Image
+    """
+    def __init__(self, image, min_width=256):
+        img = image if isinstance(image, Image.Image) else Image.fromarray(np.asarray(image))
+        self.levels = [img]
+        while img.width // 2 >= min_width and img.height >= 2:
+            img = img.reduce(2)
+            self.levels.append(img)
+
+    @property
+    def size(self):
+        return self.levels[0].size
+
+    def level(self, width):
+        """Il livello più piccolo largo almeno `width` (il primo se nessuno lo è)."""
+        for img in reversed(self.levels):
+            if img.width >= width:
+                return img
+        return self.levels[0]
+
+    def resize(self, size, resample=QUALITY):
+        # il filtro veloce parte dal livello più vicino; LANCZOS da uno
+        # largo almeno il doppio, per non perdere dettaglio rispetto
+        # all'originale (come reducing_gap di PIL)
+        src = self.level(size[0] * (2 if resample == QUALITY else 1))
+        if src.size == tuple(size):
+            return src
+        return src.resize(size, resample)
+
+
+class CanvasRenderer:
+    """
+    Disegna un'immagine centrata e in scala su `canvas`, senza
+    distorsione, e la ridisegna quando il canvas cambia dimensione.
+    """
+    def __init__(self, canvas, settle_ms=150, fast_ms=30):
+        self.canvas = canvas
+        self.settle_ms = settle_ms
+        self.fast_ms = fast_ms
+        self.pyramid = None
+        self._item = None
+        self._photo = None        # riferimento alla PhotoImage, altrimenti Tk la perde
+        self._key = None          # (w, h, filtro) dell'ultimo rendering
+        self._fast_id = None
+        self._settle_id = None
+        canvas.bind('<Configure>', self._on_configure)
+
+    def show(self, image):
+        """Mostra `image` (array, PIL.Image o ImagePyramid) alla qualità piena."""
+        self.pyramid = image if isinstance(image, ImagePyramid) else ImagePyramid(image)
+        self._key = None
+        self._render(QUALITY)
+
+    def clear(self):
+        self._cancel()
+        self.pyramid = None
+        self._key = None
+        self._photo = None
+        if self._item is not None:
+            self.canvas.delete(self._item)
+            self._item = None
+
+    def _cancel(self):
+        for attr in ('_fast_id', '_settle_id'):
+            after_id = getattr(self, attr)
+            if after_id is not None:
+                self.canvas.after_cancel(after_id)
+                setattr(self, attr, None)
+
+    def _on_configure(self, event):
+        if self.pyramid is None:
+            return
+        # anteprima veloce a cadenza fissa, LANCZOS solo a ridimensionamento finito
+        if self._fast_id is None:
+            self._fast_id = self.canvas.after(self.fast_ms, self._fast)
+        if self._settle_id is not None:
+            self.canvas.after_cancel(self._settle_id)
+        self._settle_id = self.canvas.after(self.settle_ms, self._settle)
+
+    def _fast(self):
+        self._fast_id = None
+        self._render(FAST)
+
+    def _settle(self):
+        self._settle_id = None
+        self._render(QUALITY)
+
+    def _render(self, resample):
+        if self.pyramid is None:
+            return
+        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()
+        w, h = self.pyramid.size
+        scale = min(cw / w, ch / h)
+        nw, nh = max(int(w * scale), 1), max(int(h * scale), 1)
+        x, y = (cw - nw) // 2, (ch - nh) // 2   # centrata nel canvas
+        key = (nw, nh, resample)
+        # stessa dimensione già disegnata (o già in alta qualità): si sposta soltanto
+        if self._item is not None and (key == self._key or
+                                       (resample == FAST and self._key == (nw, nh, QUALITY))):
+            self.canvas.coords(self._item, x, y)
+            return
+        with tracing.span("gui.render", quality=resample == QUALITY, bytes=nw * nh * 3):
+            self._photo = ImageTk.PhotoImage(self.pyramid.resize((nw, nh), resample))
+        if self._item is None:
+            self._item = self.canvas.create_image(x, y, anchor=tk.NW, image=self._photo)
+        else:
+            self.canvas.itemconfigure(self._item, image=self._photo)
+            self.canvas.coords(self._item, x, y)
+        self._key = key
@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Cache su disco di keypoint e descrittori, indirizzata per contenuto.
+
+La chiave è l'hash dei pixel dell'immagine (già ridimensionata, quindi
+include la scala), il nome dell'estrattore e i suoi parametri. Ogni voce
+è una cartella con un .npy per array (letti in memory-map) e un
+meta.json con i dtype originali: i descrittori sono salvati in float16,
+i keypoint in float32, e al caricamento tornano al dtype originale.
+
+La dimensione totale è limitata: oltre il limite vengono cancellate le
+voci usate meno di recente (mtime di meta.json, aggiornato a ogni hit).
+
+Variabili d'ambiente:
+    FEATURE_CACHE_DIR     cartella della cache (default ./cache/features)
+    FEATURE_CACHE_MAX_MB  limite in MB (default 2048)
+    FEATURE_CACHE=0       disabilita la cache
+"""
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import threading
+import numpy as np
+
+CACHE_DIR = os.environ.get('FEATURE_CACHE_DIR', os.path.join('.', 'cache', 'features'))
+MAX_BYTES = int(os.environ.get('FEATURE_CACHE_MAX_MB', 2048)) << 20
+ENABLED = os.environ.get('FEATURE_CACHE', '1') != '0'
+
+_lock = threading.Lock()
+_total = None             # byte occupati, calcolati alla prima scrittura
+
+
+def key(image: np.ndarray, extractor: str, **params) -> str:
+    """Chiave della voce: hash di pixel, forma, estrattore e parametri."""
+    image = np.ascontiguousarray(image)
+    h = hashlib.blake2b(digest_size=20)
+    h.update(image.data)
+    h.update(repr((image.shape, str(image.dtype), extractor, sorted(params.items()))).encode())
+    return h.hexdigest()
+
+
+def _entry_dir(k: str) -> str:
+    return os.path.join(CACHE_DIR, k[:2], k)
+
+
+def _storage_dtype(name, arr):
+    if not np.issubdtype(arr.dtype, np.floating):
+        return arr.dtype
+    if name.startswith('desc') or name.startswith('dino'):
+        return np.float16
+    return np.float32
+
+
+def load(k: str):
+    """Ritorna il dict di array della voce `k` (memory-map), None se assente."""
+    if not ENABLED:
+        return None
+    d = _entry_dir(k)
+    meta_path = os.path.join(d, 'meta.json')
+    try:
+        with open(meta_path, 'r') as jf:
+            meta = json.load(jf)
+        out = {}
+        for name, dtype in meta['arrays'].items():
+            arr = np.load(os.path.join(d, name + '.npy'), mmap_mode='r')
+            out[name] = arr if arr.dtype == np.dtype(dtype) else arr.astype(dtype)
+        os.utime(meta_path)   # LRU: ultimo accesso
+        return out
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def save(k: str, arrays: dict):
+    """Scrive la voce `k` (scrittura atomica) e applica il limite di dimensione."""
+    global _total
+    if not ENABLED:
+        return
+    d = _entry_dir(k)
+    # nome proprio di processo e chiamata: più worker possono scrivere
+    # la stessa voce insieme senza mescolare i file
+    tmp = f"{d}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    try:
+        os.makedirs(tmp, exist_ok=True)
+        meta = {'arrays': {}}
+        size = 0
+        for name, arr in arrays.items():
+            arr = np.asarray(arr)
+            meta['arrays'][name] = str(arr.dtype)
+            path = os.path.join(tmp, name + '.npy')
+            np.save(path, arr.astype(_storage_dtype(name, arr), copy=False))
+            size += os.path.getsize(path)
+        with open(os.path.join(tmp, 'meta.json'), 'w') as jf:
+            json.dump(meta, jf)
+        if os.path.isdir(d):
+            shutil.rmtree(tmp, ignore_errors=True)
+            return
+        os.replace(tmp, d)
+    except OSError:
+        shutil.rmtree(tmp, ignore_errors=True)
+        return
+
+    with _lock:
+        if _total is None:
+            _total = sum(s for _, s, _ in _scan())
+        else:
+            _total += size
+        if _total > MAX_BYTES:
+            _evict()
+
+
+def _scan():
+    """(cartella, byte, ultimo accesso) di tutte le voci."""
+    out = []
+    if not os.path.isdir(CACHE_DIR):
+        return out
+    for sub in os.scandir(CACHE_DIR):
+        if not sub.is_dir():
+            continue
+        for e in os.scandir(sub.path):
+            if not e.is_dir() or '.tmp' in e.name:
+                continue
+            try:
+                files = list(os.scandir(e.path))
+                size = sum(f.stat().st_size for f in files)
+                atime = os.stat(os.path.join(e.path, 'meta.json')).st_mtime
+            except OSError:
+                continue
+            out.append((e.path, size, atime))
+    return out
+
+
+def _evict():
+    """Cancella le voci meno recenti fino al 90% del limite."""
+    global _total
+    entries = sorted(_scan(), key=lambda x: x[2])
+    _total = sum(s for _, s, _ in entries)
+    for path, size, _ in entries:
+        if _total <= 0.9 * MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        _total -= size
+
+
+def cached(image: np.ndarray, extractor: str, compute, **params) -> dict:
+    """
+    Ritorna le feature di `image` per `extractor`: dalla cache se presenti,
+    altrimenti compute() (dict nome -> array numpy) e le salva.
+    """
+    k = key(image, extractor, **params)
+    hit = load(k)
+    if hit is not None:
+        return hit
+    arrays = compute()
+    save(k, arrays)
+    return arrays
+
+
+def clear():
+    global _total
+    with _lock:
+        shutil.rmtree(CACHE_DIR, ignore_errors=True)
+        _total = 0
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Coda di job in background per la GUI.
+
+I job (matching, pose estimation) girano su un executor con un numero
+fisso di thread; progressi e risultati tornano al thread di Tk tramite
+la funzione `post` (di solito `lambda fn: root.after(0, fn)`), perché
+Tkinter va usato solo dal thread principale.
+
+    jobs = JobQueue(lambda fn: root.after(0, fn), on_change=update_label)
+    job = jobs.submit("img0 → img1", work, on_done=show, on_progress=bar)
+
+`work(job)` riceve il job: chiama job.progress(testo, frazione) tra una
+fase e l'altra e job.check(), che solleva Cancelled se il job è stato
+annullato. Un job in coda viene annullato subito; uno in esecuzione si
+ferma al primo check (l'inferenza di un modello non si interrompe a metà).
+"""
+import itertools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+class Cancelled(Exception):
+    """Sollevata da Job.check() quando il job è stato annullato."""
+
+
+class Job:
+    _ids = itertools.count(1)
+
+    def __init__(self, label, fn, queue, on_done=None, on_error=None, on_progress=None):
+        self.id = next(Job._ids)
+        self.label = label
+        self.fn = fn
+        self.state = 'queued'     # queued | running | done | failed | cancelled
+        self._queue = queue
+        self._cancel = threading.Event()
+        self._on_done = on_done
+        self._on_error = on_error
+        self._on_progress = on_progress
+        self.future = None
+
+    @property
+    def cancelled(self) -> bool:
+        return self._cancel.is_set()
+
+    def cancel(self):
+        """Annulla il job: subito se è in coda, al prossimo check se è in esecuzione."""
+        self._cancel.set()
+        if self.future is not None and self.future.cancel():
+            self.state = 'cancelled'
+            self._queue._finished(self)
+
+    def check(self):
+        if self._cancel.is_set():
+            raise Cancelled(self.label)
+
+    def progress(self, text, fraction=None):
+        """Aggiorna il progresso (dal thread del job); ignorato se annullato."""
+        self.check()
+        if self._on_progress is not None:
+            self._queue.post(lambda: self._on_progress(self, text, fraction))
+
+    def _run(self):
+        self.state = 'running'
+        self._queue._changed()
+        try:
+            self.check()
+            result = self.fn(self)
+            self.check()
+        except Cancelled:
+            self.state = 'cancelled'
+        except Exception as e:  # l'errore torna alla GUI, la coda prosegue
+            self.state = 'failed'
+            if self._on_error is not None:
+                self._queue.post(lambda err=e: self._on_error(self, err))
+        else:
+            self.state = 'done'
+            if self._on_done is not None:
+                self._queue.post(lambda: self._on_done(self, result))
+        self._queue._finished(self)
+
+
+class JobQueue:
+    """
+    Esegue i job nell'ordine di invio su `workers` thread.
+
+    Parametri
+    ----------
+    post : callable
+        post(fn) esegue fn sul thread della GUI (root.after).
+    workers : int
+        Job in esecuzione contemporaneamente (1 = uno dopo l'altro, come
+        serve ai matcher che tengono un solo modello sulla GPU).
+    on_change : callable, opzionale
+        on_change(queue) sul thread della GUI quando cambia lo stato dei job.
+    """
+    def __init__(self, post, workers=1, on_change=None, name="jobs"):
+        self.post = post
+        self.on_change = on_change
+        self._executor = ThreadPoolExecutor(workers, thread_name_prefix=name)
+        self._lock = threading.Lock()
+        self._jobs = []           # in coda o in esecuzione, in ordine di invio
+
+    def submit(self, label, fn, on_done=None, on_error=None, on_progress=None) -> Job:
+        job = Job(label, fn, self, on_done, on_error, on_progress)
+        with self._lock:
+            self._jobs.append(job)
+            job.future = self._executor.submit(job._run)
+        self._changed()
+        return job
+
+    @property
+    def jobs(self):
+        with self._lock:
+            return list(self._jobs)
+
+    @property
+    def running(self):
+        return next((j for j in self.jobs if j.state == 'running'), None)
+
+    @property
+    def pending(self):
+        return [j for j in self.jobs if j.state == 'queued']
+
+    def busy(self) -> bool:
+        return bool(self.jobs)
+
+    def cancel_all(self):
+        for job in self.jobs:
+            job.cancel()
+
+    def shutdown(self):
+        """Annulla tutto senza attendere il job in esecuzione."""
+        self.cancel_all()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finished(self, job):
+        with self._lock:
+            if job in self._jobs:
+                self._jobs.remove(job)
+        self._changed()
+
+    def _changed(self):
+        if self.on_change is not None:
+            self.post(lambda: self.on_change(self))
@@ -3,26 +3,32 @@ import numpy as np
 import cv2
 from models.liftfeat_wrapper import LiftFeat, MODEL_PATH
 
-def run_liftfeat(img0: np.ndarray, img1: np.ndarray):
-    """
-    Esegue il matching con LiftFeat.
-    Restituisce keypoints, confidence e immagine di visualizzazione,
-    con overlay del numero di match trovati.
-    
-    detect_threshold controlla quanto “forti” devono essere i punti di interesse perché vengano restituiti.
-
-        Valori più bassi → più keypoint (ma potenzialmente più rumore).
-
-        Valori più alti → meno keypoint, più selettivi.
-    """
-    
-    lf = LiftFeat(weight=MODEL_PATH, detect_threshold=0.2)
-    data0 = lf.extract(img0)
-    data1 = lf.extract(img1)
-    kpts0 = data0['keypoints'].cpu().numpy()
-    desc0 = data0['descriptors'].cpu().numpy()
-    kpts1 = data1['keypoints'].cpu().numpy()
-    desc1 = data1['descriptors'].cpu().numpy()
+import feature_cache
+import matcher_registry
+import tracing
+
+def _load(detect_threshold=0.2):
+    return LiftFeat(weight=MODEL_PATH, detect_threshold=detect_threshold)
+
+def warmup(detect_threshold: float = 0.2):
+    """Carica LiftFeat nel registro senza eseguire matching."""
+    matcher_registry.get("LiftFeat", _load, detect_threshold=detect_threshold)
+
+def _extract(lf, img, detect_threshold, use_cache=True):
+    """Estrazione LiftFeat come array numpy, saltata se è in feature_cache."""
+    def compute():
+        data = lf.extract(img)
+        return {k: v.cpu().numpy() for k, v in data.items() if hasattr(v, 'cpu')}
+    if not use_cache:
+        return compute()
+    return feature_cache.cached(img, "LiftFeat", compute, detect_threshold=detect_threshold)
+
+def _match_feats(data0, data1):
+    """Matching dei descrittori LiftFeat; ritorna ref_pts, dst_pts, conf."""
+    kpts0 = np.asarray(data0['keypoints'])
+    desc0 = np.asarray(data0['descriptors'], dtype=np.float32)
+    kpts1 = np.asarray(data1['keypoints'])
+    desc1 = np.asarray(data1['descriptors'], dtype=np.float32)
 
     # Matching con BFMatcher + ratio test
     """
@@ -37,15 +43,59 @@ def run_liftfeat(img0: np.ndarray, img1: np.ndarray):
     good = [m for m, n in raw if m.distance < 0.84 * n.distance]
 
     # Estrai punti corrispondenti
-    ref_pts = np.array([kpts0[m.queryIdx] for m in good], dtype=np.float32)
-    dst_pts = np.array([kpts1[m.trainIdx] for m in good], dtype=np.float32)
+    ref_pts = np.array([kpts0[m.queryIdx] for m in good], dtype=np.float32).reshape(-1, 2)
+    dst_pts = np.array([kpts1[m.trainIdx] for m in good], dtype=np.float32).reshape(-1, 2)
 
     conf = np.ones(len(ref_pts), dtype=np.float32)
+    return ref_pts, dst_pts, conf
+
+def match_many(reference: np.ndarray, targets, detect_threshold: float = 0.2, use_cache: bool = True):
+    """
+    Matching uno-a-molti con LiftFeat: la reference viene estratta una
+    sola volta e confrontata con ciascun target.
+    Yields (ref_pts, dst_pts, conf) per ciascun target, nello stesso ordine.
+    """
+    lf = matcher_registry.get("LiftFeat", _load, detect_threshold=detect_threshold)
+    with tracing.span("liftfeat.extract", bytes=reference.nbytes):
+        data_ref = _extract(lf, reference, detect_threshold, use_cache)
+    for img in targets:
+        with tracing.span("liftfeat.extract", bytes=img.nbytes):
+            data = _extract(lf, img, detect_threshold, use_cache)
+        with tracing.span("liftfeat.match") as sp:
+            res = _match_feats(data_ref, data)
+            sp.set(items=len(res[0]))
+        yield res
+
+def run_liftfeat(img0: np.ndarray, img1: np.ndarray, detect_threshold: float = 0.2,
+                 use_cache: bool = True):
+    """
+    Esegue il matching con LiftFeat.
+    Restituisce keypoints, confidence e immagine di visualizzazione,
+    con overlay del numero di match trovati.
+    Il modello resta residente nel matcher_registry; con use_cache le
+    feature già calcolate vengono lette da feature_cache.
+    
+    detect_threshold controlla quanto “forti” devono essere i punti di interesse perché vengano restituiti.
+
+        Valori più bassi → più keypoint (ma potenzialmente più rumore).
 
-    viz = warp_and_draw(ref_pts, dst_pts, img0, img1)
+        Valori più alti → meno keypoint, più selettivi.
+    """
+    
+    lf = matcher_registry.get("LiftFeat", _load, detect_threshold=detect_threshold)
+    with tracing.span("liftfeat.extract", bytes=img0.nbytes + img1.nbytes) as sp:
+        data0 = _extract(lf, img0, detect_threshold, use_cache)
+        data1 = _extract(lf, img1, detect_threshold, use_cache)
+        sp.set(items=len(data0['keypoints']) + len(data1['keypoints']))
+    with tracing.span("liftfeat.match") as sp:
+        ref_pts, dst_pts, conf = _match_feats(data0, data1)
+        sp.set(items=len(ref_pts))
+
+    with tracing.span("liftfeat.viz", items=len(ref_pts)):
+        viz = warp_and_draw(ref_pts, dst_pts, img0, img1)
 
     # Aggiungi overlay con numero di match
-    text = f"{len(good)} match con LiftFeat"
+    text = f"{len(ref_pts)} match con LiftFeat"
     cv2.putText(
         viz, text,
         org=(10, 30),
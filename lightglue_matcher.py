@@ -1,10 +1,14 @@
  #!/usr/bin/env python3
-import os
+import itertools
 import numpy as np
 import torch
 import cv2
 from lightglue import LightGlue, SuperPoint
-from lightglue.utils import rbd
+from lightglue.utils import rbd, ImagePreprocessor
+
+import feature_cache
+import matcher_registry
+import tracing
 
 device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 torch.set_grad_enabled(False)
@@ -14,27 +18,37 @@ torch.set_grad_enabled(False)
     (–> più alto = più punti, ma più rumore e calcolo).
 """
 
-extractor = SuperPoint(max_num_keypoints=2048).eval().to(device)
-matcher = LightGlue(features="superpoint").eval().to(device)
+def _load(max_num_keypoints=2048):
+    extractor = SuperPoint(max_num_keypoints=max_num_keypoints).eval().to(device)
+    matcher = LightGlue(features="superpoint").eval().to(device)
+    return extractor, matcher
 
-def run_lightglue(img0: np.ndarray, img1: np.ndarray):
-    """
-    Esegue il matching con LightGlue e disegna i match sul risultato,
-    aggiungendo in overlay il numero di corrispondenze trovate.
-    Args:
-        img0, img1: immagini in formato numpy array HxWx3 (RGB, uint8)
-    Returns:
-        kp0, kp1: array dei keypoints corrispondenti Nx2
-        conf: array delle confidence score di matching (N,)
-        viz: immagine congiunta, linee di match e numero di match
-    """
-    # Normalize images to [0,1] tensors
-    t0 = torch.from_numpy(img0.astype(np.float32) / 255.0).permute(2, 0, 1).unsqueeze(0).to(device)
-    t1 = torch.from_numpy(img1.astype(np.float32) / 255.0).permute(2, 0, 1).unsqueeze(0).to(device)
+def warmup(max_num_keypoints: int = 2048):
+    """Carica SuperPoint e LightGlue nel registro senza eseguire matching."""
+    matcher_registry.get("LightGlue", _load, max_num_keypoints=max_num_keypoints)
 
-    # Estrazione feature e matching
-    feats0 = extractor.extract(t0)
-    feats1 = extractor.extract(t1)
+def _to_tensor(img: np.ndarray):
+    # Normalize image to [0,1] tensor 1x3xHxW
+    return torch.from_numpy(img.astype(np.float32) / 255.0).permute(2, 0, 1).unsqueeze(0).to(device)
+
+def _feats_to_numpy(feats):
+    return {k: v.cpu().numpy() for k, v in feats.items() if isinstance(v, torch.Tensor)}
+
+def _feats_from_numpy(arrays):
+    return {k: torch.from_numpy(np.array(v)).to(device) for k, v in arrays.items()}
+
+def _extract(extractor, img, max_num_keypoints, use_cache=True):
+    """SuperPoint su una immagine, saltando l'estrazione se è in feature_cache."""
+    if not use_cache:
+        return extractor.extract(_to_tensor(img))
+    arrays = feature_cache.cached(
+        img, "SuperPoint",
+        lambda: _feats_to_numpy(extractor.extract(_to_tensor(img))),
+        max_num_keypoints=max_num_keypoints)
+    return _feats_from_numpy(arrays)
+
+def _match_feats(matcher, feats0, feats1):
+    """Matching LightGlue tra due insiemi di feature; ritorna kp0, kp1, conf."""
     matches01 = matcher({"image0": feats0, "image1": feats1})
     feats0, feats1, matches01 = [rbd(x) for x in [feats0, feats1, matches01]]
 
@@ -52,38 +66,140 @@ def run_lightglue(img0: np.ndarray, img1: np.ndarray):
         conf = matches01["matches_confidence"].cpu().numpy()
     else:
         conf = np.ones(len(kp0), dtype=np.float32)
+    return kp0, kp1, conf
 
-    # Prepara immagine di visualizzazione
-    h0, w0 = img0.shape[:2]
-    h1, w1 = img1.shape[:2]
-    # Ridimensiona altezza se necessaria
-    if h0 != h1:
-        new_h = min(h0, h1)
-        img0 = cv2.resize(img0, (int(w0 * new_h / h0), new_h))
-        img1 = cv2.resize(img1, (int(w1 * new_h / h1), new_h))
+def _extract_batch(extractor, imgs):
+    """
+    Estrae SuperPoint su un gruppo di immagini della stessa dimensione
+    con un solo forward batch (stesso preprocessing di extractor.extract).
+    Se il batch non si può comporre (numero di keypoint diverso tra le
+    immagini) ricade sull'estrazione una per una.
+    """
+    if len(imgs) == 1:
+        return [extractor.extract(_to_tensor(imgs[0]))]
+    batch = torch.cat([_to_tensor(img) for img in imgs], 0)
+    shape = batch.shape[-2:][::-1]
+    try:
+        prep, scales = ImagePreprocessor(**extractor.preprocess_conf)(batch)
+        feats = extractor({"image": prep})
+    except RuntimeError:
+        return [extractor.extract(_to_tensor(img)) for img in imgs]
+    out = []
+    for i in range(len(imgs)):
+        f = {k: v[i:i + 1] for k, v in feats.items() if isinstance(v, torch.Tensor)}
+        f["image_size"] = torch.tensor(shape)[None].to(prep).float()
+        f["keypoints"] = (f["keypoints"] + 0.5) / scales[None] - 0.5
+        out.append(f)
+    return out
+
+def match_many(reference: np.ndarray, targets, batch_size: int = 8, max_num_keypoints: int = 2048,
+               use_cache: bool = True):
+    """
+    Matching uno-a-molti: le feature della reference vengono estratte una
+    sola volta; i target vengono estratti a gruppi di `batch_size`,
+    raggruppati per dimensione (bucket) per un unico forward di SuperPoint.
+    Args:
+        reference: immagine di riferimento HxWx3 (RGB, uint8)
+        targets: iterabile di immagini HxWx3 (anche un generatore)
+        batch_size: immagini target per forward
+        use_cache: riusa le feature già in feature_cache
+    Yields:
+        (kp0, kp1, conf) per ciascun target, nello stesso ordine
+    """
+    extractor, matcher = matcher_registry.get("LightGlue", _load, max_num_keypoints=max_num_keypoints)
+    with tracing.span("lightglue.extract", bytes=reference.nbytes):
+        feats_ref = _extract(extractor, reference, max_num_keypoints, use_cache)
+
+    targets = iter(targets)
+    while True:
+        chunk = list(itertools.islice(targets, batch_size))
+        if not chunk:
+            return
+        feats = [None] * len(chunk)
+        keys = [None] * len(chunk)
+        if use_cache:
+            for i, img in enumerate(chunk):
+                keys[i] = feature_cache.key(img, "SuperPoint", max_num_keypoints=max_num_keypoints)
+                hit = feature_cache.load(keys[i])
+                if hit is not None:
+                    feats[i] = _feats_from_numpy(hit)
+        # bucket per dimensione (solo i target non in cache),
+        # poi risultati nell'ordine originale
+        buckets = {}
+        for i, img in enumerate(chunk):
+            if feats[i] is None:
+                buckets.setdefault(img.shape, []).append(i)
+        for idx in buckets.values():
+            with tracing.span("lightglue.extract_batch", items=len(idx),
+                              bytes=sum(chunk[i].nbytes for i in idx)):
+                for i, f in zip(idx, _extract_batch(extractor, [chunk[i] for i in idx])):
+                    feats[i] = f
+                    if use_cache:
+                        feature_cache.save(keys[i], _feats_to_numpy(f))
+        for f in feats:
+            with tracing.span("lightglue.match") as sp:
+                res = _match_feats(matcher, feats_ref, f)
+                sp.set(items=len(res[0]))
+            yield res
+
+def run_lightglue(img0: np.ndarray, img1: np.ndarray, max_num_keypoints: int = 2048,
+                  use_cache: bool = True):
+    """
+    Esegue il matching con LightGlue e disegna i match sul risultato,
+    aggiungendo in overlay il numero di corrispondenze trovate.
+    SuperPoint e LightGlue restano residenti nel matcher_registry.
+    Args:
+        img0, img1: immagini in formato numpy array HxWx3 (RGB, uint8)
+        max_num_keypoints: keypoint massimi estratti da SuperPoint
+        use_cache: salta l'estrazione se le feature sono in feature_cache
+    Returns:
+        kp0, kp1: array dei keypoints corrispondenti Nx2
+        conf: array delle confidence score di matching (N,)
+        viz: immagine congiunta, linee di match e numero di match
+    """
+    extractor, matcher = matcher_registry.get("LightGlue", _load, max_num_keypoints=max_num_keypoints)
+
+    # Estrazione feature e matching
+    with tracing.span("lightglue.extract", bytes=img0.nbytes + img1.nbytes) as sp:
+        feats0 = _extract(extractor, img0, max_num_keypoints, use_cache)
+        feats1 = _extract(extractor, img1, max_num_keypoints, use_cache)
+        sp.set(items=int(feats0["keypoints"].shape[-2] + feats1["keypoints"].shape[-2]))
+    with tracing.span("lightglue.match") as sp:
+        kp0, kp1, conf = _match_feats(matcher, feats0, feats1)
+        sp.set(items=len(kp0))
+
+    with tracing.span("lightglue.viz", items=len(kp0)):
+        # Prepara immagine di visualizzazione
         h0, w0 = img0.shape[:2]
+        h1, w1 = img1.shape[:2]
+        # Ridimensiona altezza se necessaria
+        if h0 != h1:
+            new_h = min(h0, h1)
+            img0 = cv2.resize(img0, (int(w0 * new_h / h0), new_h))
+            img1 = cv2.resize(img1, (int(w1 * new_h / h1), new_h))
+            h0, w0 = img0.shape[:2]
+
+        viz = np.concatenate([img0, img1], axis=1).copy()
+
+        # Disegna linee di match
+        line_width = 2
+        for (x0, y0), (x1, y1) in zip(kp0, kp1):
+            pt0 = (int(x0), int(y0))
+            pt1 = (int(x1) + w0, int(y1))
+            cv2.line(viz, pt0, pt1, color=(0, 255, 0), thickness=line_width)
+            cv2.circle(viz, pt0, radius=3, color=(0, 0, 255), thickness=-1)
+            cv2.circle(viz, pt1, radius=3, color=(0, 0, 255), thickness=-1)
 
-    viz = np.concatenate([img0, img1], axis=1).copy()
-
-    # Disegna linee di match
-    line_width = 2
-    for (x0, y0), (x1, y1) in zip(kp0, kp1):
-        pt0 = (int(x0), int(y0))
-        pt1 = (int(x1) + w0, int(y1))
-        cv2.line(viz, pt0, pt1, color=(0, 255, 0), thickness=line_width)
-        cv2.circle(viz, pt0, radius=3, color=(0, 0, 255), thickness=-1)
-        cv2.circle(viz, pt1, radius=3, color=(0, 0, 255), thickness=-1)
-
-    # Aggiungi overlay con numero di match
-    text = f"{len(kp0)} match con LightGlue"
-    cv2.putText(
-        viz, text,
-        org=(10, 30),
-        fontFace=cv2.FONT_HERSHEY_SIMPLEX,
-        fontScale=1.0,
-        color=(255, 0, 0),
-        thickness=2,
-        lineType=cv2.LINE_AA
-    )
+        # Aggiungi overlay con numero di match
+        text = f"{len(kp0)} match con LightGlue"
+        cv2.putText(
+            viz, text,
+            org=(10, 30),
+            fontFace=cv2.FONT_HERSHEY_SIMPLEX,
+            fontScale=1.0,
+            color=(255, 0, 0),
+            thickness=2,
+            lineType=cv2.LINE_AA
+        )
 
     return kp0, kp1, conf, viz
\ No newline at end of file
@@ -1,14 +1,28 @@
 #!/usr/bin/env python3
+import time
+_T_START = time.perf_counter()
 import os
+import sys
 import subprocess
+import threading
+from collections import deque
 import tkinter as tk
 from tkinter import messagebox, filedialog, ttk
-from PIL import Image, ImageTk
 import numpy as np
 
-from omniglue_matcher import run_omniglue
-from liftfeat_matcher import run_liftfeat
-from lightglue_matcher import run_lightglue
+# i matcher vengono importati solo quando selezionati (vedi matcher_registry.BACKENDS)
+import matcher_registry
+from gui_jobs import JobQueue
+
+# Budget per l'apertura della finestra: oltre questa soglia viene segnalato
+STARTUP_BUDGET_S = float(os.environ.get("MATCHING_STARTUP_BUDGET_S", 2.0))
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "matching_and_pose"))
+import image_io
+import matches_io
+import pose_client
+import tracing
+from canvas_view import CanvasRenderer, ImagePyramid
 
 class MatchingApp:
     #
@@ -32,14 +46,28 @@ class MatchingApp:
 
         # Avaible algorithms 
         # StringVar allow to follow the selected algorithm in GUI 
-        self.algorithms = ["OmniGlue", "LiftFeat", "LightGlue"]
+        self.algorithms = list(matcher_registry.BACKENDS)
         self.selected_alg = tk.StringVar(value=self.algorithms[0])
+        self._warm = {}   # nome -> thread di warm-up
         self.image1_path = None
         self.image2_path = None
-        self.tk_output_image = None
-        self._last_array = None
+        # PLY e visibility del progetto, chiesti una volta se si usa il pose worker
+        self.ply_path = None
+        self.vis_path = None
+        self.max_width = 800   # larghezza delle immagini passate al matcher
+
+        # matching e pose estimation su thread di lavoro, uno alla volta per
+        # coda; i risultati tornano al thread di Tk con root.after
+        post = lambda fn: self.root.after(0, fn)
+        self.jobs = JobQueue(post, workers=1, on_change=self._jobs_changed, name="matching")
+        self.pose_jobs = JobQueue(post, workers=1, on_change=self._jobs_changed, name="pose")
+        self._confirm = deque()   # (job, risultato) in attesa di conferma
+        self._asking = False
 
         self.build_ui()
+        # warm-up del backend selezionato mentre l'utente sceglie le immagini
+        self.selected_alg.trace_add("write", lambda *_: self.warmup(self.selected_alg.get()))
+        self.root.after(0, lambda: self.warmup(self.selected_alg.get()))
 
     def build_ui(self):    
         #
@@ -86,6 +114,17 @@ class MatchingApp:
                             bg="#3498db", fg="white", font=("Helvetica",10,"bold"), padx=15, pady=10)
         run_btn.pack(fill="x", pady=5)
 
+        # Avanzamento, coda e annullamento
+        job_frame = ttk.Frame(main_frame)
+        job_frame.pack(fill="x", pady=5)
+        self.progress = ttk.Progressbar(job_frame, mode="determinate", maximum=100)
+        self.progress.pack(side="left", fill="x", expand=True)
+        self.queue_label = ttk.Label(job_frame, text="", width=12)
+        self.queue_label.pack(side="left", padx=10)
+        self.cancel_btn = tk.Button(job_frame, text="Annulla", command=self.cancel_job, state="disabled",
+                                    bg="#c0392b", fg="white", font=("Helvetica",10,"bold"), padx=10)
+        self.cancel_btn.pack(side="left")
+
         # Stato
         self.status_label = ttk.Label(main_frame, text="Seleziona le immagini e premi 'Esegui Matching'.",
                                      foreground="#3498db", font=("Helvetica",9,"italic"))
@@ -97,7 +136,26 @@ class MatchingApp:
         ttk.Label(canvas_frame, text="Risultato Matching:", font=("Helvetica",10,"bold")).pack(anchor="w", pady=(0,5))
         self.canvas = tk.Canvas(canvas_frame, bg="white", highlightbackground="#7f8c8d", highlightthickness=2)
         self.canvas.pack(fill="both", expand=True)
-        self.canvas.bind('<Configure>', self._on_canvas_resize)
+        # ridisegno in scala al cambio di dimensione (debounce + piramide)
+        self.view = CanvasRenderer(self.canvas)
+
+    def warmup(self, name):
+        """Importa il backend e carica il modello su un thread in background."""
+        if name in self._warm:
+            return
+        def work():
+            try:
+                matcher_registry.warmup(name)
+                msg = f"{name} pronto."
+            except Exception as e:  # il warm-up non deve mai bloccare la GUI
+                msg = f"Warm-up {name} non riuscito: {e}"
+            self.root.after(0, lambda: self._warmup_done(name, msg))
+        self._warm[name] = threading.Thread(target=work, daemon=True)
+        self._warm[name].start()
+
+    def _warmup_done(self, name, msg):
+        if name == self.selected_alg.get() and not self.jobs.busy():
+            self.status_label.config(text=msg)
 
     def load_image1(self):
         path = filedialog.askopenfilename(filetypes=[("Image files","*.jpg *.png *.jpeg")])
@@ -118,90 +176,159 @@ class MatchingApp:
         self.img1_label.config(text="Nessun file selezionato", background="#34495e")
         self.img2_label.config(text="Nessun file selezionato", background="#34495e")
         self.status_label.config(text="Seleziona le immagini e premi 'Esegui Matching'.")
-        self.canvas.delete("all")
-        self._last_array = None
-
-    def resize_image(self, img, max_width=800):
-        h, w = img.shape[:2]
-        if w > max_width:
-            scale = max_width / w
-            new_w = int(w * scale)
-            new_h = int(h * scale)
-            resized = np.array(Image.fromarray(img).resize((new_w, new_h), Image.LANCZOS))
-            return resized, scale
-        return img, 1.0
+        self.view.clear()
 
     def run_matching(self):
         if not (self.image1_path and self.image2_path):
             messagebox.showerror("Errore","Seleziona entrambe le immagini.")
             return
-        self.status_label.config(text=f"Matching con {self.selected_alg.get()} in corso...")
-        self.root.update()
-        
-        # Load images
-        img0 = np.array(Image.open(self.image1_path).convert('RGB'))
-        img1 = np.array(Image.open(self.image2_path).convert('RGB'))
-
-        # Resize before matching as Numpy array
-        img0_small, scale0 = self.resize_image(img0)
-        img1_small, scale1 = self.resize_image(img1)
-        #print(f"img0 resized by {scale0}, img1 by {scale1}")
-
-        # Matching
-        # Call the selected algorithm to search keypoints,
-        # confidence scores and viz image to visualize 
-        # the corrispondences
-        if self.selected_alg.get() == "OmniGlue":
-            kp0_s, kp1_s, conf, viz = run_omniglue(img0_small, img1_small)
-        elif self.selected_alg.get() == "LiftFeat":
-            kp0_s, kp1_s, conf, viz = run_liftfeat(img0_small, img1_small)
-        else:
-            kp0_s, kp1_s, conf, viz = run_lightglue(img0_small, img1_small)
-
-        # Return keypoints to the original size 
-        kp0 = kp0_s * np.array([1/scale0, 1/scale0])
-        kp1 = kp1_s * np.array([1/scale1, 1/scale1])
-
-        # Save keypoints e confidence in a file
-        os.makedirs("output", exist_ok=True)
-        with open(os.path.join("output", "matches_output.txt"), "w") as f:
-            f.write("Keypoints Image 0:\n"); np.savetxt(f, kp0, fmt="%.6f")
-            f.write("\nKeypoints Image 1:\n"); np.savetxt(f, kp1, fmt="%.6f")
-            f.write("\nMatch Confidence Scores:\n"); np.savetxt(f, conf, fmt="%.6f")
+        # il job lavora su una copia dei parametri: l'utente può già
+        # scegliere e accodare la coppia successiva
+        ref_path, tgt_path, alg = self.image1_path, self.image2_path, self.selected_alg.get()
+        label = f"{os.path.basename(ref_path)} → {os.path.basename(tgt_path)} ({alg})"
+        self.jobs.submit(label, lambda job: self._match_job(job, ref_path, tgt_path, alg),
+                         on_done=self._matching_done, on_error=self._job_failed,
+                         on_progress=self._job_progress)
+
+    def _match_job(self, job, ref_path, tgt_path, alg):
+        """Matching di una coppia (thread del JobQueue, niente Tkinter qui)."""
+        with tracing.span("gui.matching", matcher=alg):
+            # Load images
+            job.progress(f"Caricamento immagini ({job.label})...", 0.05)
+            # JPEG decoded directly at reduced scale, then resized to 800 px
+            with tracing.span("gui.decode") as sp:
+                img0_small, scale0, size0 = image_io.load_rgb(ref_path, self.max_width)
+                img1_small, scale1, size1 = image_io.load_rgb(tgt_path, self.max_width)
+                sp.set(bytes=img0_small.nbytes + img1_small.nbytes)
+            #print(f"img0 resized by {scale0}, img1 by {scale1}")
+
+            # Matching
+            # Call the selected algorithm to search keypoints,
+            # confidence scores and viz image to visualize 
+            # the corrispondences
+            job.progress(f"Matching con {alg} in corso ({job.label})...", 0.2)
+            run_matcher = matcher_registry.backend(alg)
+            with tracing.span("gui.match") as sp:
+                kp0_s, kp1_s, conf, viz = run_matcher(img0_small, img1_small)
+                sp.set(items=len(kp0_s))
+            job.progress(f"Salvataggio dei match ({job.label})...", 0.9)
+
+            # Return keypoints to the original size 
+            kp0 = kp0_s * np.array([1/scale0, 1/scale0])
+            kp1 = kp1_s * np.array([1/scale1, 1/scale1])
 
+            # Save keypoints, confidence and matching metadata in the binary file
+            meta = dict(image_sizes=[size0, size1],
+                        scales=[scale0, scale1], matcher=alg)
+            with tracing.span("gui.write_matches", items=len(kp0)):
+                matches_io.write_matches(os.path.join("output", "matches_output.bin"),
+                                         kp0, kp1, conf, **meta)
+            # i livelli ridotti della visualizzazione si preparano qui, fuori da Tk
+            viz = ImagePyramid(viz)
+        return {'ref': ref_path, 'tgt': tgt_path, 'kp0': kp0, 'kp1': kp1, 'conf': conf,
+                'meta': meta, 'viz': viz}
+
+    def _matching_done(self, job, result):
         # Visualize matching on GUI
-        self.status_label.config(text="Inferenza completata. Output visualizzato.")
-        self._display_scaled(viz)   # adabt to the canvas
+        self.status_label.config(text=f"Inferenza completata: {job.label}.")
+        self.view.show(result['viz'])   # adabt to the canvas
+        # una conferma alla volta, anche se più job finiscono insieme
+        self._confirm.append((job, result))
+        if not self._asking:
+            self._ask_next()
+
+    def _ask_next(self):
+        if not self._confirm:
+            return
+        job, result = self._confirm.popleft()
+        self._asking = True
+        try:
+            # Ask if he wants to execute the pose estimation
+            ok = messagebox.askyesno("Conferma Matching",
+                                     f"{job.label}\nMatching soddisfacente? Vuoi eseguire pose estimation?")
+        finally:
+            self._asking = False
+        if ok:
+            self.run_pose(result)
+        elif not self.jobs.busy() and not self._confirm:
+            self.reset_ui()
+        self.root.after(0, self._ask_next)
+
+    def run_pose(self, result):
+        """Passa i match alla pose estimation (worker persistente o script) in background."""
+        if not (self.ply_path and self.vis_path) and pose_client.is_running():
+            ply = filedialog.askopenfilename(title="Seleziona PLY", filetypes=[("PLY files", "*.ply")])
+            vis = filedialog.askopenfilename(title="Seleziona TXT", filetypes=[("TXT files", "*.txt")])
+            if not (ply and vis):
+                messagebox.showerror("Errore", "Devi selezionare entrambi i file.")
+                return
+            self.ply_path, self.vis_path = ply, vis
+        label = f"pose {os.path.basename(result['tgt'])}"
+        self.pose_jobs.submit(label, lambda job: self._pose_job(job, result),
+                              on_done=lambda job, msg: self.status_label.config(text=msg),
+                              on_error=self._job_failed, on_progress=self._job_progress)
 
-        # Ask if he wants to execute the pose estimation
-        if messagebox.askyesno("Conferma Matching", "Matching soddisfacente? Vuoi eseguire pose estimation?" ):
+    def _pose_job(self, job, result):
+        kp0, kp1 = result['kp0'], result['kp1']
+        if pose_client.is_running() and self.ply_path and self.vis_path:
+            # worker persistente: progetto e KD-tree già in memoria
+            job.progress("Pose estimation in corso (worker)...")
+            try:
+                with tracing.span("gui.pose_request", items=len(kp0)):
+                    pose_client.request_pose(self.ply_path, self.vis_path,
+                                             os.path.basename(result['ref']), result['tgt'], kp0, kp1)
+            except (OSError, RuntimeError) as e:
+                return f"Pose estimation fallita: {e}"
+            return "Pose estimation completata (worker)."
+        # matches_output.bin può essere già stato sovrascritto da un job
+        # successivo: lo script riceve il file dei match di questa coppia
+        matches_file = os.path.join("output", "jobs", f"matches_{job.id}.bin")
+        os.makedirs(os.path.dirname(matches_file), exist_ok=True)
+        matches_io.write_matches(matches_file, kp0, kp1, result['conf'], **result['meta'])
+        # lo script continua la traccia della GUI (TRACE_PARENT)
+        with tracing.span("gui.spawn"):
             subprocess.Popen([
                 "python", "./matching_and_pose/matching_and_pose.py",
-                self.image1_path, self.image2_path
-            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True)
-            self.status_label.config(text="Pose estimation avviata in background.")
-        else:
-            self.reset_ui()
+                result['ref'], result['tgt'], matches_file
+            ], stdout=subprocess.PIPE, stderr=subprocess.PIPE, start_new_session=True,
+                env=tracing.child_env())
+        return "Pose estimation avviata in background."
+
+    def _job_progress(self, job, text, fraction):
+        self.status_label.config(text=text)
+        if fraction is not None and job is self.jobs.running:
+            self.progress['value'] = fraction * 100
+
+    def _job_failed(self, job, error):
+        self.status_label.config(text=f"{job.label} non riuscito: {type(error).__name__}: {error}")
+
+    def _jobs_changed(self, _queue=None):
+        running = self.jobs.running
+        pending = len(self.jobs.pending) + len(self.pose_jobs.jobs)
+        self.queue_label.config(text=f"In coda: {pending}" if pending else "")
+        self.cancel_btn.config(state="normal" if self.jobs.busy() else "disabled")
+        if running is None:
+            self.progress['value'] = 0
+
+    def cancel_job(self):
+        """Annulla il matching in corso (i job in coda proseguono)."""
+        job = self.jobs.running or next(iter(self.jobs.pending), None)
+        if job is not None:
+            job.cancel()
+            self.status_label.config(text=f"Annullato: {job.label}")
 
-    def _display_scaled(self, array):
-        """Adapt image to canvas without distortion"""
-        self._last_array = array   # save actual image on _last_array
-        self.canvas.delete("all")   # delete all on canvas before re-drawing
-        img = Image.fromarray(array)   # convert NumPy array in PIL image
-        cw, ch = self.canvas.winfo_width(), self.canvas.winfo_height()  # obtain actual canvas dimensions
-        scale = min(cw / img.width, ch / img.height) # evalutate scale factor to re-drawing the image maintaining the dimensions 
-        nw, nh = int(img.width * scale), int(img.height * scale)  # garantee that image will be not cut
-        img_resized = img.resize((nw, nh), Image.LANCZOS)  #LANCZOS -> high quality filter to scaling 
-        self.tk_output_image = ImageTk.PhotoImage(img_resized) #convert PIL in an object compatible with Tkinter
-        x, y = (cw - nw) // 2, (ch - nh) // 2   # coordinates to center image in canvas
-        self.canvas.create_image(x, y, anchor=tk.NW, image=self.tk_output_image)
-
-    def _on_canvas_resize(self, event):  #called every canvas dimension change
-        if self._last_array is not None:
-            self._display_scaled(self._last_array)  # scaled the image with the new dimension of the canvas
+    def close(self):
+        self.jobs.shutdown()
+        self.pose_jobs.shutdown()
+        self.root.destroy()
 
 if __name__ == '__main__':
     root = tk.Tk()
     app = MatchingApp(root)
-    root.protocol("WM_DELETE_WINDOW", root.destroy)
+    root.update_idletasks()
+    startup = time.perf_counter() - _T_START
+    print(f"[Startup] finestra pronta in {startup:.2f}s (budget {STARTUP_BUDGET_S:.2f}s)")
+    if startup > STARTUP_BUDGET_S:
+        print(f"[Startup] ATTENZIONE: budget di avvio superato di {startup - STARTUP_BUDGET_S:.2f}s")
+    root.protocol("WM_DELETE_WINDOW", app.close)
     root.mainloop()
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+"""
+Registro dei modelli di matching residenti in memoria.
+
+Ogni backend (OmniGlue, LiftFeat, LightGlue) viene caricato una sola
+volta, al primo uso, e riutilizzato a ogni chiamata successiva con la
+stessa configurazione (soglie, numero di keypoint, percorsi dei pesi).
+Se il processo supera il budget di memoria, i modelli usati meno di
+recente vengono scaricati.
+
+Il budget si imposta con set_budget_mb() o con la variabile d'ambiente
+MATCHER_MEMORY_BUDGET_MB (default 6144).
+"""
+import gc
+import os
+import sys
+import importlib
+import threading
+import time
+from collections import OrderedDict
+
+try:
+    import psutil
+except ImportError:  # opzionale: senza psutil si usa /proc o la stima dei modelli
+    psutil = None
+
+_here = os.path.join(os.path.dirname(os.path.abspath(__file__)), "matching_and_pose")
+if _here not in sys.path:
+    sys.path.insert(0, _here)
+import tracing
+
+_lock = threading.RLock()
+_models = OrderedDict()   # chiave -> _Entry, dal meno al più recente
+_loading = {}             # chiave -> Lock del caricamento in corso
+
+# Backend registrati per nome: (modulo, funzione di matching).
+# Il modulo viene importato solo quando il backend è richiesto.
+BACKENDS = OrderedDict([
+    ("OmniGlue", ("omniglue_matcher", "run_omniglue")),
+    ("LiftFeat", ("liftfeat_matcher", "run_liftfeat")),
+    ("LightGlue", ("lightglue_matcher", "run_lightglue")),
+])
+import_times = {}         # nome backend -> secondi di import
+_budget = int(os.environ.get('MATCHER_MEMORY_BUDGET_MB', 6144)) << 20
+# dimensione assunta per un modello di cui non si è misurato nulla
+UNKNOWN_MODEL_BYTES = 512 << 20
+
+
+class _Entry:
+    def __init__(self, model, nbytes, load_s):
+        self.model = model
+        self.nbytes = nbytes
+        self.load_s = load_s
+
+    @property
+    def size(self) -> int:
+        """Byte stimati per il budget; mai 0, o evict scaricherebbe tutto."""
+        return self.nbytes or UNKNOWN_MODEL_BYTES
+
+
+def register_backend(name: str, module: str, func: str):
+    BACKENDS[name] = (module, func)
+
+
+def _module(name: str):
+    module_name = BACKENDS[name][0]
+    if module_name in sys.modules:
+        # sempre import_module, mai sys.modules direttamente: se il thread
+        # di warm-up sta ancora importando il modulo, import_module attende
+        # il lock di import del modulo invece di restituirlo a metà
+        return importlib.import_module(module_name)
+    t0 = time.perf_counter()
+    with tracing.span("model.import", backend=name):
+        module = importlib.import_module(module_name)
+    import_times.setdefault(name, time.perf_counter() - t0)
+    print(f"[MatcherRegistry] import {module_name}: {import_times[name]:.2f}s")
+    return module
+
+
+def backend(name: str):
+    """
+    Importa (la prima volta) il modulo del backend `name` e ritorna la
+    sua funzione run_*; il tempo di import viene registrato in import_times.
+    """
+    return getattr(_module(name), BACKENDS[name][1])
+
+
+def backend_many(name: str):
+    """
+    Funzione match_many (uno-a-molti) del backend `name`, None se il
+    backend non la fornisce.
+    """
+    return getattr(_module(name), 'match_many', None)
+
+
+def warmup(name: str):
+    """Importa il backend e carica il suo modello con la configurazione di default."""
+    module = _module(name)
+    if hasattr(module, 'warmup'):
+        module.warmup()
+
+
+def _rss():
+    """Memoria residente del processo in byte, None se non misurabile."""
+    if psutil is not None:
+        return psutil.Process().memory_info().rss
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def _param_bytes(model):
+    """Byte dei parametri torch contenuti in model (anche tuple/attributi)."""
+    torch = sys.modules.get('torch')
+    if torch is None:
+        return 0
+    seen, total = set(), 0
+    todo = list(model) if isinstance(model, (tuple, list)) else [model]
+    todo += [v for m in list(todo) for v in getattr(m, '__dict__', {}).values()]
+    for m in todo:
+        if isinstance(m, torch.nn.Module):
+            for p in m.parameters():
+                if id(p) not in seen:
+                    seen.add(id(p))
+                    total += p.numel() * p.element_size()
+    return total
+
+
+def _key(backend, config):
+    return (backend,) + tuple(sorted(config.items()))
+
+
+def set_budget_mb(mb: int):
+    global _budget
+    _budget = int(mb) << 20
+    evict()
+
+
+def get(backend: str, loader, **config):
+    """
+    Ritorna il modello di `backend` per la configurazione data,
+    caricandolo con loader(**config) solo se non è già residente.
+
+    Il caricamento avviene fuori dal lock del registro, con un lock per
+    chiave: chi chiede lo stesso modello attende, chi chiede un modello
+    già residente no.
+    """
+    key = _key(backend, config)
+    with _lock:
+        entry = _models.get(key)
+        if entry is not None:
+            _models.move_to_end(key)
+            return entry.model
+        key_lock = _loading.setdefault(key, threading.Lock())
+
+    with key_lock:
+        with _lock:
+            entry = _models.get(key)
+        if entry is None:
+            # con più caricamenti in parallelo la differenza di RSS è
+            # solo una stima; resta il conteggio dei parametri torch
+            rss0 = _rss()
+            t0 = time.perf_counter()
+            with tracing.span("model.load", backend=backend) as sp:
+                model = loader(**config)
+                load_s = time.perf_counter() - t0
+                rss1 = _rss()
+                nbytes = max(rss1 - rss0, 0) if rss0 is not None and rss1 is not None else 0
+                sp.set(bytes=nbytes)
+            entry = _Entry(model, nbytes or _param_bytes(model), load_s)
+            print(f"[MatcherRegistry] {backend} caricato in {load_s:.1f}s "
+                  f"(~{entry.size >> 20} MB)")
+        with _lock:
+            _models[key] = entry
+            _models.move_to_end(key)
+            _loading.pop(key, None)
+            evict(keep=key)
+    return entry.model
+
+
+def _usage():
+    rss = _rss()
+    return rss if rss is not None else sum(e.size for e in _models.values())
+
+
+def evict(keep=None):
+    """Scarica i modelli meno recenti finché il processo supera il budget."""
+    with _lock:
+        # l'RSS non cala subito dopo il rilascio: si usa la stima per modello
+        over = _usage() - _budget
+        freed = 0
+        while freed < over:
+            victim = next((k for k in _models if k != keep), None)
+            if victim is None:
+                break
+            freed += _models.pop(victim).size
+            print(f"[MatcherRegistry] {victim[0]} scaricato (budget {_budget >> 20} MB)")
+        if freed:
+            gc.collect()
+            torch = sys.modules.get('torch')
+            if torch is not None and torch.cuda.is_available():
+                torch.cuda.empty_cache()
+
+
+def unload(backend: str = None):
+    """Scarica tutti i modelli (o solo quelli di `backend`)."""
+    with _lock:
+        for k in [k for k in _models if backend is None or k[0] == backend]:
+            _models.pop(k)
+        gc.collect()
+
+
+def loaded():
+    """Elenco (backend, config, MB stimati) dei modelli residenti."""
+    with _lock:
+        return [(k[0], dict(k[1:]), e.size >> 20) for k, e in _models.items()]
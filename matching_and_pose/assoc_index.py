@@ -0,0 +1,211 @@
+"""
+Indice di associazione 2D per una camera di riferimento.
+
+Dato un keypoint di riferimento trova il punto 2D visibile (e quindi il
+punto 3D) più vicino entro una soglia in pixel. L'indice si costruisce
+una volta per camera e si salva nell'archivio di visibilità
+(`<visibility>.store/assoc/<i>.pkl`), così i target successivi sulla
+stessa camera non ricostruiscono il KD-tree.
+
+Due strutture:
+    KD-tree (cKDTree)      query parallele (workers) con distance_upper_bound
+    griglia uniforme       hash per celle di lato `cell` px; per camere
+                           molto dense è più veloce del KD-tree
+"""
+import os
+import uuid
+import pickle
+import numpy as np
+from scipy.spatial import cKDTree
+
+INDEX_VERSION = 1
+
+# densità (punti per px²) oltre la quale 'auto' usa la griglia
+GRID_DENSITY = 0.1
+
+# celle vicine visitate dalla query su griglia (3×3)
+_OFFSETS = np.array([(dx, dy) for dy in (-1, 0, 1) for dx in (-1, 0, 1)])
+
+
+class AssociationIndex:
+    """
+    Indice 2D sui punti visibili di una camera.
+
+    Parametri
+    ----------
+    p2D : np.ndarray, shape (n,2)
+        Coordinate 2D dei punti visibili.
+    cell : float
+        Lato delle celle della griglia in pixel; la griglia è esatta per
+        query con max_dist <= cell.
+    """
+    def __init__(self, p2D, cell=3.0):
+        p2D = np.asarray(p2D, dtype=np.float32).reshape(-1, 2)
+        self.n = p2D.shape[0]
+        self.cell = float(cell)
+        self.tree = cKDTree(p2D, balanced_tree=False)
+        self._build_grid(p2D)
+
+    def _build_grid(self, p2D):
+        if self.n == 0:
+            self.origin = np.zeros(2)
+            self.shape = (0, 0)
+            self.order = np.zeros(0, dtype=np.int32)
+            self.starts = np.zeros(1, dtype=np.int64)
+            self.grid_p2D = p2D
+            return
+        self.origin = p2D.min(axis=0).astype(float)
+        c = np.floor((p2D - self.origin) / self.cell).astype(np.int64)
+        nx, ny = c.max(axis=0) + 1
+        key = c[:, 1] * nx + c[:, 0]
+        # CSR: i punti della cella k sono order[starts[k]:starts[k+1]]
+        self.shape = (int(nx), int(ny))
+        self.order = np.argsort(key, kind='stable').astype(np.int32)
+        self.starts = np.zeros(nx * ny + 1, dtype=np.int64)
+        np.cumsum(np.bincount(key, minlength=nx * ny), out=self.starts[1:])
+        self.grid_p2D = p2D[self.order]
+
+    @property
+    def density(self) -> float:
+        """Punti per pixel² nell'ingombro della camera."""
+        nx, ny = self.shape
+        return self.n / max(nx * ny * self.cell ** 2, 1.0)
+
+    @property
+    def nbytes(self) -> int:
+        # griglia + stima del KD-tree (copia dei dati float64 + indici + nodi)
+        return self.order.nbytes + self.starts.nbytes + self.grid_p2D.nbytes + self.n * 40
+
+    def _query_tree(self, pts, max_dist, workers):
+        d, i = self.tree.query(pts, k=2, distance_upper_bound=max_dist, workers=workers)
+        return d[:, 0], i[:, 0], d[:, 1]
+
+    def _query_grid(self, pts, max_dist):
+        Q = pts.shape[0]
+        nx, ny = self.shape
+        best = np.full(Q, np.inf)
+        second = np.full(Q, np.inf)
+        best_i = np.full(Q, self.n)
+        if self.n == 0 or Q == 0:
+            return best, best_i, second
+
+        # celle 3×3 attorno a ogni query, in ordine di query
+        c = np.floor((pts - self.origin) / self.cell).astype(np.int64)
+        cx = c[:, :1] + _OFFSETS[:, 0]
+        cy = c[:, 1:] + _OFFSETS[:, 1]
+        inside = (cx >= 0) & (cx < nx) & (cy >= 0) & (cy < ny)
+        key = np.where(inside, cy * nx + cx, 0)
+        s = np.where(inside, self.starts[key], 0).ravel()
+        n = np.where(inside, self.starts[key + 1] - self.starts[key], 0).ravel()
+
+        # espansione dei candidati: posizione nella griglia e query di appartenenza
+        total = int(n.sum())
+        if total == 0:
+            return best, best_i, second
+        pos = np.arange(total) - np.repeat(np.cumsum(n) - n - s, n)
+        cnt = n.reshape(Q, -1).sum(axis=1)
+        qi = np.repeat(np.arange(Q), cnt)
+        d2 = ((self.grid_p2D[pos] - pts[qi]) ** 2).sum(axis=1)
+
+        # minimo e secondo minimo per query (segmenti contigui)
+        has = cnt > 0
+        seg = (np.cumsum(cnt) - cnt)[has]
+        best[has] = np.minimum.reduceat(d2, seg)
+        hit = np.flatnonzero(d2 == np.repeat(best, cnt))
+        hit = hit[np.r_[True, qi[hit][1:] != qi[hit][:-1]]]     # primo a pari distanza
+        best_i[qi[hit]] = self.order[pos[hit]]
+        d2[hit] = np.inf
+        second[has] = np.minimum.reduceat(d2, seg)
+
+        best, second = np.sqrt(best), np.sqrt(second)
+        far = best >= max_dist
+        best[far] = np.inf
+        best_i[far] = self.n
+        second[second >= max_dist] = np.inf
+        return best, best_i, second
+
+    def query(self, pts, max_dist=3.0, ambiguity_ratio=None, mutual=False,
+              workers=-1, method='auto'):
+        """
+        Associa ogni punto di `pts` al punto visibile più vicino.
+
+        Parametri
+        ----------
+        pts : np.ndarray, shape (Q,2)
+            Keypoint sull'immagine di riferimento.
+        max_dist : float
+            Distanza massima in pixel.
+        ambiguity_ratio : float, opzionale
+            Se un secondo punto cade entro max_dist e d1 > ratio * d2,
+            l'associazione è ambigua (punti 3D diversi sotto lo stesso
+            keypoint) e viene scartata.
+        mutual : bool
+            Tiene solo associazioni uno-a-uno: se più keypoint cadono
+            sullo stesso punto resta il più vicino.
+        workers : int
+            Thread per la query sul KD-tree (-1 = tutti i core).
+        method : 'auto', 'kdtree' o 'grid'
+
+        Ritorna
+        -------
+        idx : np.ndarray (Q,) int
+            Indice del punto associato nella camera (valido dove mask).
+        mask : np.ndarray (Q,) bool
+        dist : np.ndarray (Q,)
+            Distanza in pixel (inf dove non associato).
+        """
+        pts = np.asarray(pts, dtype=float).reshape(-1, 2)
+        if method == 'auto':
+            method = 'grid' if max_dist <= self.cell and self.density >= GRID_DENSITY else 'kdtree'
+        if method == 'grid':
+            if max_dist > self.cell:
+                raise ValueError(f"La griglia richiede max_dist <= {self.cell}")
+            dist, idx, second = self._query_grid(pts, max_dist)
+        elif method == 'kdtree':
+            dist, idx, second = self._query_tree(pts, max_dist, workers)
+        else:
+            raise ValueError(f"Metodo sconosciuto: {method}")
+
+        mask = idx < self.n
+        if ambiguity_ratio is not None:
+            mask &= ~(np.isfinite(second) & (dist > ambiguity_ratio * second))
+        if mutual and mask.any():
+            q = np.flatnonzero(mask)
+            q = q[np.lexsort((dist[q], idx[q]))]
+            dup = np.r_[False, idx[q][1:] == idx[q][:-1]]
+            mask[q[dup]] = False
+        idx = np.where(mask, idx, 0)
+        dist = np.where(mask, dist, np.inf)
+        return idx, mask, dist
+
+    def query_radius(self, pts, r=3.0, workers=-1):
+        """Tutti i punti entro `r` px da ciascun punto di `pts` (liste di indici)."""
+        return self.tree.query_ball_point(np.asarray(pts, dtype=float).reshape(-1, 2),
+                                          r, workers=workers)
+
+    def save(self, path, source=None):
+        """Salva l'indice (KD-tree già costruito incluso); `source` è la firma dei dati."""
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        # nome temporaneo del processo: più worker possono salvare lo
+        # stesso indice insieme, vince l'ultimo replace (contenuto uguale)
+        tmp = f"{path}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        try:
+            with open(tmp, 'wb') as f:
+                pickle.dump({'version': INDEX_VERSION, 'source': source, 'index': self}, f,
+                            protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp, path)
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+    @staticmethod
+    def load(path, source=None):
+        """
+        Carica un indice salvato con save(); ValueError se è di un'altra
+        versione o costruito su dati diversi da `source`.
+        """
+        with open(path, 'rb') as f:
+            data = pickle.load(f)
+        if data.get('version') != INDEX_VERSION or data.get('source') != source:
+            raise ValueError(f"Indice di associazione non aggiornato: {path}")
+        return data['index']
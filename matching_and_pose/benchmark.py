@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""
+Microbenchmark dei kernel di pose estimation su scene sintetiche.
+
+    python benchmark.py run --sizes 100,1000,10000,100000,1000000 --out bench.json
+    python benchmark.py compare old.json new.json [--time-threshold 0.15]
+
+Per ogni dimensione genera una scena (cloud casuale davanti alla camera,
+K/R/t noti, proiezioni 2D con rumore, .ply binario e file di visibilità
+in una cartella temporanea) e per ogni kernel misura:
+    tempo       mediana e minimo su più ripetizioni
+    memoria     picco delle allocazioni (tracemalloc, esecuzione separata)
+    accuratezza errore rispetto alla verità nota (rotazione in gradi,
+                traslazione relativa, scarto massimo, ...) o a
+                un'implementazione di riferimento (Fiore 'full',
+                numpy eigh)
+
+I risultati sono JSON; `run` termina con codice 1 se un errore supera i
+limiti assoluti di ACCURACY_LIMITS, `compare` se un kernel peggiora
+oltre le soglie (tempo, memoria, accuratezza) rispetto al run precedente.
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import tracemalloc
+import warnings
+import numpy as np
+
+import absolute
+import cloud_get_points
+import exterior_fiore
+import ns
+import proj
+import pt
+import ransac
+import vtrans
+
+DEFAULT_SIZES = (100, 1000, 10_000, 100_000, 1_000_000)
+BENCH_CAMERA = 'bench.jpg'
+
+# errori massimi ammessi rispetto a un'implementazione di riferimento:
+# le varianti veloci devono dare lo stesso risultato, non solo uno vicino
+ACCURACY_LIMITS = {
+    'G_vs_full': 1e-8,        # exterior_fiore 'linear' contro 'full'
+    's_vs_full': 1e-8,        # scala, relativo
+    'angle_vs_eigh': 1e-8,    # ns_diag_lowrank contro numpy eigh (rad)
+    'angle_rad': 1e-6,        # ns_diag_lowrank contro il vettore noto
+}
+
+
+# ---------------------------------------------------------------- scene
+
+def make_scene(n, seed=0, noise=0.5, outliers=0.3):
+    """Scena sintetica con n punti: cloud, camera nota e proiezioni."""
+    rng = np.random.default_rng(seed)
+    W, H = 1600, 1200
+    K = np.array([[1400.0, 0, W / 2], [0, 1400.0, H / 2], [0, 0, 1]])
+    a, b, c = rng.uniform(-0.3, 0.3, 3)
+    Rx = np.array([[1, 0, 0], [0, np.cos(a), -np.sin(a)], [0, np.sin(a), np.cos(a)]])
+    Ry = np.array([[np.cos(b), 0, np.sin(b)], [0, 1, 0], [-np.sin(b), 0, np.cos(b)]])
+    Rz = np.array([[np.cos(c), -np.sin(c), 0], [np.sin(c), np.cos(c), 0], [0, 0, 1]])
+    R = Rz @ Ry @ Rx
+    t = np.array([0.2, -0.1, 12.0])
+
+    # punti nel frustum: profondità 6-18, coordinate immagine uniformi
+    depth = rng.uniform(6, 18, n)
+    uv = rng.uniform([0, 0], [W, H], (n, 2))
+    Xc = np.c_[(uv - K[:2, 2]) / K[0, 0] * depth[:, None], depth]
+    X = ((Xc - t) @ R).astype(np.float32).astype(float)   # come nel .ply (float32)
+
+    x = (X @ R.T + t) @ K.T
+    uv = x[:, :2] / x[:, 2:]
+    uv_noisy = uv + rng.normal(0, noise, uv.shape)
+    bad = rng.random(n) < outliers
+    uv_out = uv_noisy.copy()
+    uv_out[bad] = rng.uniform([0, 0], [W, H], (int(bad.sum()), 2))
+    return {'n': n, 'K': K, 'R': R, 't': t, 'X': X, 'uv': uv, 'uv_noisy': uv_noisy,
+            'uv_outliers': uv_out, 'W': W, 'H': H, 'rng': rng}
+
+
+def write_scene_files(scene, directory, n_cameras=4):
+    """
+    .ply binario (float32 x,y,z) e file di visibilità con `n_cameras`
+    camere; BENCH_CAMERA vede tutti i punti, le altre una metà casuale.
+    """
+    X = scene['X'].astype(np.float32)
+    n = X.shape[0]
+    ply_file = os.path.join(directory, 'cloud.ply')
+    with open(ply_file, 'wb') as f:
+        f.write((f"ply\nformat binary_little_endian 1.0\nelement vertex {n}\n"
+                 "property float x\nproperty float y\nproperty float z\nend_header\n").encode())
+        X.astype('<f4').tofile(f)
+
+    vis_file = os.path.join(directory, 'visibility.txt')
+    rng = scene['rng']
+    with open(vis_file, 'w') as f:
+        for c in range(n_cameras):
+            name = BENCH_CAMERA if c == 0 else f"cam_{c}.jpg"
+            ids = np.arange(n) if c == 0 else np.flatnonzero(rng.random(n) < 0.5)
+            uv = scene['uv'][ids]
+            f.write(f"Visibility for camera {name}\n{ids.size}\n")
+            np.savetxt(f, np.c_[ids, uv], fmt=['%d', '%.4f', '%.4f'])
+    return ply_file, vis_file
+
+
+# ---------------------------------------------------------------- metriche
+
+def _pose_errors(G, scene):
+    R, t = G[:, :3], G[:, 3]
+    cos = (np.trace(R @ scene['R'].T) - 1) / 2
+    return {'rot_deg': float(np.degrees(np.arccos(np.clip(cos, -1, 1)))),
+            'trans_rel': float(np.linalg.norm(t - scene['t']) / np.linalg.norm(scene['t']))}
+
+
+def _max_abs(a, b):
+    return {'max_abs': float(np.max(np.abs(np.asarray(a, float) - np.asarray(b, float))))}
+
+
+def _angle(v, w):
+    # arctan2 invece di arccos: precisa anche per angoli sotto 1e-8
+    v = v / np.linalg.norm(v)
+    w = w / np.linalg.norm(w)
+    c = np.dot(v, w)
+    return {'angle_rad': float(np.arctan2(np.linalg.norm(v - c * w), abs(c)))}
+
+
+# ---------------------------------------------------------------- kernel
+#
+# Ogni kernel è (nome, n massimo, setup): setup(scene) prepara gli input
+# e ritorna (funzione senza argomenti, verifica(risultato) -> dict).
+
+def _k_fiore(method):
+    def setup(s):
+        m3d, m2d = s['X'].T, s['uv_noisy'].T
+        return (lambda: exterior_fiore.exterior_fiore(s['K'], m3d, m2d, method=method),
+                lambda r: _pose_errors(r[0], s))
+    return setup
+
+
+def _k_fiore_vs_full(s):
+    # scena con outlier (e rumore): il nucleo di L non è esatto e la
+    # variante lineare deve risolvere davvero l'equazione secolare
+    m3d, m2d = s['X'].T, s['uv_outliers'].T
+    G_full, s_full = exterior_fiore.exterior_fiore(s['K'], m3d, m2d, method='full')
+    return (lambda: exterior_fiore.exterior_fiore(s['K'], m3d, m2d, method='linear'),
+            lambda r: {'G_vs_full': float(np.max(np.abs(r[0] - G_full))),
+                       's_vs_full': float(abs(r[1] - s_full) / abs(s_full))})
+
+
+def _k_ransac(s):
+    m3d, m2d = s['X'].T, s['uv_outliers'].T
+    return (lambda: ransac.ransac_fiore(s['K'], m3d, m2d, seed=0),
+            lambda r: _pose_errors(r[0], s))
+
+
+def _k_absolute(s):
+    scale = 2.5
+    Y = s['X'].T                                        # 3xN
+    X = (s['X'] @ s['R'].T + s['t']) * scale            # Nx3
+    return (lambda: absolute.absolute(X, Y, method='scale'),
+            lambda r: dict(_pose_errors(r[0], s), scale_err=float(abs(r[1] - scale))))
+
+
+def _k_ns(s):
+    n = s['n']
+    rng = np.random.default_rng(1)
+    v = rng.normal(size=n)
+    v /= np.linalg.norm(v)
+    A = rng.normal(size=(n + 8, n))
+    A -= np.outer(A @ v, v)                             # nucleo = span(v)
+    return (lambda: ns.ns(A), lambda r: _angle(r, v))
+
+
+def _k_ns_lowrank(s):
+    n = s['n']
+    rng = np.random.default_rng(1)
+    v = rng.uniform(0.5, 1.5, n)
+    C = rng.uniform(0, 1, (n, 12))
+    d = (C @ (C.T @ v)) / v                             # (diag(d) - CC^T) v = 0
+    # diag(d) - CC^T è una M-matrice singolare (C >= 0, v > 0): v è
+    # l'autovettore dell'autovalore minimo 0. Lo spostamento lo porta a
+    # lam > 0, così la radice dell'equazione secolare non è in lam = 0
+    d = d + 0.3 * d.min()
+    def check(r):
+        acc = _angle(r, v)
+        if n <= 2000:
+            w = np.linalg.eigh(np.diag(d) - C @ C.T)[1][:, 0]
+            acc['angle_vs_eigh'] = _angle(r, w)['angle_rad']
+        return acc
+    return (lambda: ns.ns_diag_lowrank(d, C), check)
+
+
+def _k_vtrans(s):
+    x = s['X'].ravel()
+    return (lambda: vtrans.vtrans(x, 3), lambda r: _max_abs(r, x.reshape(3, -1)))
+
+
+def _k_pt(s):
+    Hm = np.array([[1.01, 0.02, 3.0], [-0.01, 0.99, -2.0], [1e-5, 2e-5, 1.0]])
+    m = s['uv'].T
+    h = Hm @ np.vstack([m, np.ones(m.shape[1])])
+    return (lambda: pt.pt(Hm, m), lambda r: _max_abs(r, h[:2] / h[2]))
+
+
+def _k_proj(s):
+    P = s['K'] @ np.c_[s['R'], s['t']]
+    return (lambda: proj.proj(P, s['X']),
+            lambda r: {'max_px': float(np.max(np.abs(np.c_[r[0], r[1]] - s['uv'])))})
+
+
+def _k_proj_batch(s):
+    P = np.repeat((s['K'] @ np.c_[s['R'], s['t']])[None], 16, axis=0)
+    return (lambda: proj.proj_batch(P, s['X']),
+            lambda r: {'max_px': float(max(np.max(np.abs(r[0] - s['uv'][:, 0])),
+                                           np.max(np.abs(r[1] - s['uv'][:, 1]))))})
+
+
+def _k_cloud(use_store):
+    def setup(s):
+        ply_file, vis_file = s['files']
+        cloud_get_points.cloud_get_points(ply_file, vis_file, BENCH_CAMERA, use_store)  # cache/archivio
+        return (lambda: cloud_get_points.cloud_get_points(ply_file, vis_file, BENCH_CAMERA, use_store),
+                lambda r: {'p3D_max_abs': _max_abs(r[1], s['X'])['max_abs'],
+                           'p2D_max_abs': _max_abs(r[0], s['uv'])['max_abs']})
+    return setup
+
+
+KERNELS = [
+    ('exterior_fiore', 1_000, _k_fiore('full')),     # memoria O(N^2)
+    ('exterior_fiore_linear', 1_000_000, _k_fiore('linear')),
+    ('exterior_fiore_linear_vs_full', 1_000, _k_fiore_vs_full),
+    ('ransac_fiore', 100_000, _k_ransac),
+    ('absolute', 1_000_000, _k_absolute),
+    ('ns', 1_000, _k_ns),
+    ('ns_diag_lowrank', 1_000_000, _k_ns_lowrank),
+    ('vtrans', 1_000_000, _k_vtrans),
+    ('pt', 1_000_000, _k_pt),
+    ('proj', 1_000_000, _k_proj),
+    ('proj_batch', 1_000_000, _k_proj_batch),
+    ('cloud_get_points', 1_000_000, _k_cloud(True)),
+    ('cloud_get_points_text', 100_000, _k_cloud(False)),
+]
+
+
+# ---------------------------------------------------------------- run
+
+def _time(fn, min_time=0.2, max_reps=50):
+    """Ripete fn finché non accumula min_time secondi (almeno 3 volte)."""
+    times = []
+    while len(times) < 3 or (sum(times) < min_time and len(times) < max_reps):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return times
+
+
+def _peak(fn):
+    tracemalloc.start()
+    try:
+        fn()
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def over_limits(rec):
+    """Misure di accuratezza di un risultato oltre ACCURACY_LIMITS."""
+    return [k for k, v in rec['accuracy'].items() if k in ACCURACY_LIMITS and v > ACCURACY_LIMITS[k]]
+
+
+def run(sizes=DEFAULT_SIZES, kernels=None, seed=0, min_time=0.2, verbose=True):
+    """Esegue i kernel richiesti su tutte le dimensioni; ritorna il dict dei risultati."""
+    selected = [k for k in KERNELS if kernels is None or k[0] in kernels]
+    results = []
+    for n in sizes:
+        scene = make_scene(n, seed)
+        tmp = tempfile.mkdtemp(prefix='bench_')
+        try:
+            if any(name.startswith('cloud_get_points') and n <= max_n for name, max_n, _ in selected):
+                scene['files'] = write_scene_files(scene, tmp)
+            for name, max_n, setup in selected:
+                if n > max_n:
+                    continue
+                fn, check = setup(scene)
+                with warnings.catch_warnings():
+                    warnings.simplefilter('ignore')
+                    result = fn()
+                    times = _time(fn, min_time)
+                    peak = _peak(fn)
+                rec = {'kernel': name, 'n': n, 'time_s': float(np.median(times)),
+                       'time_min_s': float(np.min(times)), 'reps': len(times),
+                       'peak_bytes': int(peak), 'accuracy': check(result)}
+                rec['over_limits'] = over_limits(rec)
+                results.append(rec)
+                if verbose:
+                    acc = ', '.join(f"{k}={v:.2e}" for k, v in rec['accuracy'].items())
+                    print(f"{name:24s} n={n:>8d}  {rec['time_s'] * 1e3:10.3f} ms  "
+                          f"{peak / 2**20:9.1f} MB  {acc}"
+                          + (f"  OLTRE IL LIMITE: {', '.join(rec['over_limits'])}" if rec['over_limits'] else ''))
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+    return {'meta': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'platform': platform.platform(), 'cpus': os.cpu_count(),
+                     'seed': seed, 'date': time.strftime('%Y-%m-%dT%H:%M:%S')},
+            'results': results}
+
+
+# ---------------------------------------------------------------- compare
+
+def compare(old, new, time_threshold=0.15, mem_threshold=0.20, acc_factor=2.0,
+            min_time_diff=50e-6, min_mem_diff=1 << 20, acc_floor=1e-9):
+    """
+    Confronta due run (dict di run()). Una riga è una regressione se
+    il tempo cresce oltre `time_threshold` (relativo) e `min_time_diff`,
+    il picco di memoria oltre `mem_threshold` e `min_mem_diff`, un
+    errore di accuratezza di oltre `acc_factor` volte (sopra acc_floor)
+    o oltre i limiti assoluti di ACCURACY_LIMITS.
+
+    Ritorna (righe, regressioni), dove ogni riga è un dict.
+    """
+    before = {(r['kernel'], r['n']): r for r in old['results']}
+    rows, regressions = [], []
+    for r in new['results']:
+        o = before.get((r['kernel'], r['n']))
+        if o is None:
+            continue
+        issues = []
+        dt = r['time_s'] - o['time_s']
+        if dt > min_time_diff and r['time_s'] > o['time_s'] * (1 + time_threshold):
+            issues.append('time')
+        dm = r['peak_bytes'] - o['peak_bytes']
+        if dm > min_mem_diff and r['peak_bytes'] > o['peak_bytes'] * (1 + mem_threshold):
+            issues.append('memory')
+        for k, v in r['accuracy'].items():
+            ov = o['accuracy'].get(k)
+            if ov is not None and v > acc_floor and v > acc_factor * ov:
+                issues.append(f"accuracy:{k}")
+        issues += [f"limit:{k}" for k in over_limits(r) if f"accuracy:{k}" not in issues]
+        row = {'kernel': r['kernel'], 'n': r['n'],
+               'time_ratio': r['time_s'] / o['time_s'] if o['time_s'] else float('inf'),
+               'mem_ratio': r['peak_bytes'] / o['peak_bytes'] if o['peak_bytes'] else float('inf'),
+               'issues': issues}
+        rows.append(row)
+        if issues:
+            regressions.append(row)
+    return rows, regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark dei kernel di pose estimation")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    r = sub.add_parser('run', help="esegue il benchmark")
+    r.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                   help="dimensioni delle scene, separate da virgola")
+    r.add_argument('--kernels', default=None, help="sottoinsieme di kernel, separati da virgola")
+    r.add_argument('--seed', type=int, default=0)
+    r.add_argument('--min-time', type=float, default=0.2, help="secondi minimi di misura per kernel")
+    r.add_argument('--out', default='benchmark.json')
+    c = sub.add_parser('compare', help="confronta due run")
+    c.add_argument('old')
+    c.add_argument('new')
+    c.add_argument('--time-threshold', type=float, default=0.15)
+    c.add_argument('--mem-threshold', type=float, default=0.20)
+    c.add_argument('--acc-factor', type=float, default=2.0)
+    args = parser.parse_args()
+
+    if args.cmd == 'run':
+        sizes = [int(s) for s in args.sizes.split(',')]
+        kernels = set(args.kernels.split(',')) if args.kernels else None
+        unknown = (kernels or set()) - {k[0] for k in KERNELS}
+        if unknown:
+            parser.error(f"kernel sconosciuti: {', '.join(sorted(unknown))}")
+        res = run(sizes, kernels, args.seed, args.min_time)
+        with open(args.out, 'w') as jf:
+            json.dump(res, jf, indent=2)
+        print(f"Risultati in {args.out}")
+        failed = [r for r in res['results'] if r['over_limits']]
+        if failed:
+            print(f"{len(failed)} risultati oltre i limiti di accuratezza")
+            sys.exit(1)
+        return
+
+    with open(args.old) as f:
+        old = json.load(f)
+    with open(args.new) as f:
+        new = json.load(f)
+    rows, regressions = compare(old, new, args.time_threshold, args.mem_threshold, args.acc_factor)
+    print(f"{'kernel':24s} {'n':>8s} {'tempo':>8s} {'memoria':>8s}")
+    for row in rows:
+        print(f"{row['kernel']:24s} {row['n']:>8d} {row['time_ratio']:7.2f}x {row['mem_ratio']:7.2f}x"
+              f"  {' '.join(row['issues'])}")
+    if regressions:
+        print(f"{len(regressions)} regressioni")
+        sys.exit(1)
+    print("Nessuna regressione")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,13 @@
-from plyfile import PlyData
 import numpy as np
 
-def cloud_get_points(zephyr_ply_file: str,
-                     visibility_point_file: str,
-                     img_name: str):
-    """
-    Analizza l'output di Zephyr:
-    - Legge la cloud di punti da un file .ply
-    - Cerca nel file di visibilità solo la sezione di `img_name`
-      ed estrae gli indici e le coordinate 2D
-
-    Parametri
-    ----------
-    zephyr_ply_file : str
-        Percorso al file .ply (sparse point cloud).
-    visibility_point_file : str
-        Percorso al file di visibilità (testuale).
-    img_name : str
-        Basename dell'immagine di cui estrarre la visibilità
-        (es. '20250124_113557.jpg').
+import ply_cache
+import visibility_store
 
-    Ritorna
-    -------
-    p2D : np.ndarray, shape (n_points, 2)
-        Coordinate 2D dei punti visibili per `img_name`.
-    p3D : np.ndarray, shape (n_points, 3)
-        Coordinate 3D corrispondenti nella cloud.
+def read_visibility_text(visibility_point_file: str, img_name: str):
+    """
+    Scansione del file di visibilità testuale (senza archivio binario):
+    ritorna (ids, p2D) della sezione `img_name`, liste vuote se assente.
     """
-    # 1) Lettura del .ply
-    
-    plydata = PlyData.read(zephyr_ply_file)
-    vertex = plydata['vertex']
-    X = np.vstack((vertex['x'], vertex['y'], vertex['z'])).T  # shape (N,3)
-
-    # 2) Lettura del file di visibilità, sezione img_name
     ids = []
     coords2D = []
     with open(visibility_point_file, 'r') as f:
@@ -64,13 +38,62 @@ def cloud_get_points(zephyr_ply_file: str,
                     pass
         i += 1
 
-    if not ids:
+    return ids, coords2D
+
+def cloud_get_points(zephyr_ply_file: str,
+                     visibility_point_file: str,
+                     img_name: str,
+                     use_store: bool = True):
+    """
+    Analizza l'output di Zephyr:
+    - Cerca nel file di visibilità solo la sezione di `img_name`
+      ed estrae gli indici e le coordinate 2D
+    - Legge dal file .ply solo i punti 3D di quegli indici
+
+    Parametri
+    ----------
+    zephyr_ply_file : str
+        Percorso al file .ply (sparse point cloud).
+    visibility_point_file : str
+        Percorso al file di visibilità (testuale).
+    img_name : str
+        Basename dell'immagine di cui estrarre la visibilità
+        (es. '20250124_113557.jpg').
+    use_store : bool, opzionale
+        Se True (default) usa l'archivio binario indicizzato accanto al
+        file di visibilità (visibility_store), creandolo o ricostruendolo
+        se il file sorgente è cambiato; legge solo la sezione di `img_name`.
+        Se False, o se l'archivio non si può scrivere, scansiona il testo.
+
+    Ritorna
+    -------
+    p2D : np.ndarray, shape (n_points, 2)
+        Coordinate 2D dei punti visibili per `img_name`.
+    p3D : np.ndarray, shape (n_points, 3)
+        Coordinate 3D corrispondenti nella cloud.
+    """
+    # 1) Lettura del file di visibilità, sezione img_name
+    ids = coords2D = None
+    if use_store:
+        try:
+            store = visibility_store.open_store(visibility_point_file)
+            if img_name in store:
+                ids, coords2D = store.camera(img_name)
+            else:
+                ids = []
+        except (OSError, ValueError):
+            ids = None
+    if ids is None:
+        ids, coords2D = read_visibility_text(visibility_point_file, img_name)
+
+    if len(ids) == 0:
         raise ValueError(f"Immagine '{img_name}' non trovata in {visibility_point_file}")
 
     p2D = np.array(coords2D, dtype=np.float32)   # (n,2)
     
-    # 3) Estrazione dei punti 3D corrispondenti
+    # 2) Solo i vertici visibili, dalla cache o dal blocco dei vertici
+    # del .ply: il cloud intero non passa mai in memoria
     indices = np.array(ids, dtype=int)
-    p3D = X[indices, :]                          # (n,3)
+    p3D = ply_cache.gather(zephyr_ply_file, indices)   # (n,3) float64
 
     return p2D, p3D
@@ -5,7 +5,7 @@ import pt
 from numpy.linalg import svd, matrix_rank, inv
 import vtrans
 
-def exterior_fiore(A, model3d, data2d):
+def exterior_fiore(A, model3d, data2d, method='full'):
     """
     Calcola l'orientamento esterno usando l'algoritmo di Fiore.
 
@@ -13,6 +13,11 @@ def exterior_fiore(A, model3d, data2d):
         A: matrice 3x3 di intrinseci (deve essere normalizzata: A[2,2] == 1)
         model3d: punti 3D (shape: 3xN)
         data2d: punti immagine (shape: 2xN)
+        method: 'full' (default) costruisce D e il prodotto di Kronecker
+                e risolve con SVD completa, memoria O(N^2);
+                'linear' sfrutta la struttura a blocchi diagonali di D
+                e non costruisce mai D né L: memoria e tempo O(N),
+                stesso risultato (vedi exterior_fiore_linear)
 
     Restituisce:
         G: matrice rigida 3x4 (rotazione + traslazione)
@@ -21,6 +26,11 @@ def exterior_fiore(A, model3d, data2d):
     if not np.isclose(A[2, 2], 1.0):
         raise ValueError("La matrice A deve essere normalizzata (A[2,2] == 1)")
 
+    if method == 'linear':
+        return exterior_fiore_linear(A, model3d, data2d)
+    elif method != 'full':
+        raise ValueError("Metodo non valido. Usa 'full' o 'linear'.")
+
     # Coordinate immagine normalizzate
     m = pt.pt(np.linalg.inv(A), data2d)
 
@@ -63,4 +73,50 @@ def exterior_fiore(A, model3d, data2d):
     
     G, s, _ = absolute.absolute(reshaped, model3d, method='scale')
 
-    return G, s
\ No newline at end of file
+    return G, s
+
+
+def exterior_fiore_linear(A, model3d, data2d):
+    """
+    Variante di exterior_fiore a memoria lineare nel numero di punti.
+
+    Con m_i le coordinate normalizzate omogenee e V2 la base del nucleo
+    di S, si ha L z = vec(M V2) con M = [z_1 m_1, ..., z_N m_N], quindi
+
+        L^T L = diag(|m_i|^2) - C C^T,   C[i, (a,b)] = m[a,i] * Q[i,b]
+
+    dove Q (N x r) è la base ortonormale dello spazio delle righe di S.
+    Il vettore nullo di L si ottiene da ns.ns_diag_lowrank senza
+    costruire D, il prodotto di Kronecker o V2.
+
+    Parametri e valori restituiti come exterior_fiore.
+    """
+    if not np.isclose(A[2, 2], 1.0):
+        raise ValueError("La matrice A deve essere normalizzata (A[2,2] == 1)")
+
+    # Coordinate immagine normalizzate, omogenee 3xN
+    m = pt.pt(np.linalg.inv(A), data2d)
+    m = np.vstack([m, np.ones((1, m.shape[1]))])
+
+    # SVD economica di S (4xN): una sola decomposizione per rango e base
+    S = np.vstack([model3d, np.ones((1, model3d.shape[1]))])
+    _, sv, Vt = svd(S, full_matrices=False)
+    tol = sv.max() * max(S.shape) * np.finfo(sv.dtype).eps
+    r = int(np.sum(sv > tol))
+    Q = Vt[:r].T                                   # N x r
+
+    # Fattore di rango basso, N x 3r
+    C = (m.T[:, :, None] * Q[:, None, :]).reshape(m.shape[1], -1)
+    d = np.sum(m * m, axis=0)
+
+    z = ns.ns_diag_lowrank(d, C)
+
+    # Correggi segno sulla profondità
+    z = z * np.sign(z[0])
+
+    # Equivale a vtrans(D @ z, 3) riordinato per righe (N x 3)
+    reshaped = (m * z).T
+
+    G, s, _ = absolute.absolute(reshaped, model3d, method='scale')
+
+    return G, s
@@ -0,0 +1,137 @@
+"""
+Lettura delle immagini condivisa da GUI, pipeline e script di posa.
+
+    img, scale, (W, H) = image_io.load_rgb(path, max_width=800)
+    W, H = image_io.image_size(path)          # solo header
+    K = image_io.intrinsics(path)             # EXIF, in cache per file
+
+I JPEG vengono decodificati direttamente a scala ridotta (draft di PIL:
+la libjpeg scala 1/2, 1/4 o 1/8 nel dominio DCT), poi portati alla
+larghezza richiesta con LANCZOS: una foto da 24-48 MP non viene mai
+decodificata a piena risoluzione per il matching. Dimensioni ed EXIF si
+leggono dall'header senza decodificare i pixel; le informazioni e la K
+sono in cache per (percorso, dimensione, mtime).
+"""
+import os
+import threading
+from collections import OrderedDict
+import numpy as np
+from PIL import Image, ExifTags
+
+# tag EXIF usati per la focale (la mappa nome -> id si costruisce una volta)
+_TAGS = {name: tag for tag, name in ExifTags.TAGS.items()}
+TAG_FOCAL_35MM = _TAGS['FocalLengthIn35mmFilm']
+TAG_FOCAL = _TAGS['FocalLength']
+_EXIF_IFD = 0x8769
+
+_CACHE_SIZE = 1024
+_cache = OrderedDict()        # (percorso, size, mtime) -> ImageInfo
+_lock = threading.Lock()
+
+
+class ImageInfo:
+    """Dimensioni, formato e focale EXIF di un'immagine (dall'header)."""
+    def __init__(self, path, width, height, format, focal_35mm=None, focal_mm=None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.format = format
+        self.focal_35mm = focal_35mm
+        self.focal_mm = focal_mm
+        self._K = {}
+
+    @property
+    def size(self):
+        return self.width, self.height
+
+
+def _rational(val):
+    if val is None:
+        return None
+    # spesso è una tupla (num, den) o un IFDRational
+    return val[0] / val[1] if isinstance(val, tuple) else float(val)
+
+
+def _read_info(path):
+    with Image.open(path) as img:
+        W, H = img.size
+        exif = img.getexif()
+        tags = dict(exif)
+        try:
+            tags.update(exif.get_ifd(_EXIF_IFD))
+        except (KeyError, AttributeError):
+            pass
+        return ImageInfo(path, W, H, img.format,
+                         _rational(tags.get(TAG_FOCAL_35MM)) or None,
+                         _rational(tags.get(TAG_FOCAL)) or None)
+
+
+def info(path) -> ImageInfo:
+    """ImageInfo di `path`, in cache finché il file non cambia."""
+    path = os.path.abspath(path)
+    st = os.stat(path)
+    key = (path, st.st_size, st.st_mtime_ns)
+    with _lock:
+        hit = _cache.get(key)
+        if hit is not None:
+            _cache.move_to_end(key)
+            return hit
+    hit = _read_info(path)
+    with _lock:
+        _cache[key] = hit
+        while len(_cache) > _CACHE_SIZE:
+            _cache.popitem(last=False)
+    return hit
+
+
+def image_size(path):
+    """(larghezza, altezza) senza decodificare l'immagine."""
+    return info(path).size
+
+
+def intrinsics(path, sensor_width_mm: float = 35.0) -> np.ndarray:
+    """
+    Matrice intrinseca K dalla focale EXIF ("35mm equivalent" o, in
+    alternativa, FocalLength), con punto principale al centro.
+    ValueError se la focale non è nei metadati.
+    """
+    inf = info(path)
+    K = inf._K.get(sensor_width_mm)
+    if K is None:
+        focal_mm = inf.focal_35mm if inf.focal_35mm is not None else inf.focal_mm
+        if focal_mm is None:
+            raise ValueError("Lunghezza focale non trovata nei metadati EXIF.")
+        fp = (focal_mm * inf.width) / sensor_width_mm
+        K = np.array([[fp, 0, inf.width / 2.0],
+                      [0, fp, inf.height / 2.0],
+                      [0, 0, 1]], dtype=float)
+        inf._K[sensor_width_mm] = K
+    return K.copy()
+
+
+def target_size(width, height, max_width=800):
+    """Dimensione e scala del ridimensionamento prima del matching."""
+    if max_width is None or width <= max_width:
+        return (width, height), 1.0
+    scale = max_width / width
+    return (int(width * scale), int(height * scale)), scale
+
+
+def load_rgb(path, max_width=None):
+    """
+    Decodifica `path` in RGB uint8, larga al più `max_width` px.
+
+    Ritorna (img HxWx3, scale, (W, H) originali): i keypoint trovati su
+    img tornano alla risoluzione piena dividendo per scale, come con
+    pose_pipeline.resize_image.
+    """
+    with Image.open(path) as img:
+        W, H = img.size
+        (nw, nh), scale = target_size(W, H, max_width)
+        if scale != 1.0 and img.format == 'JPEG':
+            # decodifica DCT a 1/2, 1/4, 1/8, mai sotto la dimensione richiesta
+            img.draft('RGB', (nw, nh))
+        img = img.convert('RGB')
+        if img.size != (nw, nh):
+            img = img.resize((nw, nh), Image.LANCZOS)
+        return np.array(img), scale, (W, H)
@@ -0,0 +1,181 @@
+"""
+Formato binario versionato per le corrispondenze (sostituisce
+matches_output.txt).
+
+Layout del file (little endian):
+    8 byte   magic b'CPMATCH\\0'
+    uint32   versione del formato
+    uint32   lunghezza dell'header JSON
+    JSON     header: n, image_sizes, scales, matcher, offset degli array
+    padding  fino a un multiplo di 64 byte
+    float32  ref  (n, 2)  keypoints nell'immagine di riferimento
+    float32  tgt  (n, 2)  keypoints nell'immagine target
+    float32  conf (n,)    confidence dei match
+
+La lettura usa np.memmap; i vecchi file testuali (matches_output.txt)
+vengono riconosciuti e letti con lo stesso risultato.
+"""
+import os
+import json
+import struct
+import numpy as np
+
+MAGIC = b'CPMATCH\0'
+VERSION = 1
+ALIGN = 64
+DEFAULT_PATH = os.path.join('.', 'output', 'matches_output.bin')
+LEGACY_PATH = os.path.join('.', 'output', 'matches_output.txt')
+
+
+class Matches:
+    """Corrispondenze lette da file: array (eventualmente memory-map) + header."""
+    def __init__(self, ref, tgt, conf, header):
+        self.ref = ref
+        self.tgt = tgt
+        self.conf = conf
+        self.header = header
+
+    def __len__(self):
+        return self.ref.shape[0]
+
+    @property
+    def image_sizes(self):
+        return self.header.get('image_sizes')
+
+    @property
+    def scales(self):
+        return self.header.get('scales')
+
+    @property
+    def matcher(self):
+        return self.header.get('matcher')
+
+
+def write_matches(path, ref, tgt, conf=None, image_sizes=None, scales=None,
+                  matcher=None, meta=None):
+    """
+    Scrive le corrispondenze nel formato binario.
+
+    Parametri
+    ----------
+    path : str
+        File di output (scrittura atomica).
+    ref, tgt : array (n, 2)
+        Keypoints nelle due immagini (coordinate a risoluzione piena).
+    conf : array (n,), opzionale
+        Confidence dei match (default 1).
+    image_sizes : [[w0, h0], [w1, h1]], opzionale
+    scales : [s0, s1], opzionale
+        Fattori di resize usati durante il matching.
+    matcher : str, opzionale
+        Nome dell'algoritmo di matching.
+    meta : dict, opzionale
+        Metadati liberi (serializzabili in JSON).
+    """
+    ref = np.ascontiguousarray(ref, dtype='<f4').reshape(-1, 2)
+    tgt = np.ascontiguousarray(tgt, dtype='<f4').reshape(-1, 2)
+    n = ref.shape[0]
+    if tgt.shape[0] != n:
+        raise ValueError("Numero di punti incoerente tra ref e tgt")
+    conf = (np.ones(n, dtype='<f4') if conf is None
+            else np.ascontiguousarray(conf, dtype='<f4').reshape(-1))
+    if conf.shape[0] != n:
+        raise ValueError("Numero di confidence incoerente con i keypoints")
+
+    header = {'n': n,
+              'image_sizes': None if image_sizes is None else [[int(v) for v in s] for s in image_sizes],
+              'scales': None if scales is None else [float(s) for s in scales],
+              'matcher': matcher,
+              'meta': meta or {}}
+    # offset relativi all'inizio della zona dati
+    header['arrays'] = {'ref': 0, 'tgt': ref.nbytes, 'conf': ref.nbytes + tgt.nbytes}
+    hjson = json.dumps(header).encode('utf-8')
+    start = len(MAGIC) + 8 + len(hjson)
+    pad = (-start) % ALIGN
+
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp = path + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<II', VERSION, len(hjson)))
+        f.write(hjson)
+        f.write(b'\0' * pad)
+        f.write(ref.tobytes())
+        f.write(tgt.tobytes())
+        f.write(conf.tobytes())
+    os.replace(tmp, path)
+    return path
+
+
+def _read_binary(path, mmap):
+    with open(path, 'rb') as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError(f"{path}: non è un file di corrispondenze binario")
+        version, hlen = struct.unpack('<II', f.read(8))
+        if version > VERSION:
+            raise ValueError(f"{path}: versione {version} non supportata (max {VERSION})")
+        header = json.loads(f.read(hlen).decode('utf-8'))
+    start = len(MAGIC) + 8 + hlen
+    start += (-start) % ALIGN
+    n = header['n']
+    offs = header['arrays']
+
+    def arr(name, shape):
+        if n == 0:
+            return np.empty(shape, dtype='<f4')
+        if mmap:
+            return np.memmap(path, dtype='<f4', mode='r', offset=start + offs[name], shape=shape)
+        return np.fromfile(path, dtype='<f4', count=int(np.prod(shape)),
+                           offset=start + offs[name]).reshape(shape)
+
+    return Matches(arr('ref', (n, 2)), arr('tgt', (n, 2)), arr('conf', (n,)), header)
+
+
+def _read_text(path):
+    """Compatibilità con matches_output.txt (tre sezioni testuali)."""
+    sections = {0: [], 1: [], 2: []}
+    current = -1
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith('Keypoints Image 0'):
+                current = 0
+            elif line.startswith('Keypoints Image 1'):
+                current = 1
+            elif line.startswith('Match Confidence'):
+                current = 2
+            elif current >= 0:
+                sections[current].append(line)
+
+    def parse(lines, cols):
+        if not lines:
+            return np.empty((0, cols), dtype=np.float32)
+        vals = np.array(' '.join(lines).split(), dtype=np.float32)
+        return vals.reshape(-1, cols)
+
+    ref = parse(sections[0], 2)
+    tgt = parse(sections[1], 2)
+    conf = parse(sections[2], 1).reshape(-1)
+    if conf.shape[0] != ref.shape[0]:
+        conf = np.ones(ref.shape[0], dtype=np.float32)
+    return Matches(ref, tgt, conf, {'n': ref.shape[0], 'legacy_text': True})
+
+
+def read_matches(path=None, mmap=True) -> Matches:
+    """
+    Legge un file di corrispondenze, binario o testuale (vecchio formato).
+    Senza `path` usa output/matches_output.bin, o il .txt se manca.
+    """
+    if path is None:
+        path = DEFAULT_PATH if os.path.exists(DEFAULT_PATH) else LEGACY_PATH
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        m = _read_binary(path, mmap)
+    else:
+        m = _read_text(path)
+    if m.ref.shape != m.tgt.shape:  # check if te matched points are equal between images
+        raise ValueError("Numero di punti incoerente tra ref e tgt")
+    return m
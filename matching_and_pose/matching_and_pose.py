@@ -1,57 +1,29 @@
 #!/usr/bin/env python3
 import os
 import sys
-import json
 import tkinter as tk
 from tkinter import ttk
 from tkinter import messagebox, filedialog
 import numpy as np
-import matplotlib.pyplot as plt
-from scipy.spatial import cKDTree
 
-import cloud_get_points
 import getInternals
-import exterior_fiore
-import set_unity_camera
+import image_io
+import matches_io
+import project
+import tracing
+from solve_pose import solve_pose, save_params
 
-from socket_server import JSONSocketOneShot
+from socket_server import JSONSocketOneShot, publish_pose
 
-def read_matches(file_path):
+def read_matches(file_path=None):
     """
-    Legge matches_output.txt e restituisce due array Nx2:
+    Legge le corrispondenze (formato binario di matches_io, o il vecchio
+    matches_output.txt) e restituisce due array Nx2:
      - ref: keypoints nell'immagine di riferimento
      - tgt: keypoints nell'immagine target
-    Si ignorano le righe di confidence.
     """
-    sections = [[], []]  # 0: ref, 1: tgt
-    current_section = -1
-
-    with open(file_path, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            if line.startswith('Keypoints Image 0'):
-                current_section = 0
-                continue
-            if line.startswith('Keypoints Image 1'):
-                current_section = 1
-                continue
-            if line.startswith('Match Confidence'):
-                break  # salta tutto il resto
-            if current_section in (0, 1):
-                parts = line.split()
-                try:
-                    x, y = float(parts[0]), float(parts[1])
-                except:
-                    continue
-                sections[current_section].append([x, y])
-
-    ref = np.array(sections[0], dtype=np.float32)
-    tgt = np.array(sections[1], dtype=np.float32)
-    if ref.shape != tgt.shape:  # check if te matched points are equal between images
-        raise ValueError("Numero di punti incoerente tra ref e tgt")
-    return ref, tgt   # Return Nx2 NumPy arrays 
+    m = matches_io.read_matches(file_path)
+    return np.asarray(m.ref), np.asarray(m.tgt)   # Return Nx2 NumPy arrays 
 
 def select_files_window():   # open GUI to select .PLY and .txt files
     selected = {'ply': '', 'vis': ''}
@@ -113,80 +85,47 @@ def select_files_window():   # open GUI to select .PLY and .txt files
 
 def main():  # read the two images on prompt
     if len(sys.argv) < 3:
-        print("Usage: python matching_and_pose.py <image1> <image2>")
+        print("Usage: python matching_and_pose.py <image1> <image2> [matches.bin]")
         sys.exit(1)
 
     ref_img_path = sys.argv[1]  # ref image
     tgt_img_path = sys.argv[2]  # target image
     ref_img_name = os.path.basename(ref_img_path)
+    matches_file = sys.argv[3] if len(sys.argv) > 3 else None   # default: output/matches_output.bin
 
     # Selezione PLY e Visibility
     ply_file, vis_file = select_files_window()
 
-    # Estrai nuvola e proiezioni
-    # p2D -> 2D coordinates of reference image
-    # p3D -> 3D coordinates of scene 
-    
-    p2D, p3D = cloud_get_points.cloud_get_points(ply_file, vis_file, ref_img_name)
-    
-    # Load images with matplotlib
-    ref_img = plt.imread(ref_img_path)
-    tgt_img = plt.imread(tgt_img_path)
-
-    # Read only the matched points (not the confidence)
-    matches_file = './output/matches_output.txt'
-    f_ref, f_tgt = read_matches(matches_file)
-
-    # Allignment 2D→3D point with KD-Tree on 2D point projected on 3D cloud 
-    # Find the nearest point for each matched 2D keypoint  
-    # Filter the more long distance corrispondences (< 3 px)
-    #
-    tree = cKDTree(p2D)
-    dist, idx = tree.query(f_ref, k=1)
-    spatial_mask = dist < 3.0  
-
-    # take only the coherent points for the pose estimation 
-    p3D_filt   = p3D[idx[spatial_mask]]
-    f_ref_filt = f_ref[spatial_mask]
-    f_tgt_filt = f_tgt[spatial_mask]
-    
-    # KK -> intrinsic camera matrix 
-    # G -> pose matrix
-    # scale -> scale to adapt 3D -> 2D
-    KK = getInternals.get_internals(tgt_img_path)
-    G, scale = exterior_fiore.exterior_fiore(KK, p3D_filt.T, f_tgt_filt.T)
-
-    # convert camera parameters in Unity like format (focal, euler, position) 
-    Ih, Iw = tgt_img.shape[:2]
-    f_mm, sx, sy, lsx, lsy, euler_deg, pos_u = set_unity_camera.set_unity_cam(
-        Iw, Ih, KK, G[:, :3], G[:, 3]
-    )
-
-    # saving of parameters
-    # intrinsic matrix, pose, scale in a JSON file
-    params = {
-        "intrinsics_K": KK.flatten().tolist(),
-        "pose_G":       G.flatten().tolist(),
-        "scale_s":      float(scale),
-        "unity": {
-            "focal_mm":     float(f_mm),
-            "sensor_x_mm":  float(sx),
-            "sensor_y_mm":  float(sy),
-            "lens_shift_x": float(lsx),
-            "lens_shift_y": float(lsy),
-            "euler_deg":    [float(a) for a in euler_deg],
-            "position":     [float(c) for c in pos_u]
-        }
-    }
-    
-    os.makedirs('./output', exist_ok=True)
-    out_file = './output/camera_parameters.json'
-    with open(out_file, 'w') as jf:
-        json.dump(params, jf, indent=2)
-    
-    # send JSON parameters to a local server on port 5005 
-    sender = JSONSocketOneShot(host='127.0.0.1', port=5005)
-    sender.send_once(params)
+    with tracing.span("script.pose", ref=ref_img_name):
+        # Estrai nuvola e proiezioni della camera di riferimento
+        # p2D -> 2D coordinates of reference image
+        # p3D -> 3D coordinates of scene 
+        view = project.ZephyrProject(ply_file, vis_file).camera(ref_img_name)
+        
+
+        # Read only the matched points (not the confidence)
+        # output/matches_output.bin, or the old matches_output.txt
+        with tracing.span("script.read_matches") as sp:
+            f_ref, f_tgt = read_matches(matches_file)
+            sp.set(items=len(f_ref))
+
+        # KK -> intrinsic camera matrix; size of the target from the
+        # header only, the pixels are never decoded here
+        with tracing.span("script.intrinsics"):
+            KK = getInternals.get_internals(tgt_img_path)
+            Iw, Ih = image_io.image_size(tgt_img_path)
+        params, _ = solve_pose(view, f_ref, f_tgt, KK, Iw, Ih)
+
+        # saving of parameters
+        # intrinsic matrix, pose, scale in a JSON file
+        out_file = save_params(params)
+
+    # send JSON parameters on port 5005: through the broadcast server if
+    # running, otherwise one-shot (waits for Unity at most 30 s)
+    with tracing.span("script.send"):
+        if not publish_pose(params, port=5005):
+            sender = JSONSocketOneShot(host='127.0.0.1', port=5005, timeout=30)
+            sender.send_once(params)
 
     return out_file
 
@@ -28,3 +28,82 @@ def ns(A: np.ndarray) -> np.ndarray:
     # Il null-space vector è l'ultima colonna di V
     v = V[:, -1]
     return v
+
+
+def ns_diag_lowrank(d: np.ndarray, C: np.ndarray,
+                    tol: float = 1e-12, max_iter: int = 50) -> np.ndarray:
+    """
+    Vettore nullo (autovettore dell'autovalore minimo) della matrice
+    simmetrica semidefinita positiva  A^T A = diag(d) - C @ C.T,
+    senza mai costruire la matrice NxN.
+
+    Equivale a ns(A) quando A^T A ha questa struttura (diagonale meno
+    un aggiornamento di rango basso), come in exterior_fiore.
+    L'autovalore minimo lam < min(d) è la radice dell'equazione secolare
+    mu_max(C^T (D - lam)^-1 C) = 1 su [0, min(d)), risolta con Newton
+    sulla matrice k x k dentro un intervallo che contiene sempre la
+    radice (bisezione se il passo ne esce), fino alla tolleranza
+    relativa `tol`; l'autovettore è (D - lam)^-1 C y. Ogni passo costa
+    O(N k^2) in tempo e O(N k) in memoria.
+
+    Parametri
+    ----------
+    d : np.ndarray, shape (N,)
+        Diagonale, strettamente positiva.
+    C : np.ndarray, shape (N, k)
+        Fattore dell'aggiornamento di rango k (k << N).
+    tol : float, opzionale
+        Tolleranza relativa su lam.
+    max_iter : int, opzionale
+        Numero massimo di passi (Newton o bisezione).
+
+    Ritorna
+    -------
+    v : np.ndarray, shape (N,)
+        Vettore di norma unitaria.
+    """
+    d = np.asarray(d, dtype=float)
+    C = np.asarray(C, dtype=float)
+    if np.any(d <= 0):
+        raise ValueError("ns_diag_lowrank: la diagonale deve essere positiva")
+
+    dmin = d.min()
+    eps = 4 * np.finfo(float).eps * dmin
+
+    def secular(lam):
+        Cd = C / (d - lam)[:, None]             # (D - lam)^-1 C, (N,k)
+        mu, Y = np.linalg.eigh(C.T @ Cd)
+        v = Cd @ Y[:, -1]
+        # g = mu_max - 1 e la sua derivata y^T C^T (D - lam)^-2 C y
+        return mu[-1] - 1.0, v @ v, v
+
+    # g(lam) è crescente e convessa su [0, min(d)), g(0) <= 0 (A^T A
+    # semidefinita) e g -> +inf verso min(d): la radice resta in [lo, hi).
+    # Newton da sinistra supera la radice, poi converge da destra; i passi
+    # che escono dall'intervallo diventano bisezioni.
+    lo, hi = 0.0, dmin
+    lam = 0.0
+    for _ in range(max_iter):
+        g, dg, v = secular(lam)
+        if g == 0:
+            break
+        if g < 0:
+            lo = lam
+        else:
+            hi = lam
+        new = lam - g / dg if dg > 0 else np.nan
+        if not lo < new < hi:
+            new = 0.5 * (lo + hi)
+        done = abs(new - lam) <= max(tol * new, eps) or hi - lo <= max(tol * hi, eps)
+        lam = new
+        if done:
+            g, dg, v = secular(lam)
+            break
+    else:
+        warnings.warn("ns_diag_lowrank: equazione secolare non convergente", UserWarning)
+
+    if g < 0 and dmin - lam <= eps:
+        # C nulla sulle righe di min(d): l'autovettore è la base canonica
+        v = np.zeros_like(d)
+        v[np.argmin(d)] = 1.0
+    return v / np.linalg.norm(v)
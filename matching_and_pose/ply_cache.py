@@ -0,0 +1,250 @@
+#!/usr/bin/env python3
+"""
+Cache dei vertici di una point cloud PLY di Zephyr.
+
+Alla prima lettura scrive accanto al .ply dei file sidecar:
+    <ply>.xyz.npy     coordinate float32 (N, 3) contigue, relative a origin
+    <ply>.rgb.npy     colori uint8 (N, 3) (opzionale)
+    <ply>.cache.json  chiave: dimensione, mtime e hash dell'header; origin
+Le letture successive li aprono in memory-map (zero-copy): X[indices]
+legge dal disco solo le pagine che servono.
+
+Le coordinate restano in float32 (metà memoria e disco); per i cloud
+georeferenziati (coordinate UTM e simili, dove il passo del float32
+supera il millimetro) si sottrae un'origine float64 salvata nella
+chiave e la si riaggiunge, in float64, solo ai punti richiesti.
+"""
+import os
+import sys
+import json
+import uuid
+import hashlib
+import numpy as np
+from plyfile import PlyData
+
+import plyread
+
+CACHE_VERSION = 2
+
+# oltre questo valore assoluto il float32 non ha più la precisione del
+# millimetro (eps * 1e4 ~ 1.2e-3): si salva l'origine
+LOCAL_RANGE = 1e4
+_CHUNK = 1 << 20
+
+
+class CloudVertices:
+    """
+    Vertici del cloud in memory-map: coordinate float32 (N, 3) relative
+    a `origin`, o l'array strutturato dei vertici del .ply (vedi
+    plyread.vertex_block). Indicizzare ritorna coordinate assolute
+    float64 e legge solo le righe richieste:
+
+        X[ids]  ->  (n, 3) float64
+    """
+    def __init__(self, data, origin=None):
+        self.data = data
+        self.origin = np.zeros(3) if origin is None else np.asarray(origin, dtype=float)
+
+    def __len__(self):
+        return len(self.data)
+
+    @property
+    def shape(self):
+        return (len(self.data), 3)
+
+    @property
+    def ndim(self) -> int:
+        return 2
+
+    def __getitem__(self, key):
+        cols = slice(None)
+        if isinstance(key, tuple):
+            key, cols = key
+        rows = self.data[key]
+        if rows.dtype.names:
+            xyz = np.stack([rows['x'], rows['y'], rows['z']], axis=-1).astype(np.float64)
+        else:
+            xyz = np.array(rows, dtype=np.float64)
+        xyz += self.origin
+        return xyz[..., cols]
+
+
+def _header_hash(ply_file: str) -> str:
+    h = hashlib.sha1()
+    with open(ply_file, 'rb') as f:
+        while True:
+            line = f.readline()
+            if not line:
+                raise ValueError(f"Header PLY non valido: {ply_file}")
+            h.update(line)
+            if line.strip() == b'end_header':
+                break
+    return h.hexdigest()
+
+
+def cache_key(ply_file: str) -> dict:
+    st = os.stat(ply_file)
+    return {'version': CACHE_VERSION,
+            'size': st.st_size,
+            'mtime_ns': st.st_mtime_ns,
+            'header_sha1': _header_hash(ply_file)}
+
+
+def _paths(ply_file: str):
+    return ply_file + '.xyz.npy', ply_file + '.rgb.npy', ply_file + '.cache.json'
+
+
+def _tmp_name(path: str) -> str:
+    # nome temporaneo proprio del processo: più processi possono
+    # costruire la stessa cache insieme senza sovrascriversi
+    return f"{path}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+
+
+def _vertex_block(ply_file: str):
+    """Vertici come array strutturato: memory-map se il PLY è binario, altrimenti plyfile."""
+    block = plyread.vertex_block(ply_file)
+    if block is None:
+        block = PlyData.read(ply_file)['vertex'].data
+    return block
+
+
+def _origin(block) -> np.ndarray:
+    """Centro (arrotondato) del bounding box se il cloud esce da ±LOCAL_RANGE, altrimenti 0."""
+    lo = np.full(3, np.inf)
+    hi = np.full(3, -np.inf)
+    for s in range(0, len(block), _CHUNK):
+        rows = block[s:s + _CHUNK]
+        for j, c in enumerate(('x', 'y', 'z')):
+            lo[j] = min(lo[j], float(rows[c].min()))
+            hi[j] = max(hi[j], float(rows[c].max()))
+    if len(block) == 0 or max(np.abs(lo).max(), np.abs(hi).max()) <= LOCAL_RANGE:
+        return np.zeros(3)
+    return np.round((lo + hi) / 2)
+
+
+def build_cache(ply_file: str):
+    """
+    Legge il .ply una volta e scrive i sidecar; ritorna la chiave scritta.
+    I vertici si copiano a blocchi dal file in memory-map nel file
+    float32, senza creare la matrice float64 intermedia. Ogni file si
+    scrive con un nome temporaneo e si pubblica con os.replace; la
+    chiave per ultima, quando i dati sono già al loro posto.
+    """
+    xyz_path, rgb_path, meta_path = _paths(ply_file)
+    key = cache_key(ply_file)
+
+    block = _vertex_block(ply_file)
+    n = len(block)
+    names = set(block.dtype.names)
+    origin = _origin(block)
+
+    tmp = _tmp_name(xyz_path)
+    try:
+        xyz = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.float32, shape=(n, 3))
+        for s in range(0, n, _CHUNK):
+            rows = block[s:s + _CHUNK]
+            for j, c in enumerate(('x', 'y', 'z')):
+                xyz[s:s + _CHUNK, j] = rows[c] - origin[j]
+        xyz.flush()
+        del xyz
+        os.replace(tmp, xyz_path)
+
+        key['has_color'] = all(c in names for c in ('red', 'green', 'blue'))
+        if key['has_color']:
+            tmp = _tmp_name(rgb_path)
+            rgb = np.lib.format.open_memmap(tmp, mode='w+', dtype=np.uint8, shape=(n, 3))
+            for j, c in enumerate(('red', 'green', 'blue')):
+                rgb[:, j] = block[c]
+            rgb.flush()
+            del rgb
+            os.replace(tmp, rgb_path)
+
+        key['count'] = int(n)
+        key['origin'] = origin.tolist()
+        tmp = _tmp_name(meta_path)
+        with open(tmp, 'w') as jf:
+            json.dump(key, jf)
+        os.replace(tmp, meta_path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return key
+
+
+def _current_meta(ply_file: str, meta_path: str):
+    """Chiave della cache se è aggiornata rispetto al .ply, altrimenti None."""
+    try:
+        with open(meta_path, 'r') as jf:
+            meta = json.load(jf)
+    except (OSError, ValueError):
+        return None
+    st = os.stat(ply_file)
+    # controllo rapido su dimensione/mtime, poi sull'hash dell'header
+    if (meta.get('version') != CACHE_VERSION or meta.get('size') != st.st_size
+            or meta.get('mtime_ns') != st.st_mtime_ns):
+        return None
+    return meta if meta.get('header_sha1') == _header_hash(ply_file) else None
+
+
+def load_vertices(ply_file: str, colors: bool = False):
+    """
+    Ritorna i vertici come CloudVertices (float32 in memory-map, X[ids]
+    in float64 assoluti), creando o ricostruendo la cache se necessario.
+
+    Parametri
+    ----------
+    ply_file : str
+        Percorso al file .ply.
+    colors : bool, opzionale
+        Se True ritorna (xyz, rgb); rgb è None se il PLY non ha colori.
+
+    Se la cartella non è scrivibile i vertici si leggono direttamente
+    dal .ply (in memory-map se binario).
+    """
+    xyz_path, rgb_path, meta_path = _paths(ply_file)
+    meta = _current_meta(ply_file, meta_path)
+    if meta is None:
+        try:
+            meta = build_cache(ply_file)
+        except OSError:
+            block = _vertex_block(ply_file)
+            xyz = CloudVertices(block)
+            if not colors:
+                return xyz
+            rgb = None
+            if all(c in block.dtype.names for c in ('red', 'green', 'blue')):
+                rgb = np.column_stack([block[c] for c in ('red', 'green', 'blue')]).astype(np.uint8)
+            return xyz, rgb
+
+    xyz = CloudVertices(np.load(xyz_path, mmap_mode='r'), meta.get('origin'))
+    if not colors:
+        return xyz
+    rgb = np.load(rgb_path, mmap_mode='r') if os.path.exists(rgb_path) else None
+    return xyz, rgb
+
+
+def gather(ply_file: str, indices) -> np.ndarray:
+    """
+    Coordinate (n, 3) float64 dei soli vertici `indices`.
+
+    Usa la cache se è aggiornata; altrimenti, per un PLY binario, legge
+    le righe direttamente dal blocco dei vertici sul disco senza
+    costruire la cache (memoria proporzionale a len(indices)).
+    """
+    xyz_path, _, meta_path = _paths(ply_file)
+    meta = _current_meta(ply_file, meta_path)
+    if meta is not None:
+        return CloudVertices(np.load(xyz_path, mmap_mode='r'), meta.get('origin'))[indices]
+    block = plyread.vertex_block(ply_file)
+    if block is not None:
+        return CloudVertices(block)[indices]
+    return load_vertices(ply_file)[indices]
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python ply_cache.py <cloud.ply> [...]")
+        sys.exit(1)
+    for ply in sys.argv[1:]:
+        key = build_cache(ply)
+        print(f"{ply}: {key['count']} vertici in cache")
@@ -1,11 +1,353 @@
+"""
+Lettura di file PLY (versione 1.0) con triangolazione delle facce.
+
+I file binari (binary_little_endian / binary_big_endian) vengono letti
+direttamente in array NumPy dal file in memory-map: gli elementi con
+sole proprietà scalari come un unico array strutturato, le facce (una
+proprietà lista) a blocchi: una sequenza di facce con lo stesso numero
+di vertici è un solo array strutturato, nelle mesh miste le facce si
+raccolgono per numero di vertici. La fan-triangolazione è vettoriale per numero di vertici e
+mantiene l'ordine delle facce. I file ASCII passano da plyfile.
+
+plyread_chunks legge vertici e triangoli a blocchi, senza tenere in
+memoria l'intera mesh; vertex_block mappa i vertici senza leggerli.
+"""
+import mmap
+import struct
 import numpy as np
 from plyfile import PlyData
-import re
+
+_TYPES = {
+    'char': 'i1', 'int8': 'i1', 'uchar': 'u1', 'uint8': 'u1',
+    'short': 'i2', 'int16': 'i2', 'ushort': 'u2', 'uint16': 'u2',
+    'int': 'i4', 'int32': 'i4', 'uint': 'u4', 'uint32': 'u4',
+    'float': 'f4', 'float32': 'f4', 'double': 'f8', 'float64': 'f8',
+}
+
+VERT_NAMES = ['vertex', 'Vertex', 'point', 'Point', 'pts', 'Pts']
+FACE_NAMES = ['face', 'Face', 'poly', 'Poly', 'tri', 'Tri']
+IDX_NAMES = ['vertex_indices', 'vertex_indexes', 'vertex_index', 'indices', 'indexes']
+
+# sotto questa lunghezza un blocco di facce uguali non conviene:
+# si leggono gli offset record per record
+_MIN_RUN = 4096
+_STRUCT = {'i1': 'b', 'u1': 'B', 'i2': 'h', 'u2': 'H', 'i4': 'i', 'u4': 'I'}
+
+
+class PlyHeader:
+    """
+    Header di un PLY: formato, commenti, elementi e offset dei dati.
+
+    elements : lista di (nome, count, proprietà); ogni proprietà è
+    (nome, dtype) o, per le liste, (nome, dtype_count, dtype_item).
+    """
+    def __init__(self, fmt, comments, elements, data_start):
+        self.format = fmt
+        self.comments = comments
+        self.elements = elements
+        self.data_start = data_start
+
+    @property
+    def binary(self) -> bool:
+        return self.format in ('binary_little_endian', 'binary_big_endian')
+
+    @property
+    def byte_order(self) -> str:
+        return '>' if self.format == 'binary_big_endian' else '<'
+
+
+def read_header(path: str) -> PlyHeader:
+    """Legge solo l'header del file PLY."""
+    fmt, comments, elements = None, [], []
+    with open(path, 'rb') as f:
+        if f.readline().strip() != b'ply':
+            raise ValueError(f"Non è un file PLY: {path}")
+        while True:
+            raw = f.readline()
+            if not raw:
+                raise ValueError(f"Header PLY non valido: {path}")
+            line = raw.decode('utf-8').rstrip('\r\n')
+            parts = line.split()
+            if not parts:
+                continue
+            if parts[0] == 'end_header':
+                break
+            if parts[0] == 'comment':
+                comments.append(line[len('comment '):])
+            elif parts[0] == 'format':
+                fmt = parts[1]
+            elif parts[0] == 'element':
+                elements.append((parts[1], int(parts[2]), []))
+            elif parts[0] == 'property':
+                if parts[1] == 'list':
+                    elements[-1][2].append((parts[4], _TYPES[parts[2]], _TYPES[parts[3]]))
+                else:
+                    elements[-1][2].append((parts[2], _TYPES[parts[1]]))
+        return PlyHeader(fmt, comments, elements, f.tell())
+
+
+def _scalar_dtype(props, bo):
+    return np.dtype([(p[0], bo + p[1]) for p in props])
+
+
+def _list_layout(props):
+    """(prima, lista, dopo) se l'elemento ha esattamente una proprietà lista."""
+    lists = [i for i, p in enumerate(props) if len(p) == 3]
+    if len(lists) != 1:
+        return None
+    i = lists[0]
+    return props[:i], props[i], props[i + 1:]
+
+
+def _record_dtype(layout, k, bo):
+    pre, (name, cnt_t, item_t), post = layout
+    return np.dtype([(p[0], bo + p[1]) for p in pre] +
+                    [('__n', bo + cnt_t), (name, bo + item_t, (k,))] +
+                    [(p[0], bo + p[1]) for p in post])
+
+
+class _ListBlock:
+    """
+    Blocco di record consecutivi di un elemento con una proprietà lista,
+    raggruppati per numero k di elementi della lista: groups è una
+    lista di (k, righe nel blocco o None = tutte, record strutturati).
+    """
+    def __init__(self, ks, groups):
+        self.ks = ks
+        self.groups = groups
+
+    def __len__(self):
+        return len(self.ks)
+
+    @property
+    def uniform(self) -> bool:
+        return len(self.groups) == 1
+
+    def field(self, name):
+        """Proprietà scalare nell'ordine dei record."""
+        if self.uniform:
+            return self.groups[0][2][name]
+        dt = self.groups[0][2].dtype[name]
+        out = np.empty(len(self), dtype=dt.newbyteorder('='))
+        for _, rows, recs in self.groups:
+            out[rows] = recs[name]
+        return out
+
+    def lists(self, name):
+        """Liste come array (m, k) se il blocco è uniforme, altrimenti array di oggetti."""
+        if self.uniform:
+            return self.groups[0][2][name]
+        out = np.empty(len(self), dtype=object)
+        for _, rows, recs in self.groups:
+            for r, row in zip(rows, recs[name]):
+                out[r] = row
+        return out
+
+    def triangles(self, name):
+        """Fan-triangolazione (0-based, int64) nell'ordine delle facce."""
+        if self.uniform:
+            k = self.groups[0][0]
+            return fan_triangulate(k, self.groups[0][2][name]).astype(np.int64)
+        ntri = np.maximum(self.ks - 2, 0)
+        starts = np.cumsum(ntri) - ntri
+        tri = np.empty((int(ntri.sum()), 3), dtype=np.int64)
+        for k, rows, recs in self.groups:
+            if k >= 3:
+                tri[(starts[rows][:, None] + np.arange(k - 2)).ravel()] = fan_triangulate(k, recs[name])
+        return tri
+
+
+def _scan_lists(buf, offset, count, layout, bo, chunk=1 << 20):
+    """
+    Legge `count` record con una proprietà lista a partire da `offset`,
+    generando un _ListBlock (copia, nessuna vista su buf) ogni al più
+    `chunk` record; alla fine ritorna l'offset dopo l'ultimo record.
+
+    Le sequenze lunghe di record con lo stesso k si leggono con un solo
+    array strutturato; altrove gli offset si calcolano record per record
+    (solo il contatore) e i record si raccolgono per k.
+    """
+    pre, (_, cnt_t, item_t), post = layout
+    pre_size = sum(np.dtype(p[1]).itemsize for p in pre)
+    fixed = pre_size + np.dtype(cnt_t).itemsize + sum(np.dtype(p[1]).itemsize for p in post)
+    item_size = np.dtype(item_t).itemsize
+    unpack = struct.Struct(bo + _STRUCT[cnt_t]).unpack_from
+    size = len(buf)
+    while count > 0:
+        if offset + pre_size >= size:
+            raise ValueError("File PLY troncato")
+        k = unpack(buf, offset + pre_size)[0]
+        rec = _record_dtype(layout, k, bo)
+        n = min(chunk, count, (size - offset) // rec.itemsize)
+        view = np.frombuffer(buf, rec, n, offset)
+        other = np.flatnonzero(view['__n'] != k)
+        m = int(other[0]) if other.size else n
+        if m == n or m >= _MIN_RUN:
+            block = _ListBlock(np.full(m, k, dtype=np.int64), [(k, None, view[:m].copy())])
+            del view, other
+            offset += m * rec.itemsize
+            count -= m
+            yield block
+            continue
+        del view, other
+
+        # facce miste: offset di ogni record dal suo contatore
+        n = min(chunk, count)
+        starts = np.empty(n, dtype=np.int64)
+        ks = np.empty(n, dtype=np.int64)
+        p = offset
+        for i in range(n):
+            if p + fixed > size:
+                raise ValueError("File PLY troncato")
+            k = unpack(buf, p + pre_size)[0]
+            starts[i] = p
+            ks[i] = k
+            p += fixed + k * item_size
+        if p > size:
+            raise ValueError("File PLY troncato")
+        data = np.frombuffer(buf, np.uint8)
+        groups = []
+        for k in np.unique(ks):
+            rows = np.flatnonzero(ks == k)
+            rec = _record_dtype(layout, int(k), bo)
+            recs = data[starts[rows][:, None] + np.arange(rec.itemsize)].view(rec).reshape(-1)
+            groups.append((int(k), rows, recs))
+        del data
+        offset = p
+        count -= n
+        yield _ListBlock(ks, groups)
+    return offset
+
+
+def _drain(scan, fn=None):
+    """Consuma _scan_lists applicando fn a ogni blocco; ritorna (risultati, offset finale)."""
+    out = []
+    while True:
+        try:
+            block = next(scan)
+        except StopIteration as stop:
+            return out, stop.value
+        if fn is not None:
+            out.append(fn(block))
+
+
+def fan_triangulate(k, faces):
+    """
+    Fan-triangolazione di facce con k vertici, faces (m, k):
+    (v0,v1,v2), (v0,v2,v3), ... nell'ordine delle facce → (m·(k-2), 3).
+    """
+    faces = np.asarray(faces)
+    if k < 3:
+        return np.zeros((0, 3), dtype=faces.dtype)
+    if k == 3:
+        return faces.reshape(-1, 3)
+    j = np.arange(1, k - 1)
+    cols = np.stack([np.zeros_like(j), j, j + 1], axis=1)       # (k-2, 3)
+    return faces[:, cols].reshape(-1, 3)
+
+
+def triangulate_lists(faces):
+    """
+    Come fan_triangulate per un array di liste di lunghezza variabile
+    (es. plyfile): raggruppa le facce per numero di vertici e rimette i
+    triangoli nell'ordine delle facce.
+    """
+    faces = list(faces)
+    sizes = np.fromiter((len(f) for f in faces), dtype=np.int64, count=len(faces))
+    ntri = np.maximum(sizes - 2, 0)
+    starts = np.cumsum(ntri) - ntri
+    tri = np.empty((int(ntri.sum()), 3), dtype=np.int64)
+    for k in np.unique(sizes[sizes >= 3]):
+        rows = np.flatnonzero(sizes == k)
+        block = fan_triangulate(int(k), np.array([faces[i] for i in rows], dtype=np.int64))
+        dst = (starts[rows][:, None] + np.arange(k - 2)).ravel()
+        tri[dst] = block
+    return tri
+
+
+def _read_binary(path, header):
+    """Elementi di un PLY binario come dict {elemento: {proprietà: array}}."""
+    bo = header.byte_order
+    data = {}
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        offset = header.data_start
+        for name, count, props in header.elements:
+            layout = _list_layout(props)
+            if layout is None:
+                if any(len(p) == 3 for p in props):
+                    return None      # più liste per elemento: plyfile
+                dt = _scalar_dtype(props, bo)
+                arr = np.frombuffer(buf, dt, count, offset).copy()
+                data[name] = {p[0]: arr[p[0]] for p in props}
+                offset += count * dt.itemsize
+                continue
+            blocks, offset = _drain(_scan_lists(buf, offset, count, layout, bo), lambda b: b)
+            data[name] = _list_element(layout, blocks)
+    return data
+
+
+def _list_element(layout, blocks):
+    pre, (lname, _, _), post = layout
+    out = {p[0]: np.concatenate([b.field(p[0]) for b in blocks]) if blocks else np.zeros(0)
+           for p in pre + post}
+    sizes = {g[0] for b in blocks for g in b.groups}
+    if len(sizes) == 1:
+        # tutte le facce con lo stesso numero di vertici: array (F, k)
+        out[lname] = np.concatenate([b.lists(lname) for b in blocks])
+    elif blocks:
+        out[lname] = np.concatenate([_as_objects(b.lists(lname)) for b in blocks])
+    else:
+        out[lname] = np.zeros(0, dtype=object)
+    order = [p[0] for p in pre] + [lname] + [p[0] for p in post]
+    out = {n: out[n] for n in order}
+    out['__blocks'] = blocks
+    return out
+
+
+def _as_objects(lists):
+    if lists.dtype == object:
+        return lists
+    out = np.empty(len(lists), dtype=object)
+    for i, row in enumerate(lists):
+        out[i] = row
+    return out
+
+
+def vertex_block(path: str):
+    """
+    Vertici di un PLY binario come np.memmap strutturato (N,) sul file,
+    senza leggerli: block[ids] legge dal disco solo le righe richieste.
+    None se il file è ASCII, se non c'è un elemento vertice o se questo
+    (o un elemento che lo precede) non si può mappare direttamente.
+    """
+    header = read_header(path)
+    if not header.binary:
+        return None
+    bo = header.byte_order
+    offset = header.data_start
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        for name, count, props in header.elements:
+            layout = _list_layout(props)
+            if name in VERT_NAMES:
+                if layout is not None or any(len(p) == 3 for p in props):
+                    return None
+                dt = _scalar_dtype(props, bo)
+                if count == 0:
+                    return np.zeros(0, dtype=dt)
+                return np.memmap(path, dtype=dt, mode='r', offset=offset, shape=(count,))
+            if layout is None:
+                if any(len(p) == 3 for p in props):
+                    return None
+                offset += count * _scalar_dtype(props, bo).itemsize
+            else:
+                _, offset = _drain(_scan_lists(buf, offset, count, layout, bo))
+    return None
+
 
 def plyread(path: str, mode: str = None):
     """
     Legge un file PLY (versione 1.0).
-    
+
     Parametri
     ----------
     path : str
@@ -13,16 +355,18 @@ def plyread(path: str, mode: str = None):
     mode : str, opzionale
         Se 'tri' o 'Tri', restituisce (tri, pts, data, comments).
         Altrimenti restituisce (data, comments).
-    
+
     Ritorna
     -------
     Se mode is None:
       data : dict
-        Mappa ogni elemento PLY al suo contenuto, 
-        es. data['vertex']['x'] è un array numpy.
+        Mappa ogni elemento PLY al suo contenuto,
+        es. data['vertex']['x'] è un array numpy. Le liste di indici
+        delle facce sono un array (F, k) se tutte le facce hanno k
+        vertici, altrimenti un array di oggetti (una lista per faccia).
       comments : list of str
         Commenti letti dall'header.
-    
+
     Se mode == 'tri':
       tri : np.ndarray, shape (M,3)
         Indici dei vertici di ciascun triangolo (1-based).
@@ -31,72 +375,95 @@ def plyread(path: str, mode: str = None):
       data : come sopra
       comments : come sopra
     """
-    # 1) Apri e leggi l'header
-    with open(path, 'rb') as f:
-        # Leggi fino a "end_header"
-        header = []
-        comments = []
-        while True:
-            line = f.readline().decode('utf-8').rstrip('\r\n')
-            header.append(line)
-            if line.startswith('comment '):
-                comments.append(line[len('comment '):])
-            if line == 'end_header':
-                break
-        # Posizione dati
-        data_start = f.tell()
-    
-    # 2) Usa plyfile.PlyData per il parsing
-    ply = PlyData.read(path)
-    
-    # 3) Estrai i dati in un dizionario
-    data = {}
-    for element in ply.elements:
-        name = element.name
-        props = {prop.name: element.data[prop.name] for prop in element.properties}
-        data[name] = props
-    
-    # 4) Se non servono triangoli, restituisci subito
+    header = read_header(path)
+    data = _read_binary(path, header) if header.binary else None
+    if data is None:
+        ply = PlyData.read(path)
+        data = {el.name: {p.name: el.data[p.name] for p in el.properties} for el in ply.elements}
+    blocks = {name: el.pop('__blocks', None) for name, el in data.items()}
+
     if mode is None:
-        return data, comments
-    
-    # 5) ALTRIMENTI estrai vertici e facce e crea tri, pts
-    # Individua il nome dell'elemento vertex
-    vert_names = ['vertex', 'Vertex', 'point', 'Point', 'pts', 'Pts']
-    vert_key = next((k for k in data if k in vert_names), None)
+        return data, header.comments
+
+    vert_key = next((k for k in data if k in VERT_NAMES), None)
     if vert_key is None:
         raise ValueError("Elemento 'vertex' non trovato nel PLY.")
     vdict = data[vert_key]
-    # Costruisci array pts Nx3
-    pts = np.vstack((vdict['x'], vdict['y'], vdict['z'])).T
-    
-    # Cerca l'elemento face
-    face_names = ['face', 'Face', 'poly', 'Poly', 'tri', 'Tri']
-    face_key = next((k for k in data if k in face_names), None)
+    pts = np.column_stack((vdict['x'], vdict['y'], vdict['z']))
+
+    face_key = next((k for k in data if k in FACE_NAMES), None)
     if face_key is None:
         # niente facce → restituisci solo pts
-        return None, pts, data, comments
-    
-    # Identifica il campo con gli indici dei vertici
-    prop_names = list(data[face_key].keys())
-    idx_names = ['vertex_indices','vertex_indexes','vertex_index','indices','indexes']
-    idx_key = next((n for n in prop_names if n in idx_names), None)
+        return None, pts, data, header.comments
+    idx_key = next((n for n in data[face_key] if n in IDX_NAMES), None)
     if idx_key is None:
         # nessuna lista di indici → restituisci come sopra
-        return None, pts, data, comments
-    
-    # data[face_key][idx_key] è una lista di array per ogni faccia
-    faces_list = data[face_key][idx_key]  # è array di dtype=object
-    # Converti in array di triangoli
-    tri = []
-    for face in faces_list:
-        # Se la faccia ha >3 vertici, fan‑triangola
-        if len(face) == 3:
-            tri.append(face)
-        else:
-            # fan‑triangulation: (v0,v1,v2), (v0,v2,v3), ...
-            for i in range(1, len(face)-1):
-                tri.append([face[0], face[i], face[i+1]])
-    tri = np.array(tri, dtype=int) + 1  # MATLAB è 1‑based
-    
-    return tri, pts, data, comments
+        return None, pts, data, header.comments
+
+    if blocks.get(face_key) is not None:
+        parts = [b.triangles(idx_key) for b in blocks[face_key]]
+        tri = np.concatenate(parts) if parts else np.zeros((0, 3), np.int64)
+    else:
+        tri = triangulate_lists(data[face_key][idx_key])
+    tri += 1  # MATLAB è 1‑based
+    return tri, pts, data, header.comments
+
+
+def plyread_chunks(path: str, chunk_size: int = 1 << 20):
+    """
+    Lettura a blocchi di un PLY binario: genera ('vertex', pts (n,3))
+    per blocchi di al più `chunk_size` vertici, poi ('tri', tri (m,3))
+    con gli indici 1-based dei triangoli (come plyread(..., 'tri')), a
+    blocchi di circa `chunk_size` facce. Il file è letto in memory-map:
+    in memoria resta un blocco alla volta.
+
+    Gli elementi con più di una lista (es. facce con vertex_indices e
+    texcoord) non si possono scorrere a blocchi: in quel caso il file si
+    legge per intero con plyread e si restituisce comunque a blocchi.
+    """
+    header = read_header(path)
+    if not header.binary:
+        raise ValueError("plyread_chunks richiede un PLY binario")
+    if any(_list_layout(props) is None and any(len(p) == 3 for p in props)
+           for _, _, props in header.elements):
+        yield from _chunks_from_plyfile(path, chunk_size)
+        return
+    bo = header.byte_order
+    with open(path, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        offset = header.data_start
+        for name, count, props in header.elements:
+            layout = _list_layout(props)
+            if layout is None:
+                dt = _scalar_dtype(props, bo)
+                if name in VERT_NAMES:
+                    for s in range(0, count, chunk_size):
+                        n = min(chunk_size, count - s)
+                        block = np.frombuffer(buf, dt, n, offset + s * dt.itemsize)
+                        pts = np.column_stack((block['x'], block['y'], block['z']))
+                        del block   # nessuna vista sul memory-map mentre il generatore è sospeso
+                        yield 'vertex', pts
+                offset += count * dt.itemsize
+                continue
+            if name not in FACE_NAMES or layout[1][0] not in IDX_NAMES:
+                # altri elementi con liste: solo per trovare l'offset successivo
+                _, offset = _drain(_scan_lists(buf, offset, count, layout, bo))
+                continue
+            pending, n_pending = [], 0
+            for block in _scan_lists(buf, offset, count, layout, bo, chunk_size):
+                pending.append(block.triangles(layout[1][0]))
+                n_pending += len(block)
+                if n_pending >= chunk_size:
+                    yield 'tri', np.concatenate(pending) + 1
+                    pending, n_pending = [], 0
+            if pending:
+                yield 'tri', np.concatenate(pending) + 1
+
+
+def _chunks_from_plyfile(path, chunk_size):
+    """Stessi blocchi di plyread_chunks, da una lettura completa con plyread."""
+    tri, pts, _, _ = plyread(path, 'tri')
+    for s in range(0, len(pts), chunk_size):
+        yield 'vertex', pts[s:s + chunk_size]
+    if tri is not None:
+        for s in range(0, len(tri), chunk_size):
+            yield 'tri', tri[s:s + chunk_size]
@@ -0,0 +1,70 @@
+"""
+Client leggero del worker di pose estimation (pose_worker.py).
+
+Non importa scipy, matplotlib o tkinter: si può usare dalla GUI
+senza rallentarne l'avvio.
+"""
+import os
+import json
+import socket
+import struct
+import numpy as np
+
+import tracing
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5006
+
+
+def send_msg(sock, data: dict):
+    payload = json.dumps(data).encode('utf-8')
+    sock.sendall(struct.pack('>I', len(payload)) + payload)
+
+
+def _recv_exact(sock, n):
+    buf = bytearray()
+    while len(buf) < n:
+        chunk = sock.recv(n - len(buf))
+        if not chunk:
+            raise ConnectionError("Connessione chiusa")
+        buf.extend(chunk)
+    return bytes(buf)
+
+
+def recv_msg(sock) -> dict:
+    (n,) = struct.unpack('>I', _recv_exact(sock, 4))
+    return json.loads(_recv_exact(sock, n).decode('utf-8'))
+
+
+def request(data: dict, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None) -> dict:
+    """Invia una richiesta al worker e ritorna la risposta (dict)."""
+    with socket.create_connection((host, port), timeout=timeout) as sock:
+        sock.settimeout(timeout)
+        send_msg(sock, data)
+        return recv_msg(sock)
+
+
+def request_pose(ply_file, vis_file, ref_name, tgt_image, ref_kpts, tgt_kpts,
+                 host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None, verify=False) -> dict:
+    """
+    Chiede una posa al worker. Ritorna i parametri camera (come
+    camera_parameters.json, con "quality" se verify); RuntimeError se il
+    worker segnala un errore.
+    """
+    resp = request({'cmd': 'pose', 'ply': os.path.abspath(ply_file),
+                    'vis': os.path.abspath(vis_file), 'ref_name': ref_name,
+                    'tgt_image': os.path.abspath(tgt_image),
+                    'ref_kpts': np.asarray(ref_kpts, dtype=float).tolist(),
+                    'tgt_kpts': np.asarray(tgt_kpts, dtype=float).tolist(),
+                    'trace': tracing.context(), 'verify': verify},
+                   host=host, port=port, timeout=timeout)
+    if not resp.get('ok'):
+        raise RuntimeError(resp.get('error', 'errore sconosciuto'))
+    return resp['params']
+
+
+def is_running(host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=0.2) -> bool:
+    try:
+        return request({'cmd': 'ping'}, host=host, port=port, timeout=timeout).get('ok', False)
+    except OSError:
+        return False
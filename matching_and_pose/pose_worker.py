@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+"""
+Worker persistente per la pose estimation.
+
+Carica un progetto Zephyr una sola volta (cloud, visibilità, KD-tree per
+camera) e serve richieste di posa su un socket locale, con la stessa
+trama di socket_server: intero '>I' con la lunghezza, poi JSON UTF-8.
+
+Richiesta:
+    {"cmd": "pose", "ply": ..., "vis": ..., "ref_name": ...,
+     "tgt_image": ..., "ref_kpts": [[x, y], ...], "tgt_kpts": [[x, y], ...],
+     "trace": {...} (opzionale, vedi tracing.context),
+     "verify": true (opzionale, verifica z-buffer della posa)}
+    {"cmd": "ping"} | {"cmd": "stats"}
+Risposta:
+    {"ok": true, "params": {...}, "inliers": n} | {"ok": false, "error": "..."}
+    (con "verify" params contiene anche "quality", vedi solve_pose.verify_pose)
+
+I progetti sono tenuti in una cache LRU con limite di memoria.
+
+Avvio:  python pose_worker.py [--port 5006] [--max-mem-mb 4096] [--max-views 64]
+"""
+import os
+import time
+import struct
+import argparse
+import threading
+import socketserver
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+import getInternals
+import image_io
+import project
+import tracing
+from solve_pose import solve_pose, save_params
+from pose_client import DEFAULT_HOST, DEFAULT_PORT, send_msg, recv_msg
+from socket_server import PoseBroadcastServer, publish_pose
+
+
+class ProjectCache:
+    """
+    Cache LRU di ZephyrProject con limite di memoria (byte stimati).
+    Oltre il limite si scartano i progetti meno recenti, poi le
+    CameraView meno recenti del progetto rimasto; il progetto (e la
+    camera) usati più di recente non vengono mai scartati.
+
+    Un progetto si carica fuori dal lock della cache: le richieste per
+    lo stesso progetto attendono il suo Future, le altre proseguono.
+    """
+    def __init__(self, max_bytes: int, max_views: int = 64):
+        self.max_bytes = max_bytes
+        self.max_views = max_views
+        self._projects = OrderedDict()    # chiave -> Future[ZephyrProject]
+        self._lock = threading.Lock()
+
+    def get(self, ply_file: str, vis_file: str) -> project.ZephyrProject:
+        key = (os.path.abspath(ply_file), os.path.abspath(vis_file))
+        with self._lock:
+            fut = self._projects.get(key)
+            owner = fut is None
+            if owner:
+                fut = self._projects[key] = Future()
+            self._projects.move_to_end(key)
+        if owner:
+            try:
+                fut.set_result(project.ZephyrProject(ply_file, vis_file, self.max_views))
+            except BaseException as e:
+                # la prossima richiesta riprova il caricamento
+                with self._lock:
+                    if self._projects.get(key) is fut:
+                        del self._projects[key]
+                fut.set_exception(e)
+        return fut.result()
+
+    def _loaded(self):
+        """[(chiave, progetto)] dei progetti caricati, dal meno recente."""
+        return [(k, f.result()) for k, f in self._projects.items()
+                if f.done() and f.exception() is None]
+
+    def evict(self):
+        with self._lock:
+            loaded = self._loaded()
+            while len(loaded) > 1 and sum(p.nbytes for _, p in loaded) > self.max_bytes:
+                key, _ = loaded.pop(0)
+                del self._projects[key]
+                print(f"[PoseWorker] Progetto scaricato: {key[0]}")
+            if loaded:
+                loaded[-1][1].trim(self.max_bytes)
+
+    @property
+    def nbytes(self) -> int:
+        with self._lock:
+            return sum(p.nbytes for _, p in self._loaded())
+
+    def stats(self) -> dict:
+        with self._lock:
+            loaded = self._loaded()
+            return {'projects': [{'ply': k[0], 'vis': k[1], 'cameras_loaded': p.views_loaded,
+                                  'bytes': p.nbytes} for k, p in loaded],
+                    'loading': len(self._projects) - len(loaded),
+                    'bytes': sum(p.nbytes for _, p in loaded), 'max_bytes': self.max_bytes}
+
+
+# server di broadcast verso Unity, avviato da main() se la porta è libera
+_broadcast = None
+_unity_port = 5005
+
+
+def _notify_unity(params):
+    # mai bloccante: la posa va in coda ai subscriber collegati
+    if _broadcast is not None:
+        _broadcast.publish(params)
+    elif not publish_pose(params, port=_unity_port):
+        print("[PoseWorker] Nessun server di broadcast attivo, posa non inoltrata")
+
+
+class _Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        cache = self.server.cache
+        while True:
+            try:
+                req = recv_msg(self.request)
+            except (ConnectionError, struct.error):
+                return
+            try:
+                resp = self.dispatch(cache, req)
+            except Exception as e:  # l'errore torna al client, il worker resta attivo
+                resp = {'ok': False, 'error': f"{type(e).__name__}: {e}"}
+            send_msg(self.request, resp)
+
+    def dispatch(self, cache, req):
+        cmd = req.get('cmd')
+        if cmd == 'ping':
+            return {'ok': True}
+        if cmd == 'stats':
+            return {'ok': True, 'stats': cache.stats()}
+        if cmd != 'pose':
+            raise ValueError(f"Comando sconosciuto: {cmd}")
+        # gli span della richiesta continuano la traccia del client
+        with tracing.remote(req.get('trace')), tracing.span("worker.pose"):
+            return self._pose(cache, req)
+
+    def _pose(self, cache, req):
+        t0 = time.perf_counter()
+        proj = cache.get(req['ply'], req['vis'])
+        view = proj.camera(req['ref_name'])
+        f_ref = np.asarray(req['ref_kpts'], dtype=np.float32).reshape(-1, 2)
+        f_tgt = np.asarray(req['tgt_kpts'], dtype=np.float32).reshape(-1, 2)
+        if f_ref.shape != f_tgt.shape:
+            raise ValueError("Numero di punti incoerente tra ref e tgt")
+
+        tgt_image = req['tgt_image']
+        with tracing.span("worker.intrinsics"):
+            KK = getInternals.get_internals(tgt_image)
+            Iw, Ih = image_io.image_size(tgt_image)   # solo header, in cache
+        params, inliers = solve_pose(view, f_ref, f_tgt, KK, Iw, Ih,
+                                     cloud=proj.X if req.get('verify') else None)
+        cache.evict()
+
+        if req.get('save', True):
+            save_params(params)
+        if req.get('notify', True):
+            _notify_unity(params)
+        return {'ok': True, 'params': params, 'inliers': int(inliers.sum()),
+                'elapsed_s': time.perf_counter() - t0}
+
+
+class PoseWorker(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host=DEFAULT_HOST, port=DEFAULT_PORT, max_bytes=4 << 30, max_views=64):
+        super().__init__((host, port), _Handler)
+        self.cache = ProjectCache(max_bytes, max_views)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Worker persistente per la pose estimation")
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--max-mem-mb', type=int, default=4096,
+                        help="limite di memoria per i progetti residenti (MB)")
+    parser.add_argument('--max-views', type=int, default=64,
+                        help="camere tenute in memoria per progetto")
+    parser.add_argument('--unity-port', type=int, default=5005,
+                        help="porta del server di broadcast delle pose")
+    args = parser.parse_args()
+
+    global _broadcast, _unity_port
+    _unity_port = args.unity_port
+    try:
+        _broadcast = PoseBroadcastServer(port=args.unity_port).start()
+    except OSError:
+        print(f"[PoseWorker] Porta {args.unity_port} occupata: uso il server di broadcast esistente")
+
+    server = PoseWorker(args.host, args.port, args.max_mem_mb << 20, args.max_views)
+    print(f"[PoseWorker] In ascolto su {args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        if _broadcast is not None:
+            _broadcast.stop()
+
+
+if __name__ == '__main__':
+    main()
@@ -38,3 +38,42 @@ def proj(P: np.ndarray, c3d: np.ndarray):
     v = np.round(y).astype(int)
 
     return u, v
+
+
+def proj_batch(P: np.ndarray, c3d: np.ndarray):
+    """
+    Proiezione prospettica di punti 3D con più matrici di camera insieme,
+    senza arrotondamento (versione vettorizzata di proj).
+
+    Parametri
+    ----------
+    P : np.ndarray, shape (H,3,4) o (3,4)
+        Matrici di proiezione (una per ipotesi).
+    c3d : np.ndarray, shape (N,3)
+        Coordinate dei punti 3D (righe).
+
+    Ritorna
+    -------
+    x, y : np.ndarray, shape (H,N)
+        Coordinate pixel (float) di ciascun punto per ciascuna camera.
+    w : np.ndarray, shape (H,N)
+        Terza coordinata omogenea (profondità, a meno di scala);
+        i punti con w <= 0 sono dietro la camera.
+    """
+    P = np.asarray(P)
+    if P.ndim == 2:
+        P = P[None]
+    if P.ndim != 3 or P.shape[1:] != (3, 4):
+        raise ValueError("P deve essere di forma (H,3,4) o (3,4)")
+    if c3d.ndim != 2 or c3d.shape[1] != 3:
+        raise ValueError("c3d deve essere di forma (N,3)")
+
+    # 3×4 @ 4×N per ogni ipotesi, senza costruire le omogenee: (H,3,N)
+    h2d = P[:, :, :3] @ c3d.T + P[:, :, 3:]
+
+    w = h2d[:, 2, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        x = h2d[:, 0, :] / w
+        y = h2d[:, 1, :] / w
+
+    return x, y, w
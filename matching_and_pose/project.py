@@ -0,0 +1,152 @@
+import os
+import pickle
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future
+import numpy as np
+
+import ply_cache
+import tracing
+import visibility_store
+from assoc_index import AssociationIndex
+
+
+class CameraView:
+    """
+    Osservazioni di una camera di riferimento del progetto Zephyr:
+    coordinate 2D, punti 3D corrispondenti, id dei punti e indice di
+    associazione 2D (assoc_index).
+    """
+    def __init__(self, name, ids, p2D, p3D, index=None):
+        self.name = name
+        self.ids = ids                    # (n,) int32
+        self.p2D = p2D                    # (n,2) float32
+        self.p3D = p3D                    # (n,3)
+        self.index = index if index is not None else AssociationIndex(p2D)
+
+    @property
+    def tree(self):
+        return self.index.tree
+
+    @property
+    def nbytes(self) -> int:
+        return self.ids.nbytes + self.p2D.nbytes + self.p3D.nbytes + self.index.nbytes
+
+
+class ZephyrProject:
+    """
+    Progetto Zephyr caricato una volta: point cloud (memory-map da
+    ply_cache), archivio di visibilità (visibility_store) e CameraView
+    per camera, create alla prima richiesta e tenute in memoria (al più
+    `max_views`, le meno recenti vengono scartate).
+    Gli indici di associazione 2D sono salvati nell'archivio di
+    visibilità e ricaricati invece di essere ricostruiti.
+
+    Una CameraView si costruisce fuori dal lock: le richieste per la
+    stessa camera attendono il suo Future, quelle per camere già in
+    memoria non attendono.
+    """
+    def __init__(self, ply_file: str, visibility_point_file: str, max_views: int = 64):
+        self.ply_file = os.path.abspath(ply_file)
+        self.visibility_point_file = os.path.abspath(visibility_point_file)
+        with tracing.span("project.cloud") as sp:
+            self.X = ply_cache.load_vertices(self.ply_file)
+            sp.set(items=len(self.X))
+        with tracing.span("project.visibility"):
+            self.store = visibility_store.open_store(self.visibility_point_file)
+        self.max_views = max_views
+        self._views = OrderedDict()       # nome -> CameraView, dalla meno recente
+        self._loading = {}                # nome -> Future[CameraView] in costruzione
+        self._lock = threading.Lock()
+
+    @property
+    def key(self):
+        return (self.ply_file, self.visibility_point_file)
+
+    @property
+    def cameras(self):
+        return self.store.cameras
+
+    @property
+    def nbytes(self) -> int:
+        """Memoria residente stimata (il cloud in memory-map non conta)."""
+        with self._lock:
+            return sum(v.nbytes for v in self._views.values())
+
+    @property
+    def views_loaded(self) -> int:
+        return len(self._views)
+
+    def trim(self, max_bytes: int):
+        """Scarta le CameraView meno recenti (tranne l'ultima) finché nbytes <= max_bytes."""
+        with self._lock:
+            total = sum(v.nbytes for v in self._views.values())
+            while len(self._views) > 1 and total > max_bytes:
+                _, view = self._views.popitem(last=False)
+                total -= view.nbytes
+
+    def covisible(self, img_name: str, k: int = None):
+        """Camere con più punti 3D in comune con `img_name`: [(nome, punti)]."""
+        if img_name not in self.store:
+            raise ValueError(f"Immagine '{img_name}' non trovata in {self.visibility_point_file}")
+        return self.store.covisible(img_name, k)
+
+    def camera(self, img_name: str) -> CameraView:
+        """
+        Ritorna la CameraView di `img_name`, costruendola alla prima
+        richiesta; ValueError se la camera non è nel file di visibilità.
+        """
+        with self._lock:
+            view = self._views.get(img_name)
+            if view is not None:
+                self._views.move_to_end(img_name)
+                return view
+            fut = self._loading.get(img_name)
+            owner = fut is None
+            if owner:
+                fut = self._loading[img_name] = Future()
+        if not owner:
+            return fut.result()
+
+        try:
+            view = self._build(img_name)
+        except BaseException as e:
+            # la prossima richiesta riprova la costruzione
+            with self._lock:
+                del self._loading[img_name]
+            fut.set_exception(e)
+            raise
+        with self._lock:
+            del self._loading[img_name]
+            self._views[img_name] = view
+            while len(self._views) > self.max_views:
+                self._views.popitem(last=False)
+        fut.set_result(view)
+        return view
+
+    def _build(self, img_name):
+        if img_name not in self.store:
+            raise ValueError(f"Immagine '{img_name}' non trovata in {self.visibility_point_file}")
+        with tracing.span("project.camera", camera=img_name) as sp:
+            ids, p2D = self.store.camera(img_name)
+            ids = np.array(ids)
+            p2D = np.array(p2D)
+            p3D = np.asarray(self.X[ids, :])
+            view = CameraView(img_name, ids, p2D, p3D, self._index(img_name, p2D))
+            sp.set(items=len(ids), bytes=view.nbytes)
+        return view
+
+    def _index(self, img_name, p2D):
+        path = os.path.join(visibility_store.store_path(self.visibility_point_file),
+                            'assoc', f"{self.store.index[img_name]}.pkl")
+        source = {'visibility': self.store.meta['source'], 'camera': img_name}
+        try:
+            return AssociationIndex.load(path, source)
+        except (OSError, ValueError, EOFError, pickle.UnpicklingError):
+            pass
+        index = AssociationIndex(p2D)
+        try:
+            index.save(path, source)
+        except OSError as e:   # cartella in sola lettura: si ricostruisce ogni volta
+            print(f"[Project] Indice di associazione non salvato: {e}")
+        return index
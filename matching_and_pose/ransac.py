@@ -0,0 +1,157 @@
+import warnings
+import numpy as np
+
+import exterior_fiore
+import proj
+
+
+def _score(A, poses, model3d, data2d, threshold):
+    """
+    Valuta insieme tutte le ipotesi di posa con una sola proiezione batch.
+
+    Ritorna la maschera degli inlier (H,N) e il costo troncato (MSAC)
+    di ciascuna ipotesi (H,).
+    """
+    P = A @ poses                                            # (H,3,4)
+    x, y, w = proj.proj_batch(P, model3d.T)
+    err2 = (x - data2d[0]) ** 2 + (y - data2d[1]) ** 2       # (H,N)
+    err2 = np.where((w > 0) & np.isfinite(err2), err2, np.inf)
+    th2 = threshold ** 2
+    inl = err2 < th2
+    cost = np.minimum(err2, th2).sum(axis=1)
+    return inl, cost
+
+
+def _fit(A, model3d, data2d, idx):
+    """Stima Fiore su un sottoinsieme; None se degenere."""
+    try:
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore')
+            G, s = exterior_fiore.exterior_fiore(A, model3d[:, idx], data2d[:, idx],
+                                                 method='linear')
+    except (np.linalg.LinAlgError, ValueError):
+        return None
+    if not np.all(np.isfinite(G)):
+        return None
+    return G, s
+
+
+def ransac_fiore(A, model3d, data2d, threshold=8.0, confidence=0.999,
+                 max_iter=2000, batch=64, sample_size=6, lo_iter=5, seed=None):
+    """
+    Stima robusta dell'orientamento esterno: LO-RANSAC attorno a
+    exterior_fiore.
+
+    A ogni passo estrae `batch` campioni minimi, stima una posa per
+    ciascuno e le valuta tutte insieme con una proiezione batch
+    (proj.proj_batch) e costo MSAC. Il numero di iterazioni si adatta
+    alla frazione di inlier stimata (terminazione anticipata); ogni nuovo
+    miglior modello viene raffinato (ottimizzazione locale) rieseguendo
+    Fiore su tutti i suoi inlier.
+
+    Parametri:
+        A: matrice 3x3 di intrinseci (normalizzata: A[2,2] == 1)
+        model3d: punti 3D (shape: 3xN)
+        data2d: punti immagine (shape: 2xN)
+        threshold: soglia di riproiezione in pixel
+        confidence: probabilità desiderata di estrarre un campione pulito
+        max_iter: limite massimo di ipotesi (latenza limitata)
+        batch: ipotesi valutate per ogni proiezione batch
+        sample_size: dimensione del campione minimo (Fiore richiede >= 6)
+        lo_iter: iterazioni di ottimizzazione locale
+        seed: seme del generatore casuale
+
+    Restituisce:
+        G: matrice rigida 3x4 (rotazione + traslazione)
+        s: fattore di scala
+        inliers: maschera booleana (N,) delle corrispondenze inlier
+    """
+    model3d = np.asarray(model3d, dtype=float)
+    data2d = np.asarray(data2d, dtype=float)
+    N = data2d.shape[1]
+    if model3d.shape[1] != N:
+        raise ValueError("model3d e data2d devono avere lo stesso numero di punti")
+    if N < sample_size:
+        raise ValueError(f"Servono almeno {sample_size} corrispondenze, trovate {N}")
+
+    rng = np.random.default_rng(seed)
+    best = None                      # (cost, G, s, inliers)
+    needed = max_iter
+    done = 0
+
+    while done < min(needed, max_iter):
+        # Campioni minimi senza ripetizioni (scarta le righe con duplicati)
+        samples = rng.integers(0, N, size=(batch, sample_size))
+        srt = np.sort(samples, axis=1)
+        samples = samples[np.all(srt[:, 1:] != srt[:, :-1], axis=1)]
+        done += batch
+
+        fits = [_fit(A, model3d, data2d, idx) for idx in samples]
+        fits = [f for f in fits if f is not None]
+        if not fits:
+            continue
+        poses = np.stack([G for G, _ in fits])
+        inl, cost = _score(A, poses, model3d, data2d, threshold)
+
+        h = int(np.argmin(cost))
+        if best is not None and cost[h] >= best[0]:
+            continue
+        best = (cost[h], fits[h][0], fits[h][1], inl[h])
+
+        # Ottimizzazione locale sugli inlier del nuovo modello migliore
+        for _ in range(lo_iter):
+            idx = np.flatnonzero(best[3])
+            if idx.size < sample_size:
+                break
+            fit = _fit(A, model3d, data2d, idx)
+            if fit is None:
+                break
+            inl_lo, cost_lo = _score(A, fit[0][None], model3d, data2d, threshold)
+            if cost_lo[0] >= best[0]:
+                break
+            best = (cost_lo[0], fit[0], fit[1], inl_lo[0])
+
+        # Terminazione adattiva
+        w = best[3].mean()
+        if w >= 1.0:
+            break
+        if w > 0:
+            den = np.log1p(-w ** sample_size)
+            if den < 0:
+                needed = int(np.ceil(np.log1p(-confidence) / den))
+
+    if best is None:
+        raise ValueError("RANSAC: nessuna ipotesi di posa valida")
+
+    _, G, s, inliers = best
+    return G, s, inliers
+
+
+def refine_fiore(A, model3d, data2d, threshold=8.0, max_iter=5):
+    """
+    Stima Fiore su tutte le corrispondenze, scartando a ogni passo quelle
+    oltre `threshold` e ristimando sulle rimanenti.
+
+    Molto più veloce di ransac_fiore ma adatta solo quando gli outlier
+    sono pochi (es. corrispondenze inseguite da un frame all'altro).
+    Stessi argomenti e valori di ritorno di ransac_fiore; ValueError se la
+    stima degenera.
+    """
+    model3d = np.asarray(model3d, dtype=float)
+    data2d = np.asarray(data2d, dtype=float)
+    idx = np.arange(data2d.shape[1])
+    inliers = None
+    for _ in range(max_iter):
+        if idx.size < 6:
+            raise ValueError(f"Servono almeno 6 corrispondenze, trovate {idx.size}")
+        fit = _fit(A, model3d, data2d, idx)
+        if fit is None:
+            raise ValueError("Stima di Fiore degenere")
+        G, s = fit
+        inl, _ = _score(A, G[None], model3d, data2d, threshold)
+        inliers = inl[0]
+        new_idx = np.flatnonzero(inliers)
+        if np.array_equal(new_idx, idx):
+            break
+        idx = new_idx
+    return G, s, inliers
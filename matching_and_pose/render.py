@@ -0,0 +1,140 @@
+"""
+Rendering con z-buffer della point cloud vista da una camera stimata.
+
+    dm = render.render(K @ G, X, Iw, Ih, scale=0.25)
+    dm.depth[v, u]     # profondità del punto più vicino (inf = vuoto)
+    dm.index[v, u]     # indice in X di quel punto (-1 = vuoto)
+    q = render.visibility_score(dm, p3D)
+
+Il cloud (anche un memory-map da decine di milioni di punti) si
+proietta a blocchi con proj.proj_batch; i punti dietro la camera o fuori
+dall'immagine vengono scartati e l'occlusione si risolve con uno
+scatter-min sul buffer di profondità (np.minimum.at), senza cicli per
+punto. Con scale < 1 le mappe sono a risoluzione ridotta: più veloci e
+con meno buchi tra i punti di un cloud sparso.
+"""
+import numpy as np
+
+import proj
+
+
+class DepthMap:
+    """
+    Mappe di profondità e di indice di una vista del cloud.
+
+    depth : np.ndarray (h, w) float32, inf dove nessun punto cade nel pixel
+    index : np.ndarray (h, w) int64, -1 dove nessun punto cade nel pixel
+    P : np.ndarray (3,4), proiezione già scalata alla risoluzione delle mappe
+    scale : float, rapporto tra le mappe e l'immagine piena
+    """
+    def __init__(self, depth, index, P, scale):
+        self.depth = depth
+        self.index = index
+        self.P = P
+        self.scale = scale
+
+    @property
+    def shape(self):
+        return self.depth.shape
+
+    @property
+    def coverage(self) -> float:
+        """Frazione dei pixel su cui cade almeno un punto."""
+        return float(np.count_nonzero(self.index >= 0)) / self.index.size
+
+    def project(self, c3d):
+        """
+        Pixel (u, v) delle mappe e profondità w di punti 3D (N,3); ok è
+        la maschera dei punti davanti alla camera e dentro le mappe.
+        """
+        x, y, w = proj.proj_batch(self.P, np.asarray(c3d))
+        return _pixels(x[0], y[0], w[0], self.shape)
+
+
+def _pixels(x, y, w, shape, near=0.0):
+    h, wd = shape
+    # confronti sui float: i punti con w <= 0 (x, y non finiti) restano fuori
+    with np.errstate(invalid='ignore'):
+        ok = (w > near) & (x >= -0.5) & (x < wd - 0.5) & (y >= -0.5) & (y < h - 0.5)
+    u = np.zeros(x.shape, dtype=np.int64)
+    v = np.zeros(y.shape, dtype=np.int64)
+    # stessa convenzione di proj.proj: pixel arrotondato
+    u[ok] = np.rint(x[ok])
+    v[ok] = np.rint(y[ok])
+    return u, v, w, ok
+
+
+def render(P: np.ndarray, X, width: int, height: int, scale: float = 1.0,
+           chunk: int = 1 << 20, near: float = 0.0) -> DepthMap:
+    """
+    Proietta il cloud con la camera P e tiene per ogni pixel il punto
+    più vicino.
+
+    Parametri
+    ----------
+    P : np.ndarray, shape (3,4)
+        Matrice di proiezione (K @ G) alla risoluzione piena.
+    X : np.ndarray, shape (N,3)
+        Punti del cloud (anche float32 o memory-map, letto a blocchi).
+    width, height : int
+        Dimensione dell'immagine piena.
+    scale : float
+        Scala delle mappe rispetto all'immagine (es. 0.25).
+    chunk : int
+        Punti proiettati per blocco (limita la memoria temporanea).
+    near : float
+        Scarta i punti con profondità <= near.
+
+    Ritorna
+    -------
+    DepthMap
+    """
+    P = np.asarray(P, dtype=float)
+    if P.shape != (3, 4):
+        raise ValueError("P deve essere di forma (3,4)")
+    if X.ndim != 2 or X.shape[1] != 3:
+        raise ValueError("X deve essere di forma (N,3)")
+    Ps = np.diag([scale, scale, 1.0]) @ P
+    shape = (max(int(round(height * scale)), 1), max(int(round(width * scale)), 1))
+
+    depth = np.full(shape[0] * shape[1], np.inf, dtype=np.float32)
+    index = np.full(shape[0] * shape[1], -1, dtype=np.int64)
+    for s in range(0, len(X), chunk):
+        x, y, w = proj.proj_batch(Ps, np.asarray(X[s:s + chunk]))
+        u, v, w, ok = _pixels(x[0], y[0], w[0], shape, near)
+        sel = np.flatnonzero(ok)
+        if sel.size == 0:
+            continue
+        lin = v[sel] * shape[1] + u[sel]
+        d = w[sel].astype(np.float32)
+        # z-buffer: minimo per pixel, poi l'indice di chi l'ha raggiunto
+        # (dei blocchi precedenti resta solo chi non è stato superato)
+        np.minimum.at(depth, lin, d)
+        win = d == depth[lin]
+        index[lin[win]] = s + sel[win]
+    return DepthMap(depth.reshape(shape), index.reshape(shape), Ps, scale)
+
+
+def visibility_score(dm: DepthMap, p3D, tol: float = 0.05) -> dict:
+    """
+    Verifica veloce di una posa: quanti punti 3D (di solito gli inlier
+    della stima) cadono nell'immagine e sono visibili, cioè non più
+    lontani di (1 + tol) volte la superficie del z-buffer nel loro pixel.
+    Con una posa sbagliata i punti finiscono fuori dall'immagine o
+    dietro altre parti del cloud.
+
+    Ritorna un dict con 'points', 'in_frame' e 'visible' (frazioni di
+    p3D), 'coverage' (frazione di pixel con almeno un punto del cloud) e
+    'score' = visible.
+    """
+    p3D = np.asarray(p3D).reshape(-1, 3)
+    n = len(p3D)
+    u, v, w, ok = dm.project(p3D)
+    surface = dm.depth[v[ok], u[ok]]
+    visible = int(np.count_nonzero(w[ok] <= surface * (1.0 + tol)))
+    in_frame = int(np.count_nonzero(ok))
+    return {'points': n,
+            'in_frame': in_frame / n if n else 0.0,
+            'visible': visible / n if n else 0.0,
+            'coverage': dm.coverage,
+            'score': visible / n if n else 0.0}
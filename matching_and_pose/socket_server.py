@@ -1,20 +1,29 @@
 # socket_server.py
 import socket, struct, json
+import asyncio, threading, argparse
 
 class JSONSocketOneShot:
     """
     Apre un socket TCP, accetta un client, invia un singolo dict JSON length-prefixed, poi chiude.
+    Con `timeout` (secondi) rinuncia se nessun client si collega in tempo.
     """
-    def __init__(self, host='127.0.0.1', port=5005):
+    def __init__(self, host='127.0.0.1', port=5005, timeout=None):
         self.host = host
         self.port = port
+        self.timeout = timeout
 
     def send_once(self, data: dict):
         server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         server.bind((self.host, self.port))
         server.listen(1)
+        server.settimeout(self.timeout)
         print(f"[SocketOneShot] In ascolto su {self.host}:{self.port}")
-        conn, addr = server.accept()
+        try:
+            conn, addr = server.accept()
+        except socket.timeout:
+            server.close()
+            print("[SocketOneShot] Nessun client collegato, invio annullato")
+            return False
         print(f"[SocketOneShot] Connessione da {addr}, invio dati…")
         payload = json.dumps(data).encode('utf-8')
         conn.sendall(struct.pack('>I', len(payload)))
@@ -22,3 +31,171 @@ class JSONSocketOneShot:
         conn.close()
         server.close()
         print("[SocketOneShot] Dati inviati e socket chiuso")
+        return True
+
+
+class PoseBroadcastServer:
+    """
+    Server asyncio persistente che inoltra ogni nuova posa a tutti i client
+    collegati, con la stessa trama di JSONSocketOneShot ('>I' + JSON).
+
+    - i subscriber (es. Unity) si collegano e ricevono un messaggio per
+      ogni posa, sulla stessa connessione; all'arrivo ricevono subito
+      l'ultima posa pubblicata (replay_last)
+    - un client che invia un messaggio è un publisher: il messaggio
+      viene inoltrato a tutti gli altri (vedi publish_pose)
+    - ogni client ha una coda limitata: se è piena si scarta la posa
+      più vecchia, così un consumer lento non rallenta mai chi pubblica
+
+    publish() è thread-safe e non bloccante.
+    """
+    def __init__(self, host='127.0.0.1', port=5005, queue_size=8, replay_last=True):
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.replay_last = replay_last
+        self.dropped = 0
+        self._clients = set()
+        self._last = None
+        self._loop = None
+        self._stop = None
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = None
+
+    @property
+    def num_clients(self):
+        return len(self._clients)
+
+    def _broadcast(self, payload, exclude=None):
+        self._last = payload
+        for q in list(self._clients):
+            if q is exclude:
+                continue
+            if q.full():
+                q.get_nowait()          # drop-oldest
+                self.dropped += 1
+            q.put_nowait(payload)
+
+    async def _send_loop(self, q, writer):
+        try:
+            while True:
+                payload = await q.get()
+                writer.write(struct.pack('>I', len(payload)) + payload)
+                await writer.drain()
+        except (ConnectionError, OSError):
+            pass
+
+    async def _handle(self, reader, writer):
+        addr = writer.get_extra_info('peername')
+        q = asyncio.Queue(maxsize=self.queue_size)
+        if self.replay_last and self._last is not None:
+            q.put_nowait(self._last)
+        self._clients.add(q)
+        sender = asyncio.ensure_future(self._send_loop(q, writer))
+        print(f"[PoseBroadcast] Client collegato: {addr} ({len(self._clients)} attivi)")
+        try:
+            while True:
+                (n,) = struct.unpack('>I', await reader.readexactly(4))
+                payload = await reader.readexactly(n)
+                try:
+                    json.loads(payload.decode('utf-8'))
+                except ValueError:
+                    continue    # messaggio non valido, ignorato
+                self._broadcast(payload, exclude=q)
+        except (asyncio.IncompleteReadError, asyncio.CancelledError, ConnectionError, OSError):
+            pass    # client chiuso o server in arresto
+        finally:
+            self._clients.discard(q)
+            sender.cancel()
+            writer.close()
+            print(f"[PoseBroadcast] Client scollegato: {addr}")
+
+    async def _main(self):
+        self._loop = asyncio.get_running_loop()
+        self._stop = asyncio.Event()
+        server = await asyncio.start_server(self._handle, self.host, self.port)
+        print(f"[PoseBroadcast] In ascolto su {self.host}:{self.port}")
+        self._ready.set()
+        try:
+            async with server:
+                await self._stop.wait()
+        finally:
+            self._loop = None
+
+    def serve_forever(self):
+        """Esegue il server nel thread corrente (bloccante)."""
+        asyncio.run(self._main())
+
+    def start(self):
+        """
+        Avvia il server su un thread in background; rilancia l'errore di
+        avvio (es. OSError se la porta è occupata).
+        """
+        def run():
+            try:
+                self.serve_forever()
+            except BaseException as e:
+                if not self._ready.is_set():
+                    self._error = e
+            finally:
+                # start() non resta mai in attesa, qualunque sia l'errore
+                self._ready.set()
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+        return self
+
+    def stop(self):
+        loop = self._loop
+        if loop is not None:
+            try:
+                loop.call_soon_threadsafe(self._stop.set)
+            except RuntimeError:
+                pass    # loop già chiuso
+        if self._thread is not None:
+            self._thread.join(timeout=2)
+
+    def publish(self, data: dict) -> bool:
+        """
+        Inoltra `data` a tutti i subscriber senza attendere nessuno.
+        Se il server non è in esecuzione (prima di start() o dopo stop())
+        il messaggio viene scartato e ritorna False.
+        """
+        payload = json.dumps(data).encode('utf-8')
+        loop = self._loop
+        if loop is None:
+            return False
+        try:
+            loop.call_soon_threadsafe(self._broadcast, payload)
+        except RuntimeError:
+            return False    # loop chiuso nel frattempo
+        return True
+
+
+def publish_pose(data: dict, host='127.0.0.1', port=5005, timeout=0.5) -> bool:
+    """
+    Pubblica una posa su un PoseBroadcastServer già in esecuzione.
+    Ritorna False se nessun server è in ascolto.
+    """
+    payload = json.dumps(data).encode('utf-8')
+    try:
+        with socket.create_connection((host, port), timeout=timeout) as sock:
+            sock.sendall(struct.pack('>I', len(payload)) + payload)
+        return True
+    except OSError:
+        return False
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Server di broadcast delle pose (trama '>I' + JSON)")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=5005)
+    parser.add_argument('--queue-size', type=int, default=8)
+    args = parser.parse_args()
+    try:
+        PoseBroadcastServer(args.host, args.port, args.queue_size).serve_forever()
+    except KeyboardInterrupt:
+        pass
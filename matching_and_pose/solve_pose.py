@@ -0,0 +1,164 @@
+import os
+import json
+import numpy as np
+
+import ransac
+import render
+import set_unity_camera
+import tracing
+
+def associate(view, f_ref, f_tgt, max_dist=3.0, ambiguity_ratio=None, mutual=False,
+              return_index=False):
+    """
+    Associa i match ref→tgt ai punti 3D della camera di riferimento:
+    per ogni keypoint di riferimento cerca il punto 2D visibile più
+    vicino nell'indice di `view` e tiene solo quelli entro `max_dist` px
+    (vedi assoc_index.AssociationIndex.query per gli altri filtri).
+
+    Ritorna p3D (M,3) e i corrispondenti punti target f_tgt (M,2); con
+    return_index=True anche rows (M,), le righe di f_ref/f_tgt associate.
+    """
+    # Allignment 2D→3D point with KD-Tree on 2D point projected on 3D cloud 
+    # Find the nearest point for each matched 2D keypoint  
+    # Filter the more long distance corrispondences (< 3 px)
+    #
+    idx, spatial_mask, _ = view.index.query(f_ref, max_dist, ambiguity_ratio, mutual)
+
+    # take only the coherent points for the pose estimation 
+    if return_index:
+        return view.p3D[idx[spatial_mask]], f_tgt[spatial_mask], np.flatnonzero(spatial_mask)
+    return view.p3D[idx[spatial_mask]], f_tgt[spatial_mask]
+
+
+def associate_multi(views, f_refs, f_tgts, max_dist=3.0, ambiguity_ratio=None, mutual=False):
+    """
+    Come associate, su più camere di riferimento: unisce le
+    corrispondenze 2D→3D di ogni coppia (views[i], f_refs[i], f_tgts[i])
+    e, se lo stesso punto 3D (id Zephyr) arriva da più camere, tiene
+    l'associazione più vicina.
+
+    Ritorna p3D (M,3), f_tgt (M,2), ids (M,) dei punti 3D, src (M,),
+    indice della camera di provenienza, e rows (M,), righe dei match
+    associati in f_refs/f_tgts concatenati.
+    """
+    p3D, tgt, ids, dist, src, rows = [], [], [], [], [], []
+    offset = 0
+    for i, (view, f_ref, f_tgt) in enumerate(zip(views, f_refs, f_tgts)):
+        idx, mask, d = view.index.query(f_ref, max_dist, ambiguity_ratio, mutual)
+        idx = idx[mask]
+        p3D.append(view.p3D[idx])
+        tgt.append(f_tgt[mask])
+        ids.append(view.ids[idx])
+        dist.append(d[mask])
+        src.append(np.full(idx.size, i, dtype=np.int32))
+        rows.append(offset + np.flatnonzero(mask))
+        offset += len(f_ref)
+    p3D, tgt, ids, dist, src, rows = (np.concatenate(a) for a in (p3D, tgt, ids, dist, src, rows))
+
+    # deduplica per id 3D: a parità di id vince la distanza minore
+    order = np.lexsort((dist, ids))
+    first = order[np.r_[True, ids[order][1:] != ids[order][:-1]]]
+    return p3D[first], tgt[first], ids[first], src[first], rows[first]
+
+
+def _match_mask(n, rows, inliers):
+    """Maschera (n,) dei match: True per le righe associate e inlier RANSAC."""
+    mask = np.zeros(n, dtype=bool)
+    mask[rows[inliers]] = True
+    return mask
+
+
+def unity_params(KK, G, scale, Iw, Ih):
+    """Dict dei parametri (schema di camera_parameters.json) per la posa G."""
+    # convert camera parameters in Unity like format (focal, euler, position) 
+    f_mm, sx, sy, lsx, lsy, euler_deg, pos_u = set_unity_camera.set_unity_cam(
+        Iw, Ih, KK, G[:, :3], G[:, 3]
+    )
+
+    # intrinsic matrix, pose, scale
+    return {
+        "intrinsics_K": KK.flatten().tolist(),
+        "pose_G":       G.flatten().tolist(),
+        "scale_s":      float(scale),
+        "unity": {
+            "focal_mm":     float(f_mm),
+            "sensor_x_mm":  float(sx),
+            "sensor_y_mm":  float(sy),
+            "lens_shift_x": float(lsx),
+            "lens_shift_y": float(lsy),
+            "euler_deg":    [float(a) for a in euler_deg],
+            "position":     [float(c) for c in pos_u]
+        }
+    }
+
+
+def verify_pose(cloud, KK, G, Iw, Ih, p3D, scale=0.25, tol=0.05):
+    """
+    Verifica della posa G con il rendering z-buffer del cloud (vedi
+    render.render): ritorna il dict di render.visibility_score per i
+    punti p3D (gli inlier) e la DepthMap della vista.
+    """
+    with tracing.span("pose.verify", items=len(cloud), points=len(p3D)) as sp:
+        dm = render.render(KK @ G, cloud, Iw, Ih, scale)
+        quality = render.visibility_score(dm, p3D, tol)
+        sp.set(score=quality['score'])
+    print(f"Verifica: {quality['visible']:.0%} inlier visibili, "
+          f"copertura {quality['coverage']:.0%}")
+    return quality, dm
+
+
+def solve_pose(view, f_ref, f_tgt, KK, Iw, Ih, max_dist=3.0, ambiguity_ratio=None, mutual=False,
+               cloud=None):
+    """
+    Stima la posa della camera target a partire dai match con la camera
+    di riferimento `view` (project.CameraView, con il KD-tree già costruito).
+    Se è dato il `cloud` (N,3) del progetto, la posa viene verificata con
+    verify_pose e il risultato è in params['quality'].
+
+    Ritorna il dict dei parametri (come camera_parameters.json) e la
+    maschera (len(f_ref),) degli inlier: True per i match associati a un
+    punto 3D e accettati da RANSAC.
+    """
+    with tracing.span("pose.associate", items=len(f_ref)):
+        p3D_filt, f_tgt_filt, rows = associate(view, f_ref, f_tgt, max_dist, ambiguity_ratio,
+                                               mutual, return_index=True)
+
+    # G -> pose matrix
+    # scale -> scale to adapt 3D -> 2D
+    # Robust estimation: LO-RANSAC around Fiore, discards wrong matches
+    with tracing.span("pose.ransac", items=len(p3D_filt)) as sp:
+        G, scale, inliers = ransac.ransac_fiore(KK, p3D_filt.T, f_tgt_filt.T)
+        sp.set(inliers=int(inliers.sum()))
+    print(f"Pose: {inliers.sum()}/{inliers.size} inlier")
+
+    params = unity_params(KK, G, scale, Iw, Ih)
+    if cloud is not None:
+        params["quality"], _ = verify_pose(cloud, KK, G, Iw, Ih, p3D_filt[inliers])
+    return params, _match_mask(len(f_ref), rows, inliers)
+
+def solve_pose_multi(views, f_refs, f_tgts, KK, Iw, Ih, max_dist=3.0,
+                     ambiguity_ratio=None, mutual=False, cloud=None):
+    """
+    Come solve_pose, con i match della target su più camere di
+    riferimento (vedi associate_multi). Ritorna il dict dei parametri e
+    la maschera degli inlier per riga di f_refs/f_tgts concatenati.
+    """
+    with tracing.span("pose.associate", items=sum(len(f) for f in f_refs), cameras=len(views)):
+        p3D, f_tgt, _, src, rows = associate_multi(views, f_refs, f_tgts, max_dist, ambiguity_ratio, mutual)
+
+    with tracing.span("pose.ransac", items=len(p3D)) as sp:
+        G, scale, inliers = ransac.ransac_fiore(KK, p3D.T, f_tgt.T)
+        sp.set(inliers=int(inliers.sum()))
+    print(f"Pose: {inliers.sum()}/{inliers.size} inlier da {len(views)} camere "
+          f"({np.bincount(src[inliers], minlength=len(views)).tolist()})")
+
+    params = unity_params(KK, G, scale, Iw, Ih)
+    if cloud is not None:
+        params["quality"], _ = verify_pose(cloud, KK, G, Iw, Ih, p3D[inliers])
+    return params, _match_mask(sum(len(f) for f in f_refs), rows, inliers)
+
+def save_params(params, out_file='./output/camera_parameters.json'):
+    os.makedirs(os.path.dirname(out_file), exist_ok=True)
+    with open(out_file, 'w') as jf:
+        json.dump(params, jf, indent=2)
+    return out_file
@@ -0,0 +1,318 @@
+#!/usr/bin/env python3
+"""
+Span di tracing per fase, leggeri e propagati tra processi.
+
+    import tracing
+    with tracing.span("lightglue.extract", items=len(kp)) as sp:
+        ...
+        sp.set(bytes=arr.nbytes)
+
+Ogni span registra tempo reale e CPU (del thread), attributi liberi
+(conteggi, byte, ...) e il padre. È disattivato (costo trascurabile)
+finché non si imposta TRACE=1 o si chiama enable().
+
+Gli eventi di tutti i processi di una stessa traccia vengono aggiunti a
+`<TRACE_DIR>/<trace_id>.jsonl`. Il contesto passa ai processi figli con
+la variabile TRACE_PARENT (vedi child_env) e al pose worker nel campo
+"trace" della richiesta (vedi context / remote).
+
+    python tracing.py output/trace/<trace_id>.jsonl
+
+scrive il Chrome trace (`.json`, da aprire in chrome://tracing o
+Perfetto) e stampa la tabella riassuntiva per nome di span.
+
+Variabili d'ambiente:
+    TRACE=1              attiva il tracing
+    TRACE_DIR            cartella delle tracce (default ./output/trace)
+    TRACE_PROFILE=nome   esegue sotto cProfile gli span con quel nome
+                         (.prof nella cartella delle tracce)
+    TRACE_PARENT         contesto ereditato dal processo padre
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import pstats
+import cProfile
+import threading
+from collections import OrderedDict
+
+TRACE_DIR = os.environ.get('TRACE_DIR', os.path.join('.', 'output', 'trace'))
+PROFILE = os.environ.get('TRACE_PROFILE') or None
+
+_enabled = os.environ.get('TRACE', '0') not in ('', '0') or 'TRACE_PARENT' in os.environ
+_trace_id = None
+_root_parent = None          # span padre in un altro processo
+_local = threading.local()
+_write_lock = threading.Lock()
+
+
+class _NullSpan:
+    def set(self, **attrs):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL = _NullSpan()
+
+
+class Span:
+    def __init__(self, name, parent, attrs):
+        self.name = name
+        self.trace = _current_trace()
+        self.id = uuid.uuid4().hex[:16]
+        self.parent = parent
+        self.attrs = attrs
+        self.dir = _trace_dir()
+        self._profile = None
+
+    def set(self, **attrs):
+        """Aggiunge o aggiorna attributi (es. items=..., bytes=...)."""
+        self.attrs.update(attrs)
+
+    def __enter__(self):
+        stack = _stack()
+        stack.append(self)
+        if _profile_name() == self.name:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        self._ts = time.time()
+        self._t0 = time.perf_counter()
+        self._c0 = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self._t0
+        cpu = time.thread_time() - self._c0
+        if self._profile is not None:
+            self._profile.disable()
+            _dump_profile(self._profile, self.name, self.id, self.dir)
+        stack = _stack()
+        if stack and stack[-1] is self:
+            stack.pop()
+        if exc_type is not None:
+            self.attrs['error'] = f"{exc_type.__name__}: {exc}"
+        _write({'trace': self.trace, 'id': self.id, 'parent': self.parent, 'name': self.name,
+                'ts': self._ts, 'wall': wall, 'cpu': cpu, 'pid': os.getpid(),
+                'tid': threading.get_ident(), 'attrs': self.attrs}, self.dir)
+        return False
+
+
+def _stack():
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    return stack
+
+
+def _current_trace():
+    # un worker serve più tracce in thread diversi: vedi remote()
+    return getattr(_local, 'trace', None) or _trace_id
+
+
+# dentro remote() il thread usa lo stato ricevuto con la richiesta
+# (attivo, cartella, profilo) invece di quello del processo
+
+def _is_enabled():
+    return _enabled or getattr(_local, 'enabled', False)
+
+
+def _trace_dir():
+    return getattr(_local, 'dir', None) or TRACE_DIR
+
+
+def _profile_name():
+    return getattr(_local, 'profile', None) or PROFILE
+
+
+def _init_from_env():
+    global _trace_id, _root_parent
+    parent = os.environ.get('TRACE_PARENT')
+    if parent and ':' in parent:
+        _trace_id, _root_parent = parent.split(':', 1)
+        _root_parent = _root_parent or None
+    else:
+        _trace_id = uuid.uuid4().hex[:16]
+
+
+def enable(trace_dir=None, profile=None):
+    """Attiva il tracing in questo processo (come TRACE=1)."""
+    global _enabled, TRACE_DIR, PROFILE
+    _enabled = True
+    if trace_dir:
+        TRACE_DIR = trace_dir
+    if profile:
+        PROFILE = profile
+
+
+def enabled() -> bool:
+    return _is_enabled()
+
+
+def trace_path(trace_id=None, trace_dir=None) -> str:
+    return os.path.join(trace_dir or _trace_dir(), f"{trace_id or _trace_id}.jsonl")
+
+
+def span(name, **attrs):
+    """Context manager di uno span; no-op se il tracing è disattivato."""
+    if not _is_enabled():
+        return _NULL
+    stack = _stack()
+    parent = stack[-1].id if stack else getattr(_local, 'remote', None) or _root_parent
+    return Span(name, parent, attrs)
+
+
+def traced(name=None):
+    """Decoratore: esegue la funzione dentro uno span (default: nome qualificato)."""
+    def deco(fn):
+        label = name or f"{fn.__module__}.{fn.__qualname__}"
+
+        def wrapper(*args, **kwargs):
+            with span(label):
+                return fn(*args, **kwargs)
+        wrapper.__name__ = fn.__name__
+        wrapper.__doc__ = fn.__doc__
+        wrapper.__wrapped__ = fn
+        return wrapper
+    return deco
+
+
+def context():
+    """Contesto dello span corrente da passare a un altro processo, None se disattivato."""
+    if not _is_enabled():
+        return None
+    stack = _stack()
+    parent = stack[-1].id if stack else getattr(_local, 'remote', None) or _root_parent
+    return {'trace': _current_trace(), 'parent': parent, 'dir': os.path.abspath(_trace_dir()),
+            'profile': _profile_name()}
+
+
+class _Remote:
+    _FIELDS = ('enabled', 'dir', 'profile', 'trace', 'remote')
+
+    def __init__(self, ctx):
+        self.ctx = ctx
+
+    def __enter__(self):
+        if self.ctx:
+            # stato del solo thread corrente: le richieste servite in
+            # parallelo dal worker non si influenzano a vicenda
+            self._prev = tuple(getattr(_local, k, None) for k in self._FIELDS)
+            _local.enabled = True
+            _local.dir = self.ctx.get('dir')
+            _local.profile = self.ctx.get('profile')
+            _local.trace = self.ctx['trace']
+            _local.remote = self.ctx.get('parent')
+        return self
+
+    def __exit__(self, *exc):
+        if self.ctx:
+            for k, v in zip(self._FIELDS, self._prev):
+                setattr(_local, k, v)
+        return False
+
+
+def remote(ctx):
+    """
+    Context manager: adotta nel thread corrente il contesto `ctx` ricevuto
+    da un altro processo (vedi context()); gli span aperti dentro il
+    blocco ne sono figli. No-op se ctx è None.
+    """
+    return _Remote(ctx)
+
+
+def child_env(env=None):
+    """Ambiente per un sottoprocesso che continua la traccia corrente."""
+    env = dict(os.environ if env is None else env)
+    ctx = context()
+    if ctx:
+        env['TRACE_PARENT'] = f"{ctx['trace']}:{ctx['parent'] or ''}"
+        env['TRACE_DIR'] = ctx['dir']
+        if ctx['profile']:
+            env['TRACE_PROFILE'] = ctx['profile']
+    return env
+
+
+def _write(event, trace_dir):
+    line = json.dumps(event, default=str) + '\n'
+    with _write_lock:
+        os.makedirs(trace_dir, exist_ok=True)
+        with open(trace_path(event['trace'], trace_dir), 'a') as f:
+            f.write(line)
+
+
+def _dump_profile(profile, name, span_id, trace_dir):
+    os.makedirs(trace_dir, exist_ok=True)
+    path = os.path.join(trace_dir, f"{name}-{span_id}.prof")
+    profile.dump_stats(path)
+    print(f"[Tracing] profilo di '{name}' in {path}")
+    pstats.Stats(profile, stream=sys.stdout).sort_stats('cumulative').print_stats(15)
+
+
+# ---------------------------------------------------------------- export
+
+def load(path):
+    """Eventi di una traccia (righe troncate ignorate)."""
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+    return events
+
+
+def to_chrome(events, out_file):
+    """Scrive il Chrome trace (eventi 'X' completi, tempi in µs)."""
+    trace = [{'name': e['name'], 'ph': 'X', 'ts': e['ts'] * 1e6, 'dur': e['wall'] * 1e6,
+              'pid': e['pid'], 'tid': e['tid'],
+              'args': dict(e['attrs'], cpu_ms=round(e['cpu'] * 1e3, 3), id=e['id'],
+                           parent=e['parent'])}
+             for e in events]
+    with open(out_file, 'w') as f:
+        json.dump({'traceEvents': trace, 'displayTimeUnit': 'ms'}, f)
+    return out_file
+
+
+def summary(events):
+    """Aggrega per nome: conteggio, tempo reale e CPU totali, somma degli attributi numerici."""
+    rows = OrderedDict()
+    for e in sorted(events, key=lambda e: e['ts']):
+        r = rows.setdefault(e['name'], {'count': 0, 'wall': 0.0, 'cpu': 0.0, 'items': 0, 'bytes': 0})
+        r['count'] += 1
+        r['wall'] += e['wall']
+        r['cpu'] += e['cpu']
+        for k in ('items', 'bytes'):
+            v = e['attrs'].get(k)
+            if isinstance(v, (int, float)):
+                r[k] += int(v)
+    return rows
+
+
+def format_summary(rows) -> str:
+    lines = [f"{'span':32s} {'n':>5s} {'wall ms':>10s} {'cpu ms':>10s} {'items':>10s} {'MB':>9s}"]
+    for name, r in sorted(rows.items(), key=lambda kv: -kv[1]['wall']):
+        lines.append(f"{name:32s} {r['count']:>5d} {r['wall'] * 1e3:10.1f} {r['cpu'] * 1e3:10.1f} "
+                     f"{r['items']:>10d} {r['bytes'] / 2**20:9.2f}")
+    return '\n'.join(lines)
+
+
+_init_from_env()
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python tracing.py <trace.jsonl> [...]")
+        sys.exit(1)
+    for path in sys.argv[1:]:
+        events = load(path)
+        out = to_chrome(events, os.path.splitext(path)[0] + '.json')
+        print(f"{path}: {len(events)} span -> {out}")
+        print(format_summary(summary(events)))
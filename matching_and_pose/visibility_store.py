@@ -0,0 +1,244 @@
+#!/usr/bin/env python3
+"""
+Archivio binario indicizzato per i file di visibilità di Zephyr.
+
+Il file testuale
+
+    Visibility for camera <nome>
+    <count>
+    <id> <x> <y>
+    ...
+
+viene convertito una sola volta in una cartella accanto al file
+(`<visibility>.store/`) con:
+    ids.i32      id dei punti 3D, int32 contigui
+    xy.f32       coordinate 2D, float32 (n, 2) contigue
+    offsets.npy  offset di inizio di ciascuna camera (n_cam + 1,)
+    meta.json    nomi delle camere e firma del file sorgente
+    covis.npz    co-visibilità camera × camera (creata alla prima richiesta)
+
+La lettura usa np.memmap: per una camera si legge solo la sua fetta.
+"""
+import os
+import sys
+import json
+import shutil
+import uuid
+import numpy as np
+from scipy import sparse
+
+STORE_VERSION = 1
+STORE_SUFFIX = '.store'
+HEADER = b'Visibility for camera'
+
+
+def store_path(visibility_point_file: str) -> str:
+    return visibility_point_file + STORE_SUFFIX
+
+
+def _source_signature(path: str) -> dict:
+    st = os.stat(path)
+    return {'size': st.st_size, 'mtime_ns': st.st_mtime_ns}
+
+
+def _parse_block(lines):
+    """Converte le righe 'id x y' di una sezione in (ids, xy)."""
+    rows = [ln for ln in lines if len(ln.split()) == 3]
+    if not rows:
+        return np.empty(0, np.int32), np.empty((0, 2), np.float32)
+    vals = np.array(b' '.join(rows).split(), dtype=np.float64).reshape(-1, 3)
+    return vals[:, 0].astype(np.int32), vals[:, 1:].astype(np.float32)
+
+
+def build_store(visibility_point_file: str, chunk_lines: int = 1_000_000) -> str:
+    """
+    Converte il file di visibilità nell'archivio binario, in streaming
+    (memoria limitata a `chunk_lines` righe per volta).
+
+    L'archivio si scrive in una cartella temporanea propria del processo
+    e si pubblica con os.replace: più processi possono costruirlo insieme
+    (es. i worker di batch_localize); se un altro lo ha già pubblicato
+    si tiene il suo.
+
+    Ritorna il percorso della cartella dell'archivio.
+    """
+    out_dir = store_path(visibility_point_file)
+    tmp_dir = f"{out_dir}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}"
+    os.makedirs(tmp_dir)
+    try:
+        _write_store(visibility_point_file, tmp_dir, chunk_lines)
+    except BaseException:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        raise
+
+    if _is_published(out_dir, visibility_point_file):
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        return out_dir
+    shutil.rmtree(out_dir, ignore_errors=True)
+    try:
+        os.replace(tmp_dir, out_dir)
+    except OSError:
+        # pubblicato da un altro processo tra il controllo e il replace
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        if not _is_published(out_dir, visibility_point_file):
+            raise
+    return out_dir
+
+
+def _is_published(out_dir, visibility_point_file) -> bool:
+    try:
+        return VisibilityStore(out_dir).is_current(visibility_point_file)
+    except (OSError, ValueError, KeyError):
+        return False
+
+
+def _write_store(visibility_point_file, tmp_dir, chunk_lines):
+    sig = _source_signature(visibility_point_file)
+    cameras = []
+    offsets = [0]
+    total = 0
+
+    with open(visibility_point_file, 'rb') as f, \
+         open(os.path.join(tmp_dir, 'ids.i32'), 'wb') as f_ids, \
+         open(os.path.join(tmp_dir, 'xy.f32'), 'wb') as f_xy:
+
+        def flush(buf):
+            nonlocal total
+            ids, xy = _parse_block(buf)
+            f_ids.write(ids.tobytes())
+            f_xy.write(xy.tobytes())
+            total += ids.size
+            buf.clear()
+
+        buf = []
+        skip_count = False
+        for line in f:
+            line = line.strip()
+            if line.startswith(HEADER):
+                if cameras:
+                    flush(buf)
+                    offsets.append(total)
+                cameras.append(line[len(HEADER):].strip().decode('utf-8'))
+                skip_count = True   # la riga successiva è il count
+                continue
+            if skip_count:
+                skip_count = False
+                continue
+            if cameras and line:
+                buf.append(line)
+                if len(buf) >= chunk_lines:
+                    flush(buf)
+        if cameras:
+            flush(buf)
+            offsets.append(total)
+
+    np.save(os.path.join(tmp_dir, 'offsets.npy'), np.asarray(offsets, dtype=np.int64))
+    with open(os.path.join(tmp_dir, 'meta.json'), 'w') as jf:
+        json.dump({'version': STORE_VERSION, 'source': sig, 'cameras': cameras}, jf)
+
+
+class VisibilityStore:
+    """
+    Archivio di visibilità aperto in memory-map; lookup O(1) per camera.
+    """
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, 'meta.json'), 'r') as jf:
+            meta = json.load(jf)
+        self.directory = directory
+        self.meta = meta
+        self.cameras = meta['cameras']
+        self.index = {name: i for i, name in enumerate(self.cameras)}
+        self.offsets = np.load(os.path.join(directory, 'offsets.npy'))
+        n = int(self.offsets[-1])
+        if n:
+            self.ids = np.memmap(os.path.join(directory, 'ids.i32'), dtype=np.int32, mode='r', shape=(n,))
+            self.xy = np.memmap(os.path.join(directory, 'xy.f32'), dtype=np.float32, mode='r', shape=(n, 2))
+        else:
+            self.ids = np.empty(0, np.int32)
+            self.xy = np.empty((0, 2), np.float32)
+        self._covis = None
+
+    def is_current(self, visibility_point_file: str) -> bool:
+        return (self.meta.get('version') == STORE_VERSION and
+                self.meta.get('source') == _source_signature(visibility_point_file))
+
+    def __contains__(self, img_name):
+        return img_name in self.index
+
+    def camera(self, img_name: str):
+        """
+        Ritorna (ids, p2D) della camera `img_name` come viste in memory-map
+        (int32 (n,), float32 (n,2)); KeyError se assente.
+        """
+        i = self.index[img_name]
+        a, b = int(self.offsets[i]), int(self.offsets[i + 1])
+        return self.ids[a:b], self.xy[a:b]
+
+    def covisibility(self):
+        """
+        Matrice sparsa (CSR, n_cam × n_cam) con il numero di punti 3D
+        osservati da entrambe le camere; diagonale a zero. Calcolata una
+        volta (incidenza camera × punto per la sua trasposta) e salvata
+        in covis.npz.
+        """
+        if self._covis is not None:
+            return self._covis
+        path = os.path.join(self.directory, 'covis.npz')
+        try:
+            self._covis = sparse.load_npz(path).tocsr()
+            return self._covis
+        except (OSError, ValueError):
+            pass
+        n_cam = len(self.cameras)
+        n_pts = int(self.ids.max()) + 1 if self.ids.size else 0
+        A = sparse.csr_matrix((np.ones(self.ids.size, dtype=np.int32), np.asarray(self.ids),
+                               self.offsets.astype(np.int64)), shape=(n_cam, n_pts))
+        A.sum_duplicates()
+        A.data[:] = 1
+        C = (A @ A.T).tocsr()
+        C.setdiag(0)
+        C.eliminate_zeros()
+        try:
+            tmp = f"{path[:-4]}.tmp-{os.getpid()}-{uuid.uuid4().hex[:8]}.npz"
+            sparse.save_npz(tmp, C)
+            os.replace(tmp, path)
+        except OSError as e:
+            print(f"[VisibilityStore] co-visibilità non salvata: {e}")
+        self._covis = C
+        return C
+
+    def covisible(self, img_name: str, k: int = None):
+        """
+        Camere che condividono più punti 3D con `img_name`, in ordine
+        decrescente: lista di (nome, punti in comune), al massimo `k`.
+        """
+        row = self.covisibility().getrow(self.index[img_name])
+        order = np.argsort(-row.data, kind='stable')[:k]
+        return [(self.cameras[row.indices[j]], int(row.data[j])) for j in order]
+
+
+def open_store(visibility_point_file: str, rebuild: bool = True) -> VisibilityStore:
+    """
+    Apre l'archivio associato al file di visibilità; se manca o il file
+    sorgente è cambiato (dimensione / mtime) lo ricostruisce.
+    """
+    directory = store_path(visibility_point_file)
+    try:
+        store = VisibilityStore(directory)
+        if store.is_current(visibility_point_file):
+            return store
+    except (OSError, ValueError, KeyError):
+        pass
+    if not rebuild:
+        raise FileNotFoundError(f"Archivio di visibilità assente o non aggiornato: {directory}")
+    build_store(visibility_point_file)
+    return VisibilityStore(directory)
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python visibility_store.py <visibility.txt> [...]")
+        sys.exit(1)
+    for vis in sys.argv[1:]:
+        out = build_store(vis)
+        print(f"{vis} -> {out}")
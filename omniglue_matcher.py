@@ -3,25 +3,91 @@ import numpy as np
 from src import omniglue
 from src.omniglue import utils
 
-def run_omniglue(img0: np.ndarray, img1: np.ndarray):
+import feature_cache
+import matcher_registry
+import tracing
+
+class _CachedExtract:
     """
-    Esegue il matching con OmniGlue.
-    Restituisce keypoints, confidence e immagine di visualizzazione.
+    Avvolge un estrattore di OmniGlue (SuperPoint o DINOv2) in modo che
+    FindMatches legga le feature da feature_cache quando disponibili.
     """
+    def __init__(self, name, fn, names):
+        self.name = name
+        self.fn = fn
+        self.names = names
+
+    def __call__(self, image, *args, **kwargs):
+        def compute():
+            out = self.fn(image, *args, **kwargs)
+            out = out if isinstance(out, tuple) else (out,)
+            return {n: np.asarray(a) for n, a in zip(self.names, out)}
+        with tracing.span("omniglue.extract", model=self.name, bytes=image.nbytes):
+            arrays = feature_cache.cached(image, "OmniGlue." + self.name, compute,
+                                          args=args, **kwargs)
+        out = tuple(np.array(arrays[n]) for n in self.names)
+        return out if len(out) > 1 else out[0]
+
+def _load(og_export, sp_export, dino_export):
     og = omniglue.OmniGlue(
+        og_export=og_export,
+        sp_export=sp_export,
+        dino_export=dino_export,
+    )
+    if feature_cache.ENABLED:
+        if hasattr(og, "sp_extract"):
+            og.sp_extract = _CachedExtract("SuperPoint", og.sp_extract,
+                                           ("keypoints", "descriptors", "scores"))
+        if hasattr(og, "dino_extract"):
+            og.dino_extract = _CachedExtract("DINO", og.dino_extract, ("dino",))
+    return og
+
+def _model():
+    return matcher_registry.get(
+        "OmniGlue", _load,
         og_export="./models/omniglue.onnx",
         sp_export="./models/sp_v6.onnx",
         dino_export="./models/dinov2_vitb14_pretrain.pth",
     )
-    kp0, kp1, conf = og.FindMatches(img0, img1)
-    idx = [i for i, val in enumerate(conf) if val > 0.01] # <-- match threshold 
+
+def warmup():
+    """Carica OmniGlue nel registro senza eseguire matching."""
+    _model()
+
+def global_descriptor(image: np.ndarray) -> np.ndarray:
+    """
+    Descrittore globale dell'immagine per il retrieval: feature DINOv2
+    del backbone di OmniGlue (stesso modello residente del matching),
+    media delle feature dei patch normalizzate, poi L2-normalizzata.
+    Restituisce un vettore float32 (C,).
+    """
+    og = _model()
+    feats = np.asarray(og.dino_extract(image), dtype=np.float32)
+    feats = feats.reshape(-1, feats.shape[-1])
+    feats /= np.linalg.norm(feats, axis=1, keepdims=True) + 1e-12
+    desc = feats.mean(axis=0)
+    return desc / (np.linalg.norm(desc) + 1e-12)
+
+def run_omniglue(img0: np.ndarray, img1: np.ndarray, match_threshold: float = 0.01):
+    """
+    Esegue il matching con OmniGlue.
+    Restituisce keypoints, confidence e immagine di visualizzazione.
+    Il modello (ONNX + DINOv2) resta residente nel matcher_registry.
+    """
+    og = _model()
+    # FindMatches comprende le estrazioni, tracciate a parte (omniglue.extract)
+    with tracing.span("omniglue.match") as sp:
+        kp0, kp1, conf = og.FindMatches(img0, img1)
+        sp.set(items=len(kp0))
+    idx = [i for i, val in enumerate(conf) if val > match_threshold] # <-- match threshold 
     kp0, kp1 = kp0[idx], kp1[idx]
     conf = conf[idx]
 
-    viz = utils.visualize_matches(
-        img0, img1, kp0, kp1, np.eye(len(kp0)),
-        show_keypoints=True, highlight_unmatched=True,
-        title=f"{len(kp0)} match con OmniGlue", line_width=2
-    )
+    with tracing.span("omniglue.viz", items=len(kp0)):
+        viz = utils.visualize_matches(
+            img0, img1, kp0, kp1, np.eye(len(kp0)),
+            show_keypoints=True, highlight_unmatched=True,
+            title=f"{len(kp0)} match con OmniGlue", line_width=2
+        )
     
     return kp0, kp1, conf, viz
\ No newline at end of file
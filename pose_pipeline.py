@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+"""
+Pipeline in-process matching → pose estimation.
+
+    result = estimate_pose("ref.jpg", "tgt.jpg", ("cloud.ply", "visibility.txt"),
+                           matcher="LightGlue")
+
+Gli array passano in memoria tra matching, associazione 2D→3D
+(cKDTree del progetto), getInternals.get_internals, LO-RANSAC/Fiore e
+set_unity_camera.set_unity_cam: niente file intermedi, niente
+sottoprocessi, niente finestre di dialogo.
+"""
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+import matcher_registry
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "matching_and_pose"))
+import getInternals
+import image_io
+import project
+import tracing
+from solve_pose import solve_pose, solve_pose_multi, save_params
+
+
+class PoseResult:
+    """
+    Risultato di estimate_pose.
+
+    G : (3,4) posa [R|t] mondo → camera target
+    scale : fattore di scala di Fiore
+    K : (3,3) intrinseci della camera target
+    params : dict dei parametri (stesso contenuto di camera_parameters.json)
+    kp_ref, kp_tgt, conf : match a risoluzione piena
+    inliers : maschera (len(kp_ref),) dei match associati a un punto 3D e
+        accettati da RANSAC
+    image_size : (W, H) dell'immagine target
+    timings : secondi per fase
+    viz : immagine di visualizzazione del matcher
+    quality : verifica della posa (solve_pose.verify_pose), None se non richiesta
+    refs : [(nome camera, numero di match)] nell'ordine di kp_ref/kp_tgt
+        (estimate_pose_multi; con una sola reference è None)
+    """
+    def __init__(self, params, K, kp_ref, kp_tgt, conf, inliers, image_size, timings, viz=None,
+                 refs=None):
+        self.params = params
+        self.G = np.asarray(params["pose_G"]).reshape(3, 4)
+        self.scale = params["scale_s"]
+        self.K = K
+        self.kp_ref = kp_ref
+        self.kp_tgt = kp_tgt
+        self.conf = conf
+        self.inliers = inliers
+        self.image_size = image_size
+        self.timings = timings
+        self.viz = viz
+        self.quality = params.get("quality")
+        self.refs = refs
+
+    @property
+    def num_inliers(self) -> int:
+        return int(np.count_nonzero(self.inliers))
+
+
+def resize_image(img, max_width=800):
+    # stesso ridimensionamento della GUI prima del matching
+    h, w = img.shape[:2]
+    (new_w, new_h), scale = image_io.target_size(w, h, max_width)
+    if scale != 1.0:
+        resized = np.array(Image.fromarray(img).resize((new_w, new_h), Image.LANCZOS))
+        return resized, scale
+    return img, 1.0
+
+
+def load_image(image, max_width=800):
+    """
+    Immagine (percorso o array) ridotta per il matching: (img, scale, (W, H)).
+    I file vengono decodificati direttamente a scala ridotta (image_io).
+    """
+    if isinstance(image, np.ndarray):
+        small, scale = resize_image(image, max_width)
+        return small, scale, image.shape[1::-1]
+    return image_io.load_rgb(image, max_width)
+
+
+def _project(proj):
+    if isinstance(proj, project.ZephyrProject):
+        return proj
+    ply_file, vis_file = proj
+    return project.ZephyrProject(ply_file, vis_file)
+
+
+@tracing.traced("pipeline.estimate_pose")
+def estimate_pose(ref_image, tgt_image, proj, matcher="LightGlue",
+                  ref_name=None, K=None, max_width=800, max_dist=3.0,
+                  save_json=None, verify=False):
+    """
+    Stima la posa della camera target rispetto al progetto Zephyr.
+
+    Parametri
+    ----------
+    ref_image, tgt_image : str o np.ndarray HxWx3 (RGB, uint8)
+        Immagine di riferimento (una camera del progetto) e target.
+    proj : project.ZephyrProject o (ply_file, visibility_file)
+        Progetto; passare un ZephyrProject per riusare cloud e KD-tree.
+    matcher : str o callable
+        Nome di un backend di matcher_registry ("OmniGlue", "LiftFeat",
+        "LightGlue") o una funzione (img0, img1) -> (kp0, kp1, conf, viz).
+    ref_name : str, opzionale
+        Nome della camera di riferimento nel file di visibilità
+        (default: basename di ref_image).
+    K : np.ndarray (3,3), opzionale
+        Intrinseci della target; obbligatorio se tgt_image è un array,
+        altrimenti letti dagli EXIF.
+    max_width : int
+        Larghezza massima delle immagini passate al matcher.
+    max_dist : float
+        Soglia in pixel per l'associazione 2D→3D.
+    save_json : str, opzionale
+        Se indicato, salva anche i parametri in questo file JSON.
+    verify : bool
+        Verifica la posa con il rendering z-buffer del cloud
+        (PoseResult.quality, params["quality"]).
+
+    Ritorna
+    -------
+    PoseResult
+    """
+    timings = {}
+    t = time.perf_counter()
+
+    if ref_name is None:
+        if isinstance(ref_image, np.ndarray):
+            raise ValueError("ref_name è obbligatorio se ref_image è un array")
+        ref_name = os.path.basename(ref_image)
+    if K is None:
+        if isinstance(tgt_image, np.ndarray):
+            raise ValueError("K è obbligatoria se tgt_image è un array")
+        K = getInternals.get_internals(tgt_image)
+
+    img0_small, scale0, _ = load_image(ref_image, max_width)
+    img1_small, scale1, (Iw, Ih) = load_image(tgt_image, max_width)
+    timings["load"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    run_matcher = matcher_registry.backend(matcher) if isinstance(matcher, str) else matcher
+    kp0_s, kp1_s, conf, viz = run_matcher(img0_small, img1_small)
+    kp_ref = np.asarray(kp0_s, dtype=np.float32) / scale0
+    kp_tgt = np.asarray(kp1_s, dtype=np.float32) / scale1
+    timings["matching"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    proj = _project(proj)
+    view = proj.camera(ref_name)
+    timings["project"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    params, inliers = solve_pose(view, kp_ref, kp_tgt, K, Iw, Ih, max_dist=max_dist,
+                                 cloud=proj.X if verify else None)
+    timings["pose"] = time.perf_counter() - t
+
+    if save_json:
+        save_params(params, save_json)
+
+    return PoseResult(params, K, kp_ref, kp_tgt, np.asarray(conf), inliers,
+                      (Iw, Ih), timings, viz)
+
+
+@tracing.traced("pipeline.estimate_pose_multi")
+def estimate_pose_multi(ref_image, tgt_image, proj, matcher="LightGlue", covisible=3,
+                        ref_name=None, images_dir=None, K=None, max_width=800,
+                        max_dist=3.0, workers=None, save_json=None, verify=False):
+    """
+    Come estimate_pose, ma la target viene confrontata anche con le
+    `covisible` camere del progetto che condividono più punti 3D con la
+    reference (co-visibilità dell'archivio di visibilità). I match sono
+    calcolati in parallelo e le corrispondenze 2D→3D di tutte le coppie
+    vengono unite, senza duplicati per id 3D, prima di LO-RANSAC/Fiore.
+
+    Parametri aggiuntivi
+    --------------------
+    covisible : int
+        Numero di camere aggiunte alla reference.
+    images_dir : str, opzionale
+        Cartella delle immagini del progetto (default: cartella di
+        ref_image); le camere senza immagine vengono saltate.
+    workers : int, opzionale
+        Thread per il matching se il backend non ha match_many
+        (default: uno per coppia).
+
+    Ritorna
+    -------
+    PoseResult (kp_ref/kp_tgt/conf concatenati, vedi PoseResult.refs)
+    """
+    timings = {}
+    t = time.perf_counter()
+
+    if ref_name is None or images_dir is None:
+        if isinstance(ref_image, np.ndarray):
+            raise ValueError("ref_name e images_dir sono obbligatori se ref_image è un array")
+        ref_name = ref_name or os.path.basename(ref_image)
+        images_dir = images_dir or os.path.dirname(os.path.abspath(ref_image))
+    if K is None:
+        if isinstance(tgt_image, np.ndarray):
+            raise ValueError("K è obbligatoria se tgt_image è un array")
+        K = getInternals.get_internals(tgt_image)
+
+    proj = _project(proj)
+    names = [ref_name]
+    sources = [ref_image]
+    for name, _ in proj.covisible(ref_name):
+        if len(names) > covisible:
+            break
+        path = os.path.join(images_dir, name)
+        if os.path.exists(path):
+            names.append(name)
+            sources.append(path)
+    timings["covisibility"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    img1_small, scale1, (Iw, Ih) = load_image(tgt_image, max_width)
+    with ThreadPoolExecutor(workers or len(sources)) as pool:
+        refs = list(pool.map(lambda src: load_image(src, max_width)[:2], sources))
+    timings["load"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    many = matcher_registry.backend_many(matcher) if isinstance(matcher, str) else None
+    if many is not None:
+        # uno-a-molti con la target come "reference": le sue feature si
+        # estraggono una volta sola e le reference vanno a batch
+        matches = [(kp_r, kp_t, c) for kp_t, kp_r, c in many(img1_small, [img for img, _ in refs])]
+    else:
+        run_matcher = matcher_registry.backend(matcher) if isinstance(matcher, str) else matcher
+        with ThreadPoolExecutor(workers or len(refs)) as pool:
+            matches = list(pool.map(lambda r: run_matcher(r[0], img1_small)[:3], refs))
+    kp_refs = [np.asarray(kp0, dtype=np.float32).reshape(-1, 2) / scale0
+               for (kp0, _, _), (_, scale0) in zip(matches, refs)]
+    kp_tgts = [np.asarray(kp1, dtype=np.float32).reshape(-1, 2) / scale1 for _, kp1, _ in matches]
+    timings["matching"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    views = [proj.camera(name) for name in names]
+    timings["project"] = time.perf_counter() - t
+
+    t = time.perf_counter()
+    params, inliers = solve_pose_multi(views, kp_refs, kp_tgts, K, Iw, Ih, max_dist=max_dist,
+                                       cloud=proj.X if verify else None)
+    timings["pose"] = time.perf_counter() - t
+
+    if save_json:
+        save_params(params, save_json)
+
+    conf = np.concatenate([np.asarray(c, dtype=np.float32).ravel() for _, _, c in matches])
+    return PoseResult(params, K, np.concatenate(kp_refs), np.concatenate(kp_tgts), conf,
+                      inliers, (Iw, Ih), timings,
+                      refs=[(name, len(kp)) for name, kp in zip(names, kp_refs)])
@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Indice di retrieval per scegliere automaticamente le immagini di
+riferimento di un progetto.
+
+Indicizzazione (offline, una volta per progetto):
+
+    python retrieval_index.py build --images project/images \\
+        --vis visibility.txt --out project/retrieval
+
+Ricerca:
+
+    python retrieval_index.py query --index project/retrieval target.jpg -k 5
+
+Ogni immagine del progetto è descritta da un vettore globale (feature
+DINOv2 del backbone di OmniGlue, vedi omniglue_matcher.global_descriptor),
+compresso con PCA e salvato in float16. Sopra ~4000 immagini i vettori
+sono raggruppati in liste invertite (k-means sferico): la ricerca
+confronta il descrittore con i centroidi e legge solo le `nprobe` liste
+più vicine, in memory-map.
+
+Contenuto della cartella:
+    vectors.f16    descrittori (N, dim) ordinati per lista
+    lists.npz      centroidi e offset delle liste, media e base PCA
+    meta.json      versione, nomi delle immagini, cartella, parametri
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import numpy as np
+
+INDEX_VERSION = 1
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG')
+
+# sotto questa dimensione la ricerca esaustiva è già di pochi ms
+IVF_MIN_SIZE = 4096
+
+
+def _normalize(X):
+    return X / (np.linalg.norm(X, axis=-1, keepdims=True) + 1e-12)
+
+
+def _kmeans(X, k, iters=20, seed=0):
+    """K-means sferico (similarità coseno) su vettori normalizzati."""
+    rng = np.random.default_rng(seed)
+    C = X[rng.choice(X.shape[0], k, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(X @ C.T, axis=1)
+        sums = np.zeros_like(C)
+        np.add.at(sums, assign, X)
+        empty = ~sums.any(axis=1)
+        sums[empty] = X[rng.choice(X.shape[0], int(empty.sum()), replace=False)]
+        C = _normalize(sums)
+    return C, np.argmax(X @ C.T, axis=1)
+
+
+def build_index(out_dir, names, descriptors, images_dir=None, dim=256, nlist=None,
+                descriptor="OmniGlue.DINOv2"):
+    """
+    Scrive l'indice in `out_dir` a partire dai descrittori (N, C).
+
+    dim : dimensione dopo la PCA (nessuna PCA se >= C o >= N)
+    nlist : numero di liste invertite (default: 4·sqrt(N) oltre
+            IVF_MIN_SIZE immagini, altrimenti 1 = ricerca esaustiva)
+    """
+    X = _normalize(np.asarray(descriptors, dtype=np.float32))
+    N, C = X.shape
+    if N == 0:
+        raise ValueError("Nessun descrittore da indicizzare")
+
+    mean = np.zeros(C, dtype=np.float32)
+    basis = np.eye(C, dtype=np.float32)
+    if dim < C and dim < N:
+        mean = X.mean(axis=0)
+        _, _, Vt = np.linalg.svd(X - mean, full_matrices=False)
+        basis = Vt[:dim].T.astype(np.float32)
+    V = _normalize((X - mean) @ basis)
+
+    if nlist is None:
+        nlist = int(4 * np.sqrt(N)) if N >= IVF_MIN_SIZE else 1
+    nlist = max(1, min(nlist, N))
+    if nlist > 1:
+        centroids, assign = _kmeans(V, nlist)
+    else:
+        centroids, assign = V.mean(axis=0, keepdims=True), np.zeros(N, dtype=np.int64)
+    order = np.argsort(assign, kind='stable')
+    offsets = np.zeros(nlist + 1, dtype=np.int64)
+    np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+
+    os.makedirs(out_dir, exist_ok=True)
+    V[order].astype(np.float16).tofile(os.path.join(out_dir, 'vectors.f16'))
+    np.savez(os.path.join(out_dir, 'lists.npz'), centroids=centroids.astype(np.float32),
+             offsets=offsets, mean=mean, basis=basis)
+    with open(os.path.join(out_dir, 'meta.json'), 'w') as jf:
+        json.dump({'version': INDEX_VERSION, 'descriptor': descriptor,
+                   'images_dir': os.path.abspath(images_dir) if images_dir else None,
+                   'dim': int(V.shape[1]), 'nlist': nlist,
+                   'names': [names[i] for i in order]}, jf)
+    return out_dir
+
+
+class RetrievalIndex:
+    """Indice su disco aperto in memory-map; vedi build_index."""
+    def __init__(self, directory: str):
+        with open(os.path.join(directory, 'meta.json'), 'r') as jf:
+            meta = json.load(jf)
+        if meta.get('version') != INDEX_VERSION:
+            raise ValueError(f"Versione dell'indice non supportata: {directory}")
+        self.directory = directory
+        self.meta = meta
+        self.names = meta['names']
+        self.images_dir = meta.get('images_dir')
+        lists = np.load(os.path.join(directory, 'lists.npz'))
+        self.centroids = lists['centroids']
+        self.offsets = lists['offsets']
+        self.mean = lists['mean']
+        self.basis = lists['basis']
+        self.vectors = np.memmap(os.path.join(directory, 'vectors.f16'), dtype=np.float16,
+                                 mode='r', shape=(len(self.names), meta['dim']))
+
+    def __len__(self):
+        return len(self.names)
+
+    def project(self, descriptor) -> np.ndarray:
+        """Descrittore globale → spazio dell'indice (PCA + L2)."""
+        d = _normalize(np.asarray(descriptor, dtype=np.float32))
+        return _normalize((d - self.mean) @ self.basis)
+
+    def search(self, descriptor, k=5, nprobe=8):
+        """
+        Le `k` immagini più simili: lista di (nome, similarità coseno),
+        in ordine decrescente. Con le liste invertite vengono lette solo
+        le `nprobe` liste più vicine al descrittore.
+        """
+        q = self.project(descriptor)
+        lists = np.argsort(-(self.centroids @ q))[:nprobe]
+        rows = np.concatenate([np.arange(self.offsets[l], self.offsets[l + 1]) for l in lists])
+        if rows.size == 0:
+            return []
+        scores = np.asarray(self.vectors[rows], dtype=np.float32) @ q
+        k = min(k, rows.size)
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.names[rows[i]], float(scores[i])) for i in top]
+
+    def search_image(self, image, k=5, nprobe=8, describe=None, max_width=800):
+        """
+        Come search, partendo da un'immagine (percorso o array RGB).
+        Ritorna (percorso o nome, similarità): il percorso se l'indice
+        conosce la cartella delle immagini.
+        """
+        desc = describe_image(image, describe, max_width)
+        hits = self.search(desc, k, nprobe)
+        if self.images_dir:
+            hits = [(os.path.join(self.images_dir, n), s) for n, s in hits]
+        return hits
+
+
+def _default_describe():
+    import omniglue_matcher   # import pesante: solo quando serve
+    return omniglue_matcher.global_descriptor
+
+
+def describe_image(image, describe=None, max_width=800):
+    """Descrittore globale di un'immagine (percorso o array RGB)."""
+    import pose_pipeline
+    image = pose_pipeline.load_image(image, max_width)[0]
+    return (describe or _default_describe())(image)
+
+
+def index_images(images_dir, out_dir, cameras=None, describe=None, max_width=800,
+                 dim=256, nlist=None):
+    """
+    Calcola i descrittori delle immagini di `images_dir` (solo quelle in
+    `cameras`, se indicato) e scrive l'indice in `out_dir`.
+    """
+    names = sorted(f for f in os.listdir(images_dir) if f.endswith(IMAGE_EXTS))
+    if cameras is not None:
+        cameras = set(cameras)
+        names = [n for n in names if n in cameras]
+    describe = describe or _default_describe()
+    descs = []
+    t0 = time.perf_counter()
+    for i, name in enumerate(names):
+        descs.append(describe_image(os.path.join(images_dir, name), describe, max_width))
+        if (i + 1) % 100 == 0:
+            print(f"[Retrieval] {i + 1}/{len(names)} immagini ({time.perf_counter() - t0:.0f}s)")
+    return build_index(out_dir, names, np.stack(descs) if descs else np.zeros((0, 1)),
+                       images_dir=images_dir, dim=dim, nlist=nlist)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Indice di retrieval delle immagini di riferimento")
+    sub = parser.add_subparsers(dest='cmd', required=True)
+    b = sub.add_parser('build', help="indicizza le immagini di un progetto")
+    b.add_argument('--images', required=True, help="cartella delle immagini del progetto")
+    b.add_argument('--vis', default=None, help="indicizza solo le camere del file di visibilità")
+    b.add_argument('--out', required=True, help="cartella dell'indice")
+    b.add_argument('--dim', type=int, default=256)
+    b.add_argument('--nlist', type=int, default=None)
+    q = sub.add_parser('query', help="immagini di riferimento più simili a un target")
+    q.add_argument('--index', required=True)
+    q.add_argument('target')
+    q.add_argument('-k', type=int, default=5)
+    q.add_argument('--nprobe', type=int, default=8)
+    args = parser.parse_args()
+
+    if args.cmd == 'build':
+        cameras = None
+        if args.vis:
+            sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "matching_and_pose"))
+            import visibility_store
+            cameras = visibility_store.open_store(args.vis).cameras
+        out = index_images(args.images, args.out, cameras, dim=args.dim, nlist=args.nlist)
+        print(f"[Retrieval] Indice scritto in {out}")
+    else:
+        index = RetrievalIndex(args.index)
+        desc = describe_image(args.target)
+        t = time.perf_counter()
+        hits = index.search(desc, args.k, args.nprobe)
+        print(f"[Retrieval] ricerca su {len(index)} immagini: {(time.perf_counter() - t) * 1000:.1f} ms")
+        for name, score in hits:
+            print(f"{score:.3f}  {name}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,340 @@
+#!/usr/bin/env python3
+"""
+Pose per ogni frame di un video (o di una sequenza di immagini).
+
+    python sequence_tracker.py --ply cloud.ply --vis visibility.txt \\
+        --ref ref.jpg --video walk.mp4 --focal-px 1450 --stream
+
+Matching completo + pose estimation solo sui keyframe. Tra un keyframe
+e l'altro le corrispondenze 2D→3D inlier vengono inseguite frame per
+frame con optical flow piramidale (Lucas-Kanade, con controllo
+avanti-indietro) e la posa viene ristimata sull'insieme inseguito.
+Quando le tracce sono troppo poche o la riproiezione peggiora si
+ritorna al matching completo (ri-localizzazione).
+
+Ogni posa viene restituita appena calcolata (generatore) e, con
+--stream, pubblicata sul server di broadcast (socket_server).
+"""
+import os
+import sys
+import glob
+import json
+import time
+import argparse
+import numpy as np
+import cv2
+from PIL import Image
+
+import matcher_registry
+import pose_pipeline
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "matching_and_pose"))
+import getInternals
+import image_io
+import project
+import ransac
+from proj import proj_batch
+from solve_pose import associate, unity_params
+from socket_server import PoseBroadcastServer, publish_pose
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.JPG', '.JPEG', '.PNG')
+
+
+class FramePose:
+    """
+    Risultato di SequenceTracker.process per un frame.
+
+    index : indice del frame nella sequenza
+    keyframe : True se la posa viene dal matching completo
+    params : dict dei parametri (come camera_parameters.json), None se persa
+    tracks : corrispondenze 2D→3D usate per la posa
+    rms_px : errore RMS di riproiezione sulle tracce (pixel)
+    timings : secondi per fase
+    """
+    def __init__(self, index, keyframe, params, tracks, rms_px, timings):
+        self.index = index
+        self.keyframe = keyframe
+        self.params = params
+        self.tracks = tracks
+        self.rms_px = rms_px
+        self.timings = timings
+
+    @property
+    def ok(self) -> bool:
+        return self.params is not None
+
+    def to_dict(self) -> dict:
+        return {'frame': self.index, 'ok': self.ok, 'keyframe': self.keyframe,
+                'tracks': self.tracks, 'rms_px': self.rms_px,
+                'params': self.params, 'timings': self.timings}
+
+
+class SequenceTracker:
+    """
+    Tracker di posa per una sequenza di frame della stessa camera.
+
+    Parametri
+    ----------
+    proj : project.ZephyrProject o (ply_file, visibility_file)
+    ref_image : str
+        Immagine di riferimento (una camera del progetto).
+    K : np.ndarray (3,3)
+        Intrinseci della camera che ha ripreso la sequenza.
+    matcher : str o callable
+        Backend di matcher_registry usato sui keyframe.
+    ref_name : str, opzionale
+        Nome della camera di riferimento (default: basename di ref_image).
+    max_width : int
+        Larghezza massima delle immagini passate al matcher.
+    min_tracks : int
+        Sotto questo numero di tracce si ri-localizza.
+    max_rms_px : float
+        Sopra questo errore RMS di riproiezione si ri-localizza.
+    min_inlier_ratio : float
+        Frazione minima di tracce coerenti con la nuova posa.
+    keyframe_interval : int
+        Se > 0, forza un keyframe ogni `keyframe_interval` frame.
+    """
+    def __init__(self, proj, ref_image, K, matcher="LightGlue", ref_name=None,
+                 max_width=800, max_dist=3.0, min_tracks=30, max_rms_px=3.0,
+                 min_inlier_ratio=0.6, keyframe_interval=0,
+                 flow_win=21, flow_levels=3, fb_threshold=1.0, track_iter=100):
+        if not isinstance(proj, project.ZephyrProject):
+            proj = project.ZephyrProject(*proj)
+        self.project = proj
+        self.view = proj.camera(ref_name or os.path.basename(ref_image))
+        self.K = np.asarray(K, dtype=float)
+        self.run_matcher = matcher_registry.backend(matcher) if isinstance(matcher, str) else matcher
+        self.ref_small, self.ref_scale, _ = image_io.load_rgb(ref_image, max_width)
+        self.max_width = max_width
+        self.max_dist = max_dist
+        self.min_tracks = min_tracks
+        self.max_rms_px = max_rms_px
+        self.min_inlier_ratio = min_inlier_ratio
+        self.keyframe_interval = keyframe_interval
+        self.fb_threshold = fb_threshold
+        self.track_iter = track_iter
+        self.lk_params = dict(winSize=(flow_win, flow_win), maxLevel=flow_levels,
+                              criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 30, 0.01))
+        self.reset()
+
+    def reset(self):
+        """Dimentica le tracce: il prossimo frame sarà un keyframe."""
+        self._prev = None        # frame precedente in scala di grigi
+        self._p3D = None         # (M,3) punti 3D inseguiti
+        self._p2D = None         # (M,2) loro posizione nel frame precedente
+        self._since_key = 0
+        self.index = 0
+
+    def _rms(self, G, p3D, p2D):
+        x, y, _ = proj_batch(self.K @ G, p3D)
+        return float(np.sqrt(np.mean((x[0] - p2D[:, 0]) ** 2 + (y[0] - p2D[:, 1]) ** 2)))
+
+    def _keyframe(self, frame, timings):
+        """Matching completo con il riferimento e pose estimation."""
+        t = time.perf_counter()
+        tgt_small, scale = pose_pipeline.resize_image(frame, self.max_width)
+        kp0, kp1, _, _ = self.run_matcher(self.ref_small, tgt_small)
+        kp_ref = np.asarray(kp0, dtype=np.float32).reshape(-1, 2) / self.ref_scale
+        kp_tgt = np.asarray(kp1, dtype=np.float32).reshape(-1, 2) / scale
+        timings['matching'] = time.perf_counter() - t
+
+        t = time.perf_counter()
+        p3D, p2D = associate(self.view, kp_ref, kp_tgt, self.max_dist)
+        G, s, inliers = ransac.ransac_fiore(self.K, p3D.T, p2D.T)
+        timings['pose'] = time.perf_counter() - t
+        return G, s, p3D[inliers], p2D[inliers]
+
+    def _track(self, gray, timings):
+        """Insegue le tracce dal frame precedente e ristima la posa."""
+        t = time.perf_counter()
+        p0 = self._p2D.reshape(-1, 1, 2).astype(np.float32)
+        p1, st, _ = cv2.calcOpticalFlowPyrLK(self._prev, gray, p0, None, **self.lk_params)
+        p0r, st_b, _ = cv2.calcOpticalFlowPyrLK(gray, self._prev, p1, None, **self.lk_params)
+        p1 = p1.reshape(-1, 2)
+        fb = np.linalg.norm(p0.reshape(-1, 2) - p0r.reshape(-1, 2), axis=1)
+        h, w = gray.shape
+        ok = ((st.ravel() == 1) & (st_b.ravel() == 1) & (fb < self.fb_threshold)
+              & (p1[:, 0] >= 0) & (p1[:, 0] < w) & (p1[:, 1] >= 0) & (p1[:, 1] < h))
+        timings['flow'] = time.perf_counter() - t
+
+        p3D, p2D = self._p3D[ok], p1[ok]
+        if len(p2D) < self.min_tracks:
+            return None
+
+        t = time.perf_counter()
+        # le tracce sono quasi tutte inlier: basta Fiore con rimozione
+        # iterativa degli outlier; RANSAC breve solo se non basta
+        threshold = 2 * self.max_rms_px
+        G, s, inliers = ransac.refine_fiore(self.K, p3D.T, p2D.T, threshold)
+        if inliers.sum() < self.min_inlier_ratio * len(p2D):
+            G, s, inliers = ransac.ransac_fiore(self.K, p3D.T, p2D.T, threshold,
+                                                max_iter=self.track_iter, seed=self.index)
+        timings['pose'] = time.perf_counter() - t
+        if inliers.sum() < max(self.min_tracks, self.min_inlier_ratio * len(p2D)):
+            return None
+        return G, s, p3D[inliers], p2D[inliers]
+
+    def process(self, frame) -> FramePose:
+        """
+        Stima la posa di un frame (np.ndarray HxWx3 RGB, uint8).
+
+        I frame vanno passati in ordine; il primo, e ogni frame in cui il
+        tracking non è affidabile, passa dal matching completo.
+        """
+        t0 = time.perf_counter()
+        timings = {}
+        gray = cv2.cvtColor(frame, cv2.COLOR_RGB2GRAY)
+        Ih, Iw = gray.shape
+        index = self.index
+        self.index += 1
+
+        fit = None
+        keyframe = (self._p3D is None
+                    or (self.keyframe_interval > 0 and self._since_key >= self.keyframe_interval))
+        if not keyframe:
+            try:
+                fit = self._track(gray, timings)
+            except ValueError:
+                fit = None
+            if fit is not None:
+                rms = self._rms(fit[0], fit[2], fit[3])
+                if rms > self.max_rms_px:
+                    fit = None
+            keyframe = fit is None
+
+        if keyframe:
+            try:
+                fit = self._keyframe(frame, timings)
+            except ValueError as e:     # pochi match o nessuna ipotesi valida
+                print(f"[Tracker] frame {index}: ri-localizzazione non riuscita ({e})")
+                fit = None
+            if fit is not None and len(fit[2]) < self.min_tracks:
+                print(f"[Tracker] frame {index}: solo {len(fit[2])} inlier, posa scartata")
+                fit = None
+            self._since_key = 0
+        else:
+            self._since_key += 1
+
+        self._prev = gray
+        if fit is None:
+            self._p3D = self._p2D = None
+            timings['total'] = time.perf_counter() - t0
+            return FramePose(index, keyframe, None, 0, None, timings)
+
+        G, s, self._p3D, self._p2D = fit
+        rms = self._rms(G, self._p3D, self._p2D)
+        params = unity_params(self.K, G, s, Iw, Ih)
+        timings['total'] = time.perf_counter() - t0
+        return FramePose(index, keyframe, params, len(self._p3D), rms, timings)
+
+    def run(self, frames):
+        """Generatore: una FramePose per ogni frame, appena calcolata."""
+        for frame in frames:
+            yield self.process(frame)
+
+
+def iter_frames(source):
+    """Frame RGB da un file video, una cartella di immagini o un pattern glob."""
+    if os.path.isdir(source) or any(c in source for c in '*?['):
+        for path in list_images(source):
+            yield np.array(Image.open(path).convert('RGB'))
+        return
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise ValueError(f"Impossibile aprire il video: {source}")
+    try:
+        while True:
+            ok, bgr = cap.read()
+            if not ok:
+                break
+            yield cv2.cvtColor(bgr, cv2.COLOR_BGR2RGB)
+    finally:
+        cap.release()
+
+
+def list_images(spec):
+    if os.path.isdir(spec):
+        return sorted(os.path.join(spec, f) for f in os.listdir(spec) if f.endswith(IMAGE_EXTS))
+    return sorted(glob.glob(spec))
+
+
+def camera_matrix(focal_px, width, height):
+    """K con punto principale al centro dell'immagine."""
+    return np.array([[focal_px, 0, width / 2.0],
+                     [0, focal_px, height / 2.0],
+                     [0, 0, 1]], dtype=float)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pose per frame di un video con tracking tra keyframe")
+    parser.add_argument('--ply', required=True, help="point cloud .ply di Zephyr")
+    parser.add_argument('--vis', required=True, help="file di visibilità di Zephyr")
+    parser.add_argument('--ref', required=True, help="immagine di riferimento")
+    parser.add_argument('--video', required=True, help="file video, cartella o pattern glob di frame")
+    parser.add_argument('--matcher', default='LightGlue', help="OmniGlue, LiftFeat o LightGlue")
+    parser.add_argument('--focal-px', type=float, default=None,
+                        help="focale in pixel dei frame (default: EXIF del primo frame)")
+    parser.add_argument('--max-width', type=int, default=800)
+    parser.add_argument('--min-tracks', type=int, default=30)
+    parser.add_argument('--max-rms-px', type=float, default=3.0)
+    parser.add_argument('--keyframe-interval', type=int, default=0,
+                        help="forza un keyframe ogni N frame (0 = solo quando serve)")
+    parser.add_argument('--out', default=os.path.join('output', 'sequence.jsonl'))
+    parser.add_argument('--stream', action='store_true',
+                        help="pubblica ogni posa sul server di broadcast")
+    parser.add_argument('--unity-port', type=int, default=5005)
+    args = parser.parse_args()
+
+    frames = iter_frames(args.video)
+    first = next(frames, None)
+    if first is None:
+        raise ValueError(f"Nessun frame in {args.video}")
+    if args.focal_px is not None:
+        K = camera_matrix(args.focal_px, first.shape[1], first.shape[0])
+    else:
+        images = list_images(args.video)
+        if not images:
+            raise ValueError("--focal-px è obbligatorio per i file video")
+        K = getInternals.get_internals(images[0])
+
+    broadcast = None
+    if args.stream:
+        try:
+            broadcast = PoseBroadcastServer(port=args.unity_port).start()
+        except OSError:
+            print(f"[Tracker] Porta {args.unity_port} occupata: uso il server di broadcast esistente")
+
+    tracker = SequenceTracker((args.ply, args.vis), args.ref, K, matcher=args.matcher,
+                              max_width=args.max_width, min_tracks=args.min_tracks,
+                              max_rms_px=args.max_rms_px,
+                              keyframe_interval=args.keyframe_interval)
+    os.makedirs(os.path.dirname(args.out) or '.', exist_ok=True)
+    t0 = time.perf_counter()
+    n = n_key = n_ok = 0
+    with open(args.out, 'w') as out:
+        for res in tracker.run(_chain(first, frames)):
+            n += 1
+            n_key += res.keyframe
+            n_ok += res.ok
+            out.write(json.dumps(res.to_dict()) + '\n')
+            if res.ok and args.stream:
+                msg = dict(res.params, frame=res.index)
+                if broadcast is not None:
+                    broadcast.publish(msg)
+                else:
+                    publish_pose(msg, port=args.unity_port)
+    elapsed = time.perf_counter() - t0
+    print(f"[Tracker] {n} frame ({n_key} keyframe, {n_ok} con posa) "
+          f"in {elapsed:.1f}s, {n / max(elapsed, 1e-9):.1f} fps → {args.out}")
+    if broadcast is not None:
+        broadcast.stop()
+
+
+def _chain(first, rest):
+    yield first
+    yield from rest
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,44 @@
+"""
+exterior_fiore: la variante 'linear' (ns.ns_diag_lowrank) deve dare la
+stessa posa di 'full' anche con rumore forte e outlier, come richiesto
+da ransac._fit che la usa su campioni e inlier.
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import warnings
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'matching_and_pose'))
+import benchmark
+import exterior_fiore
+import ns
+
+
+@pytest.mark.parametrize('noise, outliers', [(0.5, 0.0), (30.0, 0.0), (1.0, 0.2), (1.0, 0.4), (30.0, 0.4)])
+@pytest.mark.parametrize('seed', range(3))
+def test_linear_matches_full(noise, outliers, seed):
+    s = benchmark.make_scene(300, seed, noise=noise, outliers=outliers)
+    m3d, m2d = s['X'].T, s['uv_outliers'].T
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')      # ns: condition number
+        G_full, s_full = exterior_fiore.exterior_fiore(s['K'], m3d, m2d, method='full')
+        G_lin, s_lin = exterior_fiore.exterior_fiore(s['K'], m3d, m2d, method='linear')
+    np.testing.assert_allclose(G_lin, G_full, rtol=0, atol=1e-9)
+    assert abs(s_lin - s_full) <= 1e-9 * abs(s_full)
+
+
+@pytest.mark.parametrize('seed', range(20))
+def test_ns_diag_lowrank_matches_eigh(seed):
+    rng = np.random.default_rng(seed)
+    n, k = 60, int(rng.integers(1, 13))
+    C = rng.normal(size=(n, k))
+    d = rng.uniform(0.1, 2.0, n)
+    # autovalore minimo di diag(d) - C C^T portato a un valore piccolo > 0
+    d += rng.uniform(0, 0.05) - np.linalg.eigvalsh(np.diag(d) - C @ C.T)[0]
+    A = np.diag(d) - C @ C.T
+    w = np.linalg.eigh(A)[1][:, 0]
+    v = ns.ns_diag_lowrank(d, C)
+    assert np.linalg.norm(v - np.sign(v @ w) * w) < 1e-8
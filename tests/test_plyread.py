@@ -0,0 +1,49 @@
+"""
+plyread_chunks deve restituire gli stessi vertici e triangoli di
+plyread(..., 'tri'), anche quando le facce hanno più liste (mesh
+texturizzate con vertex_indices e texcoord).
+
+    python -m pytest tests/
+"""
+import os
+import sys
+import numpy as np
+import pytest
+from plyfile import PlyData, PlyElement
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'matching_and_pose'))
+import plyread
+
+
+def _write_mesh(path, textured, n=50, seed=0):
+    rng = np.random.default_rng(seed)
+    vert = np.zeros(n, dtype=[('x', 'f4'), ('y', 'f4'), ('z', 'f4')])
+    for c in ('x', 'y', 'z'):
+        vert[c] = rng.standard_normal(n)
+    sizes = rng.integers(3, 6, 40)
+    fields = [('vertex_indices', 'O')]
+    if textured:
+        fields.append(('texcoord', 'O'))
+    face = np.empty(len(sizes), dtype=fields)
+    face['vertex_indices'] = [rng.integers(0, n, k).astype(np.int32) for k in sizes]
+    if textured:
+        face['texcoord'] = [rng.random(2 * k).astype(np.float32) for k in sizes]
+    PlyData([PlyElement.describe(vert, 'vertex'), PlyElement.describe(face, 'face')],
+            text=False).write(path)
+
+
+@pytest.mark.parametrize('textured', [False, True])
+@pytest.mark.parametrize('chunk_size', [7, 1 << 20])
+def test_chunks_match_plyread(tmp_path, textured, chunk_size):
+    path = str(tmp_path / 'mesh.ply')
+    _write_mesh(path, textured)
+    tri, pts, _, _ = plyread.plyread(path, 'tri')
+
+    parts = {'vertex': [], 'tri': []}
+    for kind, block in plyread.plyread_chunks(path, chunk_size):
+        if kind == 'vertex':
+            assert len(block) <= chunk_size
+        parts[kind].append(block)
+    np.testing.assert_array_equal(np.concatenate(parts['vertex']), pts)
+    assert parts['tri'], "facce perse"
+    np.testing.assert_array_equal(np.concatenate(parts['tri']), tri)